@@ -0,0 +1,242 @@
+# -*- coding: UTF-8 -*-
+"""Catch-up after downtime: the bot polls a local stub Bot API that holds a backlog of pending updates.
+
+The first run starts from an empty offset and works through /start, registration and task requests of every
+participant; the second run is a restart that must resume from the offset saved in bot_meta and work through a
+backlog of tracker updates. Both runs check that every update was handled exactly once, then report the catch-up
+time. The third run holds the handler of the very first pending update until every update that does not share its
+queue is handled, so fetching must not wait for the oldest update in flight; the bot then crashes with everything
+acknowledged to Telegram, and the restart must finish the held update and the rest from the inbox in the database.
+Exits with status 1 if a check fails.
+
+    python benchmarks/bench_catchup.py [--participants 2000] [--workers 8]
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+from loadtest import make_event, phase_updates, update
+
+import polling  # noqa: E402  (bot/ is on sys.path via synthetic)
+from markups import Buttons  # noqa: E402
+
+TOKEN = '123456:' + 'A' * 35
+
+
+class StubBotAPI:
+    """Just enough of the Bot API for polling: getUpdates with offset confirmation, sendMessage, deleteWebhook"""
+
+    def __init__(self):
+        self.pending = []
+        self.offsets = []
+        self.sent = collections.Counter()
+        self.next_id = 1
+        self._arrived = asyncio.Event()
+
+    def add(self, user_id, text):
+        self.pending.append(update(self.next_id, user_id, text))
+        self.next_id += 1
+        self._arrived.set()
+
+    async def handle(self, request):
+        data = dict(await request.post())
+        method = request.match_info['method']
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self.get_updates(data)})
+        if method == 'sendMessage':
+            self.sent[int(data['chat_id'])] += 1
+            return web.json_response({'ok': True, 'result': {
+                'message_id': 1, 'date': 0, 'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                'text': data.get('text')}})
+        return web.json_response({'ok': True, 'result': True})
+
+    async def get_updates(self, data):
+        offset = int(data['offset']) if 'offset' in data else None
+        self.offsets.append(offset)
+        if offset is not None:
+            # like Telegram: everything below the offset is confirmed and forgotten
+            self.pending = [item for item in self.pending if item['update_id'] >= offset]
+        if not self.pending and int(data.get('timeout', 0)):
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), int(data['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:int(data.get('limit', 100))]
+
+
+async def catch_up(main, api, workers):
+    poller = polling.Poller(main.dp, main.db, workers=workers, queue_size=4000)
+    task = asyncio.create_task(poller.run())
+    await poller.caught_up.wait()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await poller.close()
+    return poller
+
+
+async def replay(main, participants, workers):
+    api = StubBotAPI()
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    main.bot.server = TelegramAPIServer.from_base(f'http://{host}:{port}')
+    unlimited = float('inf')
+    main.sender._global.rate = main.sender._global.capacity = main.sender._global.tokens = unlimited
+    main.sender.chat_rate = main.sender.chat_burst = unlimited
+
+    failures = []
+    # sendMessage calls per user: /start, registration prompt and result, task; then tracker prompt and result
+    # plus the notification each user gets as the receiver of somebody's parcel
+    runs = (('first start', ('start_storm', 'registration', 'task_fetch'), 4),
+            ('restart', ('tracker_set',), 3))
+    for name, phases, sends in runs:
+        updates = [item for phase in phases for item in phase_updates(phase, participants, Buttons)]
+        for user_id, text in updates:
+            api.add(user_id, text)
+        last_id = api.pending[-1]['update_id']
+        saved = await polling.Poller(main.dp, main.db).load_offset()
+        api.offsets.clear()
+        api.sent.clear()
+        poller = await catch_up(main, api, workers)
+        await main.sender.join()
+        print(f'{name}: {poller.catch_up_updates} pending updates caught up in {poller.catch_up_seconds:.2f} s '
+              f'({poller.catch_up_updates / poller.catch_up_seconds:.0f} updates/s)')
+        if api.offsets[0] != (saved + 1 if saved is not None else None):
+            failures.append(f'{name}: first getUpdates offset {api.offsets[0]}, saved offset {saved}')
+        stored = await polling.Poller(main.dp, main.db).load_offset()
+        if (poller.offset.processed, stored) != (last_id, last_id):
+            failures.append(f'{name}: processed {poller.offset.processed}, saved {stored}, last update {last_id}')
+        if poller.catch_up_updates != len(updates):
+            failures.append(f'{name}: {poller.catch_up_updates} of {len(updates)} updates caught up')
+        wrong = [user_id for user_id in range(1, participants + 1) if api.sent[user_id] != sends]
+        if wrong:
+            failures.append(f'{name}: {len(wrong)} users got other than {sends} messages, e.g. user {wrong[0]} '
+                            f'got {api.sent[wrong[0]]}')
+    failures += await slow_update(main, api, participants, workers)
+    await runner.cleanup()
+    return failures
+
+
+async def slow_update(main, api, participants, workers):
+    """Third run: a held handler must not stop fetching, and a crash must not lose acknowledged updates"""
+    failures = []
+    release = asyncio.Event()
+    load_context = main.router.load_context
+
+    async def held_load_context(user_id):
+        if user_id == 1:
+            await release.wait()
+        return await load_context(user_id)
+
+    main.router.load_context = held_load_context
+    for user_id, text in phase_updates('tracker_get', participants, Buttons):
+        api.add(user_id, text)
+    last_id = api.pending[-1]['update_id']
+    api.sent.clear()
+    # the shard of user 1 waits behind the held update; every other user is answered while it is held
+    others = {user_id for user_id in range(1, participants + 1) if user_id % workers != 1 % workers}
+    poller = polling.Poller(main.dp, main.db, workers=workers, queue_size=4000)
+    task = asyncio.create_task(poller.run())
+    started = asyncio.get_running_loop().time()
+    while not others <= set(api.sent) and asyncio.get_running_loop().time() - started < 60:
+        await asyncio.sleep(0.05)
+    held = asyncio.get_running_loop().time() - started
+    answered = len(others & set(api.sent))
+    print(f'held update: {answered} of {len(others)} users on other queues answered in {held:.2f} s, '
+          f'{len(api.pending)} updates left unacknowledged')
+    if answered != len(others) or api.pending:
+        failures.append(f'held update: {answered} of {len(others)} other users answered, '
+                        f'{len(api.pending)} updates unacknowledged')
+
+    # the poller forgets handled updates in the inbox every save_interval seconds
+    await asyncio.sleep(poller.save_interval + 0.5)
+
+    # crash: the poller and its workers stop without finishing the updates or saving the boundary
+    for running in [task, poller._saver] + poller.updates._tasks:
+        running.cancel()
+    await asyncio.gather(task, poller._saver, *poller.updates._tasks, return_exceptions=True)
+    release.set()
+    unanswered_before = [user_id for user_id in range(1, participants + 1) if not api.sent[user_id]]
+    restarted = await catch_up(main, api, workers)
+    await main.sender.join()
+    print(f'crash: {restarted.catch_up_updates} updates left in the inbox caught up after the restart')
+    stored = await polling.Poller(main.dp, main.db).load_offset()
+    unanswered = [user_id for user_id in range(1, participants + 1) if not api.sent[user_id]]
+    if unanswered or api.sent[1] != 1 or (restarted.offset.processed, stored) != (last_id, last_id):
+        failures.append(f'crash: {len(unanswered)} users unanswered, user 1 answered {api.sent[1]} times, '
+                        f'processed {restarted.offset.processed}, saved {stored}, last update {last_id}')
+    # only the updates that had not been handled before the crash come back from the inbox
+    if restarted.catch_up_updates != len(unanswered_before):
+        failures.append(f'crash: {restarted.catch_up_updates} updates replayed, {len(unanswered_before)} were '
+                        f'unanswered before the crash')
+    inbox, = (await main.db.fetchall('SELECT COUNT(*) FROM `update_inbox`'))[0]
+    if inbox:
+        failures.append(f'crash: {inbox} updates left in the inbox after catching up')
+    main.router.load_context = load_context
+    return failures
+
+
+def check_database(participants):
+    connection = sqlite3.connect('data/database.db')
+    registered, tracked = connection.execute(
+        "SELECT SUM(`signup` = 'complete'), SUM(`track_number` != 'notimplemented') FROM `users`").fetchone()
+    connection.close()
+    if (registered, tracked) != (participants, participants):
+        return [f'{registered} users registered and {tracked} trackers saved, expected {participants}']
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rudolf-catchup-')
+    cwd = os.getcwd()
+    try:
+        make_event(workdir, args.participants)
+        os.environ.setdefault('TOKEN', TOKEN)
+        # a restart after a crash starts without the answers remembered for debouncing
+        os.environ['DEBOUNCE_SECONDS'] = '0'
+        os.chdir(workdir)
+        import main as bot_main
+        logging.getLogger().setLevel(logging.WARNING)
+
+        async def run():
+            try:
+                return await replay(bot_main, args.participants, args.workers)
+            finally:
+                await bot_main.on_shutdown(bot_main.dp)
+                await bot_main.dp.storage.close()
+                await (await bot_main.bot.get_session()).close()
+
+        failures = asyncio.run(run())
+        failures += check_database(args.participants)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Every pending update was handled exactly once')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+"""Throughput of bot/cluster.py against the number of worker processes, on the load-test phases.
+
+Every run gets a fresh synthetic event and replays the phases of loadtest.py through a Cluster whose workers use
+a stub Bot. Read-heavy phases should scale with the number of cores; write-heavy ones are bounded by the single
+writer process.
+
+    python benchmarks/bench_cluster.py [--participants 2000] [--workers 1 2 4]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from loadtest import PHASES, StubBot, make_event, phase_updates, update
+
+import cluster  # noqa: E402  (bot/ is on sys.path via synthetic)
+from markups import Buttons  # noqa: E402
+
+
+def stub_telegram(main):
+    """Runs in each worker before it starts: Telegram is replaced by StubBot, rate limits are lifted"""
+    main.bot.request = StubBot().request
+    unlimited = float('inf')
+    main.sender._global.rate = main.sender._global.capacity = main.sender._global.tokens = unlimited
+    main.sender.chat_rate = main.sender.chat_burst = unlimited
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+async def replay(participants, workers):
+    nodes = cluster.Cluster('./data/database.db', workers=workers, queue_size=participants * 2, setup=stub_telegram)
+    nodes.start()
+    ids = itertools.count(1)
+    results = {}
+    for phase in PHASES:
+        updates = [update(next(ids), user_id, text) for user_id, text in phase_updates(phase, participants, Buttons)]
+        started = time.perf_counter()
+        for item in updates:
+            await nodes.put(item)
+        await nodes.join()
+        results[phase] = len(updates) / (time.perf_counter() - started)
+    await nodes.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    os.environ.setdefault('TOKEN', '123456:' + 'A' * 35)
+    cwd = os.getcwd()
+    print(f'{os.cpu_count()} CPUs; updates/s per phase')
+    print(f"{'workers':>7}  " + '  '.join(f'{phase:>12}' for phase in PHASES))
+    for workers in args.workers:
+        workdir = tempfile.mkdtemp(prefix='rudolf-cluster-')
+        try:
+            make_event(workdir, args.participants)
+            os.chdir(workdir)
+            results = asyncio.run(replay(args.participants, workers))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(f'{workers:>7}  ' + '  '.join(f'{results[phase]:>12.0f}' for phase in PHASES))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# -*- coding: UTF-8 -*-
+"""Per-update FSM overhead of SQLiteStorage against aiogram's MemoryStorage.
+
+One simulated update reads the state, enters a state and finishes it again, which is what
+the registration and tracker dialogs do.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from synthetic import make_database
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from fsm_storage import SQLiteStorage
+
+UPDATES = 50000
+USERS = 5000
+
+
+async def run(storage):
+    started = time.perf_counter()
+    for i in range(UPDATES):
+        user = i % USERS
+        await storage.get_state(chat=user, user=user)
+        await storage.set_state(chat=user, user=user, state='Registration:vk_id')
+        await storage.finish(chat=user, user=user)
+    elapsed = time.perf_counter() - started
+    await storage.close()
+    await storage.wait_closed()
+    return elapsed / UPDATES * 1e6
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_database(os.path.join(tmp, 'bench-fsm.db'), 0, registered=False)
+        memory = await run(MemoryStorage())
+        sqlite = await run(SQLiteStorage(path, flush_interval=0.1))
+    print(f'MemoryStorage {memory:6.2f} us/update, SQLiteStorage {sqlite:6.2f} us/update')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
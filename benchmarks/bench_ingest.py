@@ -0,0 +1,253 @@
+# -*- coding: UTF-8 -*-
+"""Update ingestion: webhook (bot/webhook.py) against long polling (bot/polling.py) on the same update stream.
+
+A synthetic event is registered through the bot, then the read-only phases of loadtest.py (task and tracker
+requests) arrive at a fixed rate twice: once POSTed to the webhook route by a client with as many connections as
+start_webhook asks Telegram for, and once published on a local stub Bot API that the Poller long-polls. For each
+path the time from an update's arrival to the end of its handling is reported, with the throughput. Both paths must
+handle every update exactly once and answer every user; exits with status 1 otherwise.
+
+    python benchmarks/bench_ingest.py [--participants 2000] [--workers 8] [--rate 200]
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+from bench_catchup import TOKEN, StubBotAPI
+from loadtest import make_event, phase_updates, update
+
+import polling  # noqa: E402  (bot/ is on sys.path via synthetic)
+import webhook  # noqa: E402
+from update_queue import UpdateQueue  # noqa: E402
+
+SETUP_PHASES = ('start_storm', 'registration', 'tracker_set')
+PHASES = ('task_fetch', 'tracker_get')
+
+
+class Ingestion:
+    """Arrival and handling times of one path's updates"""
+
+    def __init__(self):
+        self.arrived = {}
+        self.latencies = []
+        self.handled = collections.Counter()
+        self.first = self.last = None
+
+    def arrive(self, update_id):
+        self.arrived[update_id] = time.perf_counter()
+        if self.first is None:
+            self.first = self.arrived[update_id]
+
+    def done(self, item):
+        self.last = time.perf_counter()
+        self.handled[item['update_id']] += 1
+        self.latencies.append(self.last - self.arrived[item['update_id']])
+
+    def percentile(self, q):
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1e3
+
+    def report(self, name):
+        seconds = self.last - self.first
+        print(f'{name:<8} {len(self.latencies):>7} {len(self.latencies) / seconds:>9.0f} '
+              f'{self.percentile(0.5):>7.1f} ms {self.percentile(0.99):>7.1f} ms')
+
+    def check(self, name, expected):
+        twice = [update_id for update_id, count in self.handled.items() if count > 1]
+        if set(self.handled) != set(expected) or twice:
+            return [f'{name}: {len(self.handled)} of {len(expected)} updates handled, {len(twice)} more than once']
+        return []
+
+
+async def arrive_at(rate, items, deliver):
+    """Calls deliver(item) for every item, rate items a second"""
+    started = time.perf_counter()
+    for n, item in enumerate(items):
+        delay = started + n / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        deliver(item)
+
+
+async def run_webhook(main, items, workers, rate):
+    ingestion = Ingestion()
+    queue = UpdateQueue(main.dp, workers, len(items) + workers, on_done=ingestion.done)
+    app = webhook.build_app(main.dp, updates=queue)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    url = f'http://{host}:{port}/webhook'
+    # start_webhook asks Telegram for this many connections; Telegram delivers one user's updates in order
+    connector = aiohttp.TCPConnector(limit=min(workers * 4, 100))
+    failures = []
+    async with aiohttp.ClientSession(connector=connector) as session:
+        per_user = collections.defaultdict(asyncio.Queue)
+        posters = []
+
+        async def post_in_order(user_queue):
+            while True:
+                item = await user_queue.get()
+                async with session.post(url, json=item) as response:
+                    if response.status != 200:
+                        failures.append(f'webhook: update {item["update_id"]} answered {response.status}')
+                user_queue.task_done()
+
+        def deliver(item):
+            user_id = item['message']['from']['id']
+            if user_id not in per_user:
+                posters.append(asyncio.create_task(post_in_order(per_user[user_id])))
+            ingestion.arrive(item['update_id'])
+            per_user[user_id].put_nowait(item)
+
+        await arrive_at(rate, items, deliver)
+        await asyncio.gather(*(user_queue.join() for user_queue in per_user.values()))
+        await queue.join()
+        await main.sender.join()
+        for task in posters:
+            task.cancel()
+        await asyncio.gather(*posters, return_exceptions=True)
+    await runner.cleanup()
+    return ingestion, failures
+
+
+async def run_polling(main, api, phases, participants, workers, rate):
+    from markups import Buttons
+
+    ingestion = Ingestion()
+    poller = polling.Poller(main.dp, main.db, workers=workers, queue_size=4000)
+    offset_done = poller.updates.on_done
+
+    def done(item):
+        offset_done(item)
+        ingestion.done(item)
+
+    poller.updates.on_done = done
+    task = asyncio.create_task(poller.run())
+    await poller.caught_up.wait()
+    first_id = api.next_id
+
+    def deliver(user_text):
+        ingestion.arrive(api.next_id)
+        api.add(*user_text)
+
+    await arrive_at(rate, [item for phase in phases for item in phase_updates(phase, participants, Buttons)],
+                    deliver)
+    expected = range(first_id, api.next_id)
+    while len(ingestion.handled) < len(expected):
+        await asyncio.sleep(0.01)
+    await main.sender.join()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await poller.close()
+    return ingestion, expected
+
+
+async def replay(main, participants, workers, rate):
+    from aiogram import Bot, Dispatcher
+    from markups import Buttons
+
+    api = StubBotAPI()
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    main.bot.server = TelegramAPIServer.from_base(f'http://{host}:{port}')
+    unlimited = float('inf')
+    main.sender._global.rate = main.sender._global.capacity = main.sender._global.tokens = unlimited
+    main.sender.chat_rate = main.sender.chat_burst = unlimited
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+
+    # far above the ids the stub API hands out to the polling run
+    ids = itertools.count(10 ** 9)
+    queue = UpdateQueue(main.dp, workers, participants * 2 + workers)
+    queue.start()
+    for phase in SETUP_PHASES:
+        for user_id, text in phase_updates(phase, participants, Buttons):
+            await queue.put(update(next(ids), user_id, text))
+        await queue.join()
+    await queue.close()
+
+    failures = []
+    print(f"{'path':<8} {'updates':>7} {'updates/s':>9} {'p50':>10} {'p99':>10}")
+    items = [update(next(ids), user_id, text) for phase in PHASES
+             for user_id, text in phase_updates(phase, participants, Buttons)]
+    api.sent.clear()
+    ingestion, errors = await run_webhook(main, items, workers, rate)
+    ingestion.report('webhook')
+    failures += errors + ingestion.check('webhook', [item['update_id'] for item in items])
+    failures += check_answers('webhook', api, participants, len(PHASES))
+
+    api.sent.clear()
+    ingestion, expected = await run_polling(main, api, PHASES, participants, workers, rate)
+    ingestion.report('polling')
+    failures += ingestion.check('polling', expected)
+    failures += check_answers('polling', api, participants, len(PHASES))
+    await runner.cleanup()
+    return failures
+
+
+def check_answers(name, api, participants, sends):
+    wrong = [user_id for user_id in range(1, participants + 1) if api.sent[user_id] != sends]
+    if wrong:
+        return [f'{name}: {len(wrong)} users got other than {sends} messages, e.g. user {wrong[0]} '
+                f'got {api.sent[wrong[0]]}']
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=200, help='arriving updates per second')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rudolf-ingest-')
+    cwd = os.getcwd()
+    try:
+        make_event(workdir, args.participants)
+        os.environ.setdefault('TOKEN', TOKEN)
+        # the same users press the same buttons on both paths, none of it may be debounced
+        os.environ['DEBOUNCE_SECONDS'] = '0'
+        os.chdir(workdir)
+        import main as bot_main
+        logging.getLogger().setLevel(logging.WARNING)
+
+        async def run():
+            try:
+                return await replay(bot_main, args.participants, args.workers, args.rate)
+            finally:
+                await bot_main.on_shutdown(bot_main.dp)
+                await bot_main.dp.storage.close()
+                await (await bot_main.bot.get_session()).close()
+
+        failures = asyncio.run(run())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Both paths handled every update exactly once')
+
+
+if __name__ == '__main__':
+    main()
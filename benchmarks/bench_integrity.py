@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+"""Pairing check (bot/integrity.py) on a synthetic event: time on valid pairs, then detection of injected faults.
+
+The event pairs everybody with the next participant, so it is one valid cycle with every participant registered.
+Faults are then written into a copy, each one must be reported exactly. Exits with status 1 if a check fails.
+
+    python benchmarks/bench_integrity.py [--participants 1000000] [--repeat 3]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from synthetic import make_database
+
+import integrity  # noqa: E402  (bot/ is on sys.path via synthetic)
+
+
+def inject_faults(path, participants):
+    """Breaks the pairs in known ways; returns the report fields check_pairs must produce"""
+    connection = sqlite3.connect(path)
+    with connection:
+        # id5 sends to itself, so id6 gets nothing; id10 sends to a VK ID outside the form, so id11 gets nothing;
+        # id20 sends to id3 as id2 does, so id21 gets nothing
+        connection.execute("UPDATE `google_form` SET `sent_to_id` = 'id5' WHERE `vk_id` = 'id5'")
+        connection.execute("UPDATE `google_form` SET `sent_to_id` = 'nobody' WHERE `vk_id` = 'id10'")
+        connection.execute("UPDATE `google_form` SET `sent_to_id` = 'id3' WHERE `vk_id` = 'id20'")
+        connection.executemany("INSERT INTO `users` (`user_id`, `vk_id`) VALUES (?, ?)",
+                               ((participants + 1, 'id7'), (participants + 2, 'ghost'), (participants + 3, 'ghost')))
+    connection.close()
+    return {'missing_receivers': ('id10',), 'shared_receivers': ('id3', 'id5'), 'unsent': ('id11', 'id21', 'id6'),
+            'fixed_points': ('id5',), 'cycles': None, 'unknown_users': ('ghost',),
+            'duplicate_registrations': ('ghost', 'id7')}
+
+
+def split_cycle(path, participants):
+    """Closes the first ten participants into a cycle of their own: still valid pairs, but two cycles"""
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("UPDATE `google_form` SET `sent_to_id` = 'id1' WHERE `vk_id` = 'id10'")
+        connection.execute("UPDATE `google_form` SET `sent_to_id` = 'id11' WHERE `vk_id` = ?", (f'id{participants}',))
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rudolf-integrity-')
+    failures = []
+    try:
+        path = make_database(os.path.join(workdir, 'database.db'), args.participants)
+        reports = [integrity.check_pairs(path) for _ in range(args.repeat)]
+        best = min(report.seconds for report in reports)
+        print(f'{args.participants} participants and registrations: best of {args.repeat} {best:.2f} s')
+        report = reports[0]
+        if not report.ok or report.cycles != 1 or report.problems():
+            failures.append(f'valid pairs reported as {report.problems()}, {report.cycles} cycles')
+
+        broken = os.path.join(workdir, 'broken.db')
+        shutil.copyfile(path, broken)
+        expected = inject_faults(broken, args.participants)
+        report = integrity.check_pairs(broken)
+        found = {name: tuple(sorted(getattr(report, name))) if name != 'cycles' else report.cycles
+                 for name in expected}
+        if report.ok or found != expected:
+            failures.append(f'injected faults: expected {expected}, found {found}')
+
+        split_cycle(path, args.participants)
+        report = integrity.check_pairs(path)
+        if not report.ok or report.cycles != 2:
+            failures.append(f'split cycle: ok {report.ok}, {report.cycles} cycles, expected 2')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Valid pairs pass, every injected fault is reported')
+
+
+if __name__ == '__main__':
+    main()
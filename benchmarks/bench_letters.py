@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""Letter export (scripts/letters.py) on a 100k-participant event: time per output and worker count, and memory.
+
+Every run is checked: one letter per participant, and a sample of letters matches config.render_task_message for
+the receiver's form row. Peak Python memory (tracemalloc) of in-process exports of growing events shows that it
+does not grow with the number of participants. Exits with status 1 if a check fails.
+
+    python benchmarks/bench_letters.py [--participants 100000] [--workers 0 4]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_database, participant  # noqa: E402
+from bot import config  # noqa: E402
+from scripts.letters import export_letters, file_name, part_name  # noqa: E402
+
+CHUNK_SIZE = 2000
+
+
+def expected(i, participants):
+    """Letter of participant i, who sends to participant i + 1"""
+    receiver = participant((i + 1) % participants, participants)
+    return f'Отправитель: id{i + 1} --> {receiver[0]}\n\n{config.render_task_message(receiver[2:])}'
+
+
+def check(target, archive, participants, chunk_size):
+    sample = range(0, participants, max(1, participants // 50))
+    if archive:
+        count = 0
+        for index in range(1, participants // chunk_size + 2):
+            if os.path.exists(part_name(target, index)):
+                with zipfile.ZipFile(part_name(target, index)) as zf:
+                    count += len(zf.namelist())
+        letters = {}
+        for i in sample:
+            with zipfile.ZipFile(part_name(target, i // chunk_size + 1)) as zf:
+                letters[i] = zf.read(file_name(f'id{i + 1}')).decode('utf-8')
+    else:
+        count = len(os.listdir(target))
+        letters = {}
+        for i in sample:
+            with open(os.path.join(target, file_name(f'id{i + 1}')), encoding='utf_8_sig') as f:
+                letters[i] = f.read()
+    failures = [] if count == participants else [f'{target}: {count} letters for {participants} participants']
+    wrong = [i for i, text in letters.items() if text != expected(i, participants)]
+    if wrong:
+        failures.append(f'{target}: letter of participant {wrong[0]} differs from the template')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=100000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rudolf-letters-')
+    failures = []
+    try:
+        db_path = make_database(os.path.join(workdir, 'database.db'), args.participants, registered=False)
+        print(f'{os.cpu_count()} CPUs; {args.participants} letters')
+        for workers in dict.fromkeys(args.workers):
+            for archive in (False, True):
+                target = os.path.join(workdir, 'out', 'messages.zip' if archive else 'messages')
+                os.makedirs(os.path.join(workdir, 'out'))
+                stats = export_letters(db_path, target, target if archive else None, workers, CHUNK_SIZE)
+                print(f'{"zip" if archive else "files":>5}, {workers} workers: {stats.seconds:6.2f} s, '
+                      f'{stats.letters / stats.seconds:8.0f} letters/s')
+                failures += check(target, archive, args.participants, CHUNK_SIZE)
+                if stats.unpaired:
+                    failures.append(f'{len(stats.unpaired)} senders reported without a receiver')
+                shutil.rmtree(os.path.join(workdir, 'out'))
+
+        peaks = []
+        for participants in (args.participants // 10, args.participants):
+            path = make_database(os.path.join(workdir, f'memory-{participants}.db'), participants, registered=False)
+            tracemalloc.start()
+            export_letters(path, archive=os.path.join(workdir, 'memory.zip'), workers=0, chunk_size=CHUNK_SIZE)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            print(f'zip, in process, {participants} letters: peak {peaks[-1] / 2 ** 20:.1f} MiB')
+        if peaks[1] > 2 * peaks[0]:
+            failures.append(f'peak memory grew from {peaks[0]} to {peaks[1]} bytes with the number of letters')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Every letter rendered once and matches the template')
+
+
+if __name__ == '__main__':
+    main()
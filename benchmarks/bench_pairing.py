@@ -0,0 +1,30 @@
+# -*- coding: UTF-8 -*-
+"""Pairing engine throughput with all constraints enabled; the properties are checked by tests/test_pairing.py"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.integrity import count_cycles  # noqa: E402
+from scripts.pairing import assign_pairs, is_derangement  # noqa: E402
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000]
+    rng = np.random.default_rng(1)
+    for n in sizes:
+        previous = assign_pairs(n, seed=rng)
+        addresses = rng.integers(0, n // 2, n)
+        regions = rng.integers(0, 85, n)
+        started = time.perf_counter()
+        receivers = assign_pairs(n, previous=previous, addresses=addresses, regions=regions, seed=rng)
+        elapsed = time.perf_counter() - started
+        assert is_derangement(receivers) and count_cycles(receivers) == 1
+        print(f'{n:>8} participants: {elapsed:.3f} s, same region {np.mean(regions == regions[receivers]):.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+"""Dispatch cost per update: one lambda filter per menu button against the Router table, on a real Dispatcher"""
+import asyncio
+import itertools
+import random
+import sys
+import time
+
+import synthetic  # noqa: F401  (puts bot/ on sys.path)
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+from aiogram.contrib.fsm_storage.memory import MemoryStorage  # noqa: E402
+
+from db import UserContext  # noqa: E402
+from markups import Buttons as Bt  # noqa: E402
+from router import Router  # noqa: E402
+
+BUTTONS = (Bt.REGISTRY, Bt.SET_TRACKER, Bt.GET_HELP, Bt.GET_TRACKER, Bt.GET_MESSAGE)
+CONTEXT = UserContext('complete', 'id1', 'notimplemented', True, 'id2', '80085271434545', None)
+
+
+async def noop(msg, context=None):
+    pass
+
+
+async def load_context(user_id):
+    return CONTEXT
+
+
+def filter_chain(dispatcher):
+    """The previous layout: a `message.text == Bt.X` filter per button, then a catch-all"""
+    for text in BUTTONS:
+        dispatcher.register_message_handler(noop, lambda message, text=text: message.text == text)
+    dispatcher.register_message_handler(noop)
+
+
+def routing_table(dispatcher):
+    router = Router(load_context, unregistered=noop)
+    for text in BUTTONS:
+        router.route(text, private=text != Bt.REGISTRY, registered=text in (Bt.GET_TRACKER, Bt.GET_MESSAGE))(noop)
+    router.fallback(noop)
+    dispatcher.register_message_handler(router.dispatch)
+
+
+def make_updates(count, seed=0):
+    rng = random.Random(seed)
+    ids = itertools.count(1)
+    updates = []
+    for _ in range(count):
+        user_id = rng.randrange(1, 1000)
+        text = rng.choice(BUTTONS + ('hello',))
+        updates.append(types.Update(update_id=next(ids), message={
+            'message_id': 1, 'date': 0, 'text': text, 'from': {'id': user_id, 'is_bot': False, 'first_name': 'x'},
+            'chat': {'id': user_id, 'type': 'private'}}))
+    return updates
+
+
+async def measure(register, updates):
+    bot = Bot('123456:' + 'A' * 35)
+    dispatcher = Dispatcher(bot, storage=MemoryStorage())
+    # the real bot registers the FSM handlers first; every menu press is checked against them too
+    dispatcher.register_message_handler(noop, commands=['start'])
+    dispatcher.register_message_handler(noop, state='Registration:vk_id')
+    dispatcher.register_message_handler(noop, state='Tracking:set_track_number')
+    register(dispatcher)
+    Bot.set_current(bot)
+    Dispatcher.set_current(dispatcher)
+    started = time.perf_counter()
+    for update in updates:
+        await asyncio.create_task(dispatcher.process_update(update))
+    elapsed = time.perf_counter() - started
+    await (await bot.get_session()).close()
+    return elapsed / len(updates) * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    updates = make_updates(count)
+    for name, register in (('filter chain', filter_chain), ('routing table', routing_table)):
+        print(f'{name:>13}: {asyncio.run(measure(register, updates)):7.1f} us per update')
+
+
+if __name__ == '__main__':
+    main()
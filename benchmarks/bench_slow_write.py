@@ -0,0 +1,131 @@
+# -*- coding: UTF-8 -*-
+"""Read-only handler latency while a slow write transaction is in flight.
+
+A synthetic event is registered through the bot, then the read-only phases of loadtest.py (task and tracker
+requests) are replayed twice: once on a quiet database and once while another connection holds a write transaction
+open for the whole phase. Readers run on their own WAL connections off the event loop, so p99 of the read-only
+handlers should stay flat. Exits with status 1 if it grows beyond 2x + 5 ms.
+
+    python benchmarks/bench_slow_write.py [--participants 2000] [--workers 8]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from loadtest import StubBot, make_event, phase_updates, update
+
+READ_PHASES = ('task_fetch', 'tracker_get')
+HANDLERS = ('get_message', 'get_tracker', 'dispatch')
+
+
+class SlowWrite:
+    """Holds a write transaction open on its own connection until released"""
+
+    def __init__(self, db_path):
+        self._db_path = db_path
+        self._held = threading.Event()
+        self._release = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.seconds = None
+
+    def _run(self):
+        connection = sqlite3.connect(self._db_path, isolation_level=None)
+        started = time.perf_counter()
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute("UPDATE `users` SET `signup` = `signup`")
+        self._held.set()
+        self._release.wait()
+        connection.execute('COMMIT')
+        self.seconds = time.perf_counter() - started
+        connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        self._held.wait()
+        return self
+
+    def __exit__(self, *exc):
+        self._release.set()
+        self._thread.join()
+
+
+async def replay(main, participants, workers):
+    from aiogram import Bot, Dispatcher
+    from markups import Buttons
+    from update_queue import UpdateQueue
+
+    main.bot.request = StubBot().request
+    unlimited = float('inf')
+    main.sender._global.rate = main.sender._global.capacity = main.sender._global.tokens = unlimited
+    main.sender.chat_rate = main.sender.chat_burst = unlimited
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    queue = UpdateQueue(main.dp, workers=workers, maxsize=participants * 2 + workers)
+    queue.start()
+    ids = itertools.count(1)
+
+    async def run(phases):
+        main.metrics.reset()
+        for phase in phases:
+            for user_id, text in phase_updates(phase, participants, Buttons):
+                await queue.put(update(next(ids), user_id, text))
+            await queue.join()
+        return {label: main.metrics.histogram('handler', label).percentile(0.99) * 1e3 for label in HANDLERS}
+
+    await run(('start_storm', 'registration', 'tracker_set'))
+    await run(READ_PHASES)  # warm the caches, so both measured runs see the same state
+    quiet = await run(READ_PHASES)
+    with SlowWrite('./data/database.db') as write:
+        busy = await run(READ_PHASES)
+    await queue.close()
+    await main.on_shutdown(main.dp)
+    await main.dp.storage.close()
+    await (await main.bot.get_session()).close()
+    return quiet, busy, write.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rudolf-slow-write-')
+    cwd = os.getcwd()
+    try:
+        make_event(workdir, args.participants)
+        os.environ.setdefault('TOKEN', '123456:' + 'A' * 35)
+        # the same users press the same buttons in every run, none of it may be debounced
+        os.environ['DEBOUNCE_SECONDS'] = '0'
+        os.chdir(workdir)
+        import main as bot_main
+        logging.getLogger().setLevel(logging.WARNING)
+        quiet, busy, held = asyncio.run(replay(bot_main, args.participants, args.workers))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'write transaction held for {held:.2f} s')
+    print(f"{'handler':<12} {'quiet p99':>10} {'busy p99':>10}")
+    failures = []
+    for label in HANDLERS:
+        print(f'{label:<12} {quiet[label]:>7.3f} ms {busy[label]:>7.3f} ms')
+        if busy[label] > 2 * quiet[label] + 5:
+            failures.append(f'{label}: p99 {quiet[label]:.3f} -> {busy[label]:.3f} ms under a slow write')
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Read-only handlers are not held up by the write transaction')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+"""Compares the "📨 Мое задание" render path: per-press SQL + format against the TaskMessageCache"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from synthetic import make_database
+
+import config  # noqa: E402  (bot/ is put on sys.path by synthetic)
+from cache import GoogleFormCache, TaskMessageCache
+from db import Database
+
+PRESSES = 20000
+
+
+def per_press(database, user_ids):
+    for user_id in user_ids:
+        config.render_task_message(database.get_google_form_columns(database.get_send_to_id(user_id)))
+
+
+def cached(messages, user_ids):
+    for user_id in user_ids:
+        messages.get(f'id{user_id}')
+
+
+def measure(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - started) / PRESSES * 1e6
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000]
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = make_database(os.path.join(tmp, f'bench-{size}.db'), size)
+            user_ids = [random.randrange(size) + 1 for _ in range(PRESSES)]
+            database = Database(path)
+            messages = TaskMessageCache(GoogleFormCache(path), config.render_task_message,
+                                        config.task_template_version)
+            started = time.perf_counter()
+            messages.warm()
+            warm = time.perf_counter() - started
+            print(f'{size:>7} participants: per press {measure(per_press, database, user_ids):8.2f} us, '
+                  f'cached {measure(cached, messages, user_ids):6.2f} us, bulk warm-up {warm:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+"""Parcel tracking service (bot/tracking.py) against a local stub tracking API.
+
+Every participant of a synthetic event has a track number. The first poll fetches all of them in batches over one
+connection pool and is timed per concurrency limit; the stub API answers each batch after a fixed latency. Exits
+with status 1 if a poll misses parcels or exceeds the limit. The service behaviour is checked by
+tests/test_tracking.py.
+
+    python benchmarks/bench_tracking.py [--participants 2000] [--concurrency 1 4 16] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+from loadtest import track_number
+from synthetic import make_database
+
+import tracking  # noqa: E402  (bot/ is on sys.path via synthetic)
+from async_db import AsyncDatabase  # noqa: E402
+
+
+class StubTrackingAPI:
+    """Batch status endpoint of the protocol HttpTrackingClient speaks; counts requests and their overlap"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.statuses = {}
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            numbers = (await request.json())['numbers']
+            await asyncio.sleep(self.latency)
+            return web.json_response({'parcels': [
+                {'number': number, 'status': status, 'description': description, 'final': final}
+                for number, (status, description, final) in ((n, self.statuses[n]) for n in numbers)]})
+        finally:
+            self.in_flight -= 1
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, priority=None, **kwargs):
+        self.sent.append((chat_id, text, priority))
+
+
+async def replay(db_path, participants, levels, latency):
+    api = StubTrackingAPI(latency)
+    app = web.Application()
+    app.router.add_post('/track', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    url = f'http://{host}:{port}/track'
+    numbers = [track_number(i) for i in range(participants)]
+    api.statuses = {number: ('accepted', 'Принято в отделении связи', False) for number in numbers}
+
+    db = AsyncDatabase(db_path)
+    failures = []
+    print(f'{"concurrency":>11}  {"requests":>8}  {"seconds":>7}  {"parcels/s":>9}')
+    for concurrency in levels:
+        await db.execute('DELETE FROM `parcel_status`')
+        client = tracking.HttpTrackingClient(url, batch_size=50, concurrency=concurrency)
+        sender = RecordingSender()
+        service = tracking.TrackingService(db, sender, client)
+        await service.load()
+        api.requests = api.max_in_flight = 0
+        started = time.perf_counter()
+        checked, changed, failed = await service.poll()
+        seconds = time.perf_counter() - started
+        print(f'{concurrency:>11}  {api.requests:>8}  {seconds:>7.2f}  {checked / seconds:>9.0f}')
+        if (checked, changed, failed, len(sender.sent)) != (participants, 0, 0, 0):
+            failures.append(f'concurrency {concurrency}: first poll checked {checked}, changed {changed}, '
+                            f'failed {failed}, sent {len(sender.sent)}; expected {participants} checked, no sends')
+        if api.max_in_flight > concurrency:
+            failures.append(f'concurrency {concurrency}: {api.max_in_flight} requests in flight')
+        await client.close()
+
+    db.close()
+    await runner.cleanup()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--latency', type=float, default=0.05, help='stub API answer time per batch, seconds')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rudolf-tracking-')
+    try:
+        db_path = make_database(os.path.join(workdir, 'database.db'), args.participants)
+        connection = sqlite3.connect(db_path)
+        with connection:
+            connection.executemany('UPDATE `users` SET `track_number` = ? WHERE `user_id` = ?',
+                                   ((track_number(i), i + 1) for i in range(args.participants)))
+        connection.close()
+        failures = asyncio.run(replay(db_path, args.participants, args.concurrency, args.latency))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Every parcel fetched within the concurrency limit')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# -*- coding: UTF-8 -*-
+"""Input validators: per-call timings of the checks the registration and tracker handlers run
+
+The accept set is checked by tests/test_validators.py.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import validators  # noqa: E402
+
+
+def per_call(func, text, number=200000):
+    return timeit.timeit(lambda: func(text), number=number) / number * 1e9
+
+
+def main():
+    cases = [
+        ('normalize_vk_id', validators.normalize_vk_id, 'katerina_legostaeva'),
+        ('normalize_vk_id', validators.normalize_vk_id, 'https://vk.com/katerina_legostaeva'),
+        ('normalize_vk_id', validators.normalize_vk_id, 'id1'),
+        ('normalize_track_number', validators.normalize_track_number, '80085271434545'),
+        ('normalize_track_number', validators.normalize_track_number, 'RA 123456785 RU'),
+    ]
+    for name, func, text in cases:
+        print(f'{name}({text!r}): {per_call(func, text):5.0f} ns')
+
+
+if __name__ == '__main__':
+    main()
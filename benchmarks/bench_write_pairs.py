@@ -0,0 +1,49 @@
+# -*- coding: UTF-8 -*-
+"""Pair write-back on a 100k-row sheet: the old per-cell data.at loop against the column mapping"""
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_database, participant  # noqa: E402
+from scripts.generator import FORM_COLUMNS, Generator, form_rows  # noqa: E402
+
+
+def per_cell(data, pairs):
+    for i, k in zip(range(len(pairs)), pairs.keys()):
+        data.at[i, 'vk_id'] = k
+        data.at[i, 'send_to_id'] = pairs[k]
+
+
+def by_column(data, pairs):
+    data['send_to_id'] = data['vk_id'].map(pairs)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = pd.DataFrame([participant(i, rows) for i in range(rows)], columns=FORM_COLUMNS)
+    generator = Generator()
+    generator._data = data
+    pairs = generator.compare_people()
+    print(f'{rows} rows: data.at loop {timed(per_cell, data.copy(), pairs):.2f} s, '
+          f'column map {timed(by_column, data.copy(), pairs):.3f} s')
+    with tempfile.TemporaryDirectory() as tmp:
+        generator._path = os.path.join(tmp, 'data.xlsx')
+        path = make_database(os.path.join(tmp, 'database.db'), 0, registered=False)
+        print(f'SQLite rows conversion {timed(form_rows, data):.2f} s, '
+              f'full write-back to SQLite and workbook {timed(generator.write_pairs_to_table, path):.1f} s')
+
+
+if __name__ == '__main__':
+    main()
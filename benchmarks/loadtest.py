@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+"""Load test: replays synthetic update streams through the real Dispatcher of bot/main.py against a stub Bot.
+
+A synthetic event (N participants paired by scripts/generator.py) is created in a temporary directory, the bot is
+imported from there, and every phase is pushed through the same UpdateQueue the webhook mode uses. Telegram's rate
+limits are lifted so the numbers describe the bot itself. Results are compared with benchmarks/baseline.json:
+
+    python benchmarks/loadtest.py                    # run and compare with the baseline
+    python benchmarks/loadtest.py --save-baseline    # run and store the results as the new baseline
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from synthetic import ROOT, participant
+
+sys.path.insert(0, ROOT)
+
+from bot import validators  # noqa: E402
+from scripts.generator import FORM_COLUMNS, Generator  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+PHASES = ('start_storm', 'registration', 'task_fetch', 'tracker_set', 'tracker_get', 'start_again')
+
+
+def make_event(workdir, participants):
+    """Creates data/database.db in workdir with participants paired by the real Generator, and a logs/ folder"""
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.makedirs(os.path.join(workdir, 'logs'))
+    table = os.path.join(workdir, 'data', 'data.xlsx')
+    rows = [participant(i, participants) for i in range(participants)]
+    pd.DataFrame(rows, columns=FORM_COLUMNS).assign(send_to_id='').to_excel(table, index=False)
+    db_path = os.path.join(workdir, 'data', 'database.db')
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), db_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        Generator(table).write_pairs_to_table(db_path)
+    return db_path
+
+
+def track_number(i):
+    digits = f'{i:013d}'
+    return digits + str(validators.domestic_check_digit(digits))
+
+
+def phase_updates(phase, participants, buttons):
+    """Updates of one phase in arrival order; user i + 1 registers with the VK ID of participant i"""
+    texts = {
+        'start_storm': lambda i: ['/start'],
+        'registration': lambda i: [buttons.REGISTRY, participant(i, participants)[0]],
+        'task_fetch': lambda i: [buttons.GET_MESSAGE],
+        'tracker_set': lambda i: [buttons.SET_TRACKER, track_number(i)],
+        'tracker_get': lambda i: [buttons.GET_TRACKER],
+        'start_again': lambda i: ['/start'],
+    }[phase]
+    per_user = [texts(i) for i in range(participants)]
+    # users interleave: everybody's first message, then everybody's second one
+    for step in range(max(map(len, per_user))):
+        for i, messages in enumerate(per_user):
+            if step < len(messages):
+                yield i + 1, messages[step]
+
+
+class StubBot:
+    """Replaces Bot.request: records API calls and answers like Telegram would"""
+
+    def __init__(self):
+        self.calls = collections.Counter()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        return {'message_id': 1, 'date': 0, 'chat': {'id': data.get('chat_id'), 'type': 'private'},
+                'text': data.get('text')}
+
+
+def update(update_id, user_id, text):
+    message = {'message_id': update_id, 'date': 0, 'text': text,
+               'from': {'id': user_id, 'is_bot': False, 'first_name': 'Santa'},
+               'chat': {'id': user_id, 'type': 'private'}}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'update_id': update_id, 'message': message}
+
+
+async def replay(main, participants, workers):
+    from aiogram import Bot, Dispatcher
+    from markups import Buttons
+    from update_queue import UpdateQueue
+
+    stub = StubBot()
+    main.bot.request = stub.request
+    unlimited = float('inf')
+    main.sender._global.rate = main.sender._global.capacity = main.sender._global.tokens = unlimited
+    main.sender.chat_rate = main.sender.chat_burst = unlimited
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    queue = UpdateQueue(main.dp, workers=workers, maxsize=participants * 2 + workers)
+    queue.start()
+    ids = itertools.count(1)
+    results = {}
+    for phase in PHASES:
+        updates = [update(next(ids), user_id, text) for user_id, text in phase_updates(phase, participants, Buttons)]
+        main.metrics.reset()
+        stub.calls.clear()
+        writes = main.db.writer_stats.operations
+        started = time.perf_counter()
+        for item in updates:
+            await queue.put(item)
+        await queue.join()
+        await main.sender.join()
+        elapsed = time.perf_counter() - started
+        handlers = {label: h for label, h in main.metrics.family('handler').items() if h.count and label != 'dispatch'}
+        # Database methods run by the reader pool, plus ad-hoc fetchall queries that bypass them
+        reads = sum(h.count for h in main.metrics.family('db_query').values())
+        reads += main.metrics.histogram('db_call', 'AsyncDatabase.fetchall').count
+        results[phase] = {
+            'updates': len(updates),
+            'updates_per_second': round(len(updates) / elapsed, 1),
+            'reads_per_update': round(reads / len(updates), 3),
+            'writes_per_update': round((main.db.writer_stats.operations - writes) / len(updates), 3),
+            'sends_per_update': round(stub.calls['sendMessage'] / len(updates), 3),
+            'handlers': {label: {'calls': h.count, 'p50_ms': round(h.percentile(0.5) * 1e3, 3),
+                                 'p99_ms': round(h.percentile(0.99) * 1e3, 3)}
+                         for label, h in sorted(handlers.items())},
+        }
+    await queue.close()
+    await main.on_shutdown(main.dp)
+    await main.dp.storage.close()
+    await (await main.bot.get_session()).close()
+    return results
+
+
+def report(results):
+    for phase, result in results.items():
+        print(f"{phase}: {result['updates']} updates, {result['updates_per_second']:.0f} updates/s, per update "
+              f"{result['reads_per_update']} reads, {result['writes_per_update']} writes, "
+              f"{result['sends_per_update']} sends")
+        for label, h in result['handlers'].items():
+            print(f"    {label:<24} {h['calls']:>7} calls  p50 {h['p50_ms']:8.3f} ms  p99 {h['p99_ms']:8.3f} ms")
+
+
+def regressions(results, baseline, tolerance):
+    """Differences from the baseline: query and send counts must not grow, timings may move within tolerance"""
+    found = []
+    for phase, result in results.items():
+        base = baseline.get(phase)
+        if base is None:
+            continue
+        for key in ('reads_per_update', 'writes_per_update', 'sends_per_update'):
+            if result[key] > base[key] + 1e-9:
+                found.append(f'{phase}: {key} {base[key]} -> {result[key]}')
+        if result['updates_per_second'] < base['updates_per_second'] * (1 - tolerance):
+            found.append(f"{phase}: throughput {base['updates_per_second']} -> "
+                         f"{result['updates_per_second']} updates/s")
+        for label, h in result['handlers'].items():
+            base_p99 = base['handlers'].get(label, {}).get('p99_ms')
+            if base_p99 is not None and h['p99_ms'] > base_p99 * (1 + tolerance) + 1:
+                found.append(f"{phase}: {label} p99 {base_p99} -> {h['p99_ms']} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown of timings')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rudolf-load-')
+    cwd = os.getcwd()
+    try:
+        make_event(workdir, args.participants)
+        os.environ.setdefault('TOKEN', '123456:' + 'A' * 35)
+        os.chdir(workdir)
+        import main as bot_main
+        logging.getLogger().setLevel(logging.WARNING)
+        results = asyncio.run(replay(bot_main, args.participants, args.workers))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report(results)
+    if args.save_baseline:
+        with open(BASELINE, 'w', encoding='utf-8') as f:
+            json.dump({'participants': args.participants, 'workers': args.workers, 'phases': results}, f, indent=2)
+        print(f'Baseline saved to {BASELINE}')
+    elif os.path.exists(BASELINE):
+        with open(BASELINE, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline['participants'], baseline['workers']) != (args.participants, args.workers):
+            print('Baseline was recorded with other --participants/--workers, not comparing')
+            return
+        found = regressions(results, baseline['phases'], args.tolerance)
+        for line in found:
+            print('REGRESSION', line)
+        if found:
+            sys.exit(1)
+        print('No regressions against the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# -*- coding: UTF-8 -*-
+"""Synthetic event data for benchmarks: a copy of the empty database filled with N participants."""
+import os
+import shutil
+import sqlite3
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+
+import db  # noqa: E402
+
+
+def participant(i, participants):
+    """Form row of participant i (VK ID id<i + 1>); everybody sends to the next one, so the pairing is a single cycle"""
+    vk_id = f'id{i + 1}'
+    return (vk_id, f'id{(i + 1) % participants + 1}', f'Participant {i}', f'Street {i}, flat {i % 300}',
+            f'{100000 + i % 900000}', 'tangerines', 'sleeping', 'socks', 'Home Alone', 'Last Christmas',
+            'olivier', 'snow fort', 'garlands', 'carrot')
+
+
+def make_database(path, participants, registered=True):
+    """Creates a database at path with participants rows in google_form and, optionally, in users"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+    migration = db.DBMigration(path)
+    with migration.bulk_load():
+        migration.add_users([participant(i, participants) for i in range(participants)])
+    migration.connection.close()
+    connection = sqlite3.connect(path)
+    with connection:
+        if registered:
+            connection.executemany("INSERT INTO `users` (`user_id`, `vk_id`, `signup`) VALUES (?, ?, 'complete')",
+                                   ((i + 1, f'id{i + 1}') for i in range(participants)))
+    connection.close()
+    return path
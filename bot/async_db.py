@@ -0,0 +1,331 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль асинхронного доступа к базе данных SQLite.
+
+Содержит класс AsyncDatabase, который повторяет методы Database, но выполняет их
+вне цикла событий: запись — в выделенном потоке BatchWriter, который объединяет
+изменения в общие транзакции, чтение — в пуле потоков с соединениями только для
+чтения в режиме WAL.
+"""
+
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import db
+from db import Database
+from cache import GoogleFormCache, KnownUsers
+
+
+class WriterStats:
+    """Счётчики работы BatchWriter.
+
+    Attributes:
+        batches (int): Количество выполненных транзакций.
+        operations (int): Количество выполненных изменений.
+        max_batch_size (int): Наибольшее число изменений в одной транзакции.
+        flush_seconds (float): Суммарное время выполнения транзакций.
+        last_flush_seconds (float): Время выполнения последней транзакции.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.operations = 0
+        self.max_batch_size = 0
+        self.flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def mean_batch_size(self):
+        """float: Среднее число изменений в транзакции."""
+        return self.operations / self.batches if self.batches else 0.0
+
+    def record(self, size, seconds):
+        """Учитывает выполненную транзакцию.
+
+        Args:
+            size (int): Количество изменений в транзакции.
+            seconds (float): Время выполнения транзакции.
+        """
+        self.batches += 1
+        self.operations += size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.flush_seconds += seconds
+        self.last_flush_seconds = seconds
+
+
+class BatchWriter:
+    """Поток записи, объединяющий изменения в общие транзакции.
+
+    Изменения ставятся в очередь и выполняются одной транзакцией, как только
+    с момента первого из них прошло `flush_interval` секунд или накопилось
+    `max_batch` изменений. Если транзакция не удалась, изменения повторяются
+    по одному, чтобы ошибка досталась только виновнику. Изменение, ожидание
+    которого отменено до начала транзакции (например, при остановке бота), не выполняется.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        flush_interval (float): Наибольшее время ожидания следующих изменений, в секундах.
+        max_batch (int): Наибольшее число изменений в одной транзакции.
+    """
+
+    _stop = object()
+
+    def __init__(self, db_path, flush_interval=0.02, max_batch=256):
+        """Открывает соединение для записи в отдельном потоке и включает WAL.
+
+        Args:
+            db_path (str): Путь к файлу базы данных SQLite.
+            flush_interval (float): Наибольшее время ожидания следующих изменений, в секундах.
+            max_batch (int): Наибольшее число изменений в одной транзакции.
+        """
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.stats = WriterStats()
+        self._db_path = db_path
+        self._queue = queue.Queue()
+        self._ready = Future()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+        self._ready.result()
+
+    def submit(self, sql, params):
+        """Ставит изменение в очередь.
+
+        Args:
+            sql (str): SQL-запрос.
+            params (dict | tuple): Параметры запроса.
+
+        Returns:
+            concurrent.futures.Future: Завершится количеством изменённых строк после фиксации транзакции.
+        """
+        future = Future()
+        self._queue.put((sql, params, future))
+        return future
+
+    def close(self):
+        """Записывает всё, что осталось в очереди, и останавливает поток."""
+        self._queue.put(self._stop)
+        self._thread.join()
+
+    def _run(self):
+        try:
+            connection = Database(self._db_path).connection
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        except Exception as e:
+            self._ready.set_exception(e)
+            return
+        self._ready.set_result(None)
+        stopping = False
+        while not stopping:
+            operation = self._queue.get()
+            if operation is self._stop:
+                break
+            batch = [operation]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                try:
+                    operation = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if operation is self._stop:
+                    stopping = True
+                    break
+                batch.append(operation)
+            self._flush(connection, batch)
+        connection.close()
+
+    def _flush(self, connection, batch):
+        # после этого отменить изменение уже нельзя, а отменённые раньше пропускаются
+        batch = [operation for operation in batch if operation[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            with connection:
+                connection.execute("BEGIN")
+                results = [connection.execute(sql, params).rowcount for sql, params, _ in batch]
+        except sqlite3.Error:
+            for sql, params, future in batch:
+                try:
+                    with connection:
+                        future.set_result(connection.execute(sql, params).rowcount)
+                except sqlite3.Error as e:
+                    future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+        self.stats.record(len(batch), time.perf_counter() - started)
+
+
+def _reader(name):
+    """Создаёт асинхронную обёртку над читающим методом Database.
+
+    Args:
+        name (str): Имя метода Database.
+    """
+    async def method(self, *args):
+        return await self._read(name, *args)
+
+    method.__name__ = name
+    method.__doc__ = getattr(Database, name).__doc__
+    return method
+
+
+def _writer(name, sql, *fields):
+    """Создаёт асинхронную обёртку над изменяющим методом Database.
+
+    Первым полем всегда должен быть `user_id`: по нему чтение того же пользователя
+    дожидается ещё не записанных изменений.
+
+    Args:
+        name (str): Имя метода Database.
+        sql (str): SQL-запрос метода с именованными параметрами.
+        fields (str): Имена параметров запроса в порядке аргументов метода.
+    """
+    async def method(self, *args):
+        return await self._write(sql, dict(zip(fields, args)))
+
+    method.__name__ = name
+    method.__doc__ = getattr(Database, name).__doc__
+    return method
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database.
+
+    Все методы Database доступны как корутины. Изменения выполняет BatchWriter
+    в собственном потоке, объединяя одновременные изменения в общие транзакции;
+    корутина изменения завершается после фиксации транзакции. Чтение выполняется
+    параллельно в пуле потоков, у каждого из которых своё соединение только для чтения.
+    Чтение данных пользователя дожидается его ещё не записанных изменений.
+    Запросы к google_form обслуживаются общим для всех читателей GoogleFormCache,
+    а уже записанные пользователи известны без запросов через KnownUsers.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        readers (int): Количество потоков (и соединений) для чтения.
+        flush_interval (float): Наибольшее время ожидания следующих изменений, в секундах.
+        max_batch (int): Наибольшее число изменений в одной транзакции.
+        form_cache_size (int): Наибольшее число строк Google-формы в кэше (None — вся таблица).
+        writer: Готовый объект записи с методами submit и close и атрибутом stats,
+            например RemoteWriter (None — запустить свой BatchWriter).
+    """
+
+    def __init__(self, db_path, readers=4, flush_interval=0.02, max_batch=256, form_cache_size=None, writer=None):
+        """Запускает поток записи, загружает кэш Google-формы и создаёт пул читателей.
+
+        Args:
+            db_path (str): Путь к файлу базы данных SQLite.
+            readers (int): Количество потоков (и соединений) для чтения.
+            flush_interval (float): Наибольшее время ожидания следующих изменений, в секундах.
+            max_batch (int): Наибольшее число изменений в одной транзакции.
+            form_cache_size (int): Наибольшее число строк Google-формы в кэше (None — вся таблица).
+            writer: Готовый объект записи (None — запустить свой BatchWriter).
+        """
+        self._db_path = db_path
+        self._local = threading.local()
+        self._pending = {}
+        self._writer = writer if writer is not None else BatchWriter(db_path, flush_interval, max_batch)
+        self.form_cache = GoogleFormCache(db_path, max_size=form_cache_size)
+        self.known_users = KnownUsers(db_path)
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader',
+                                                 initializer=self._open_reader)
+
+    @property
+    def writer_stats(self):
+        """WriterStats: Счётчики размера транзакций и времени записи."""
+        return self._writer.stats
+
+    def _open_reader(self):
+        """Открывает соединение только для чтения для текущего потока пула."""
+        self._local.database = Database(self._db_path, read_only=True, form_cache=self.form_cache)
+
+    def _call_reader(self, name, *args):
+        return getattr(self._local.database, name)(*args)
+
+    async def _read(self, name, *args):
+        pending = self._pending.get(args[0]) if args else None
+        if pending is not None:
+            await asyncio.wait((pending,))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._call_reader, name, *args)
+
+    async def _write(self, sql, params):
+        user_id = params['user_id']
+        future = asyncio.wrap_future(self._writer.submit(sql, params))
+        self._pending[user_id] = future
+        try:
+            return await future
+        finally:
+            if self._pending.get(user_id) is future:
+                del self._pending[user_id]
+
+    def _fetchall(self, sql, params):
+        return self._local.database.connection.execute(sql, params).fetchall()
+
+    async def fetchall(self, sql, params=()):
+        """Выполняет произвольный читающий запрос в пуле читателей.
+
+        Args:
+            sql (str): SQL-запрос.
+            params (tuple): Параметры запроса.
+
+        Returns:
+            list: Строки результата.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._fetchall, sql, params)
+
+    async def execute(self, sql, params=()):
+        """Выполняет произвольный изменяющий запрос через поток записи.
+
+        Args:
+            sql (str): SQL-запрос.
+            params (tuple): Параметры запроса.
+
+        Returns:
+            int: Количество изменённых строк.
+        """
+        return await asyncio.wrap_future(self._writer.submit(sql, params))
+
+    async def add_user(self, user_id):
+        """Добавляет пользователя в базу данных, если его там ещё нет, и запоминает его в known_users.
+
+        Одновременные вызовы для одного пользователя (в том числе из разных процессов)
+        добавят одну строку: запрос не вставляет строку, если такой user_id уже есть.
+
+        Args:
+            user_id (int): Идентификатор пользователя.
+
+        Returns:
+            bool: True, если пользователь добавлен, False — если он уже был.
+        """
+        added = await self._write(db.sql_query_add_user, {'user_id': user_id})
+        self.known_users.add(user_id)
+        return bool(added)
+
+    def close(self):
+        """Дожидается завершения чтения, записывает очередь изменений и закрывает базу."""
+        self._read_executor.shutdown(wait=True)
+        self._writer.close()
+
+    user_exists = _reader('user_exists')
+    get_vk_id = _reader('get_vk_id')
+    get_signup = _reader('get_signup')
+    get_track_number = _reader('get_track_number')
+    get_send_to_id = _reader('get_send_to_id')
+    get_user_id_via_vk = _reader('get_user_id_via_vk')
+    get_vk_sender_key = _reader('get_vk_sender_key')
+    is_in_google_form = _reader('is_in_google_form')
+    load_context = _reader('load_context')
+    get_google_form_columns = _reader('get_google_form_columns')
+
+    set_vk_id = _writer('set_vk_id', db.sql_query_set_vk_id, 'user_id', 'vk_id')
+    set_signup = _writer('set_signup', db.sql_query_set_signup, 'user_id', 'signup')
+    set_track_number = _writer('set_track_number', db.sql_query_set_track_number, 'user_id', 'tracker')
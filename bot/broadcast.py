@@ -0,0 +1,149 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль массовых рассылок бота.
+
+Содержит класс Broadcaster, который рассылает участникам задания и трек-номера
+их посылок через SendScheduler с низким приоритетом, а также сообщает получателю
+трек-номер, как только отправитель его заявил.
+"""
+
+import asyncio
+import logging
+import time
+
+import config
+from sender import BULK, SEND_ERRORS
+
+
+class Broadcaster:
+    """Рассылка заданий и трек-номеров участникам.
+
+    Пользователи читаются частями по возрастанию `users.id`. После отправки каждой
+    части номер последнего пользователя сохраняется в таблицу broadcast_progress,
+    поэтому прерванная рассылка продолжается с места остановки и повторно получат
+    сообщение не больше `chunk_size` пользователей.
+
+    Args:
+        db (AsyncDatabase): База данных бота.
+        sender (SendScheduler): Планировщик исходящих сообщений.
+        task_messages (TaskMessageCache): Кэш готовых текстов заданий.
+        chunk_size (int): Количество пользователей в одной части.
+    """
+
+    kinds = ('tasks', 'tracks')
+
+    def __init__(self, db, sender, task_messages, chunk_size=200):
+        self.db = db
+        self.sender = sender
+        self.task_messages = task_messages
+        self.chunk_size = chunk_size
+        self._running = {}
+
+    def is_running(self, kind):
+        """Проверяет, идёт ли сейчас рассылка.
+
+        Args:
+            kind (str): Вид рассылки: 'tasks' или 'tracks'.
+        """
+        task = self._running.get(kind)
+        return task is not None and not task.done()
+
+    def start(self, kind, restart=False):
+        """Запускает рассылку в фоне.
+
+        Args:
+            kind (str): Вид рассылки: 'tasks' или 'tracks'.
+            restart (bool): Начать заново, даже если рассылка уже была завершена.
+
+        Returns:
+            asyncio.Task: Задача рассылки, её результат — как у метода run.
+        """
+        task = self._running[kind] = asyncio.create_task(self.run(kind, restart))
+        return task
+
+    async def run(self, kind, restart=False):
+        """Выполняет рассылку до конца, продолжая прерванную с контрольной точки.
+
+        Args:
+            kind (str): Вид рассылки: 'tasks' — задания, 'tracks' — трек-номера посылок.
+            restart (bool): Начать заново, даже если рассылка уже была завершена.
+
+        Returns:
+            tuple: Количество отправленных и неотправленных сообщений за всю рассылку
+                или None, если рассылка уже была завершена.
+        """
+        if kind not in self.kinds:
+            raise ValueError(f'Unknown broadcast: {kind}')
+        progress = await self.db.fetchall(sql_query_get_progress, (kind,))
+        if progress and progress[0][3] is not None and not restart:
+            return None
+        if not progress or restart:
+            await self.db.execute(sql_query_start_progress, (kind, time.time()))
+            last_id, sent, failed = 0, 0, 0
+        else:
+            last_id, sent, failed = progress[0][:3]
+        started = time.monotonic()
+        query = sql_query_tasks_chunk if kind == 'tasks' else sql_query_tracks_chunk
+        while True:
+            rows = await self.db.fetchall(query, (last_id, self.chunk_size))
+            if not rows:
+                break
+            results = await asyncio.gather(*(self._send(kind, row) for row in rows))
+            last_id = rows[-1][0]
+            sent += sum(results)
+            failed += len(results) - sum(results)
+            await self.db.execute(sql_query_save_progress, (last_id, sent, failed, kind))
+        await self.db.execute(sql_query_finish_progress, (time.time(), kind))
+        logging.info(config.broadcast_log % (kind, sent, failed, time.monotonic() - started))
+        return sent, failed
+
+    async def _send(self, kind, row):
+        _, user_id, value = row
+        if kind == 'tasks':
+            text = self.task_messages.get(value)
+            if text is None:
+                return False
+        else:
+            text = config.got_track.format(track_num=value)
+        try:
+            await self.sender.send_message(user_id, text, priority=BULK)
+        except SEND_ERRORS as e:
+            logging.warning('Broadcast %s to %s failed: %r', kind, user_id, e)
+            return False
+        return True
+
+    async def notify_track(self, sender_user_id, track_number):
+        """Сообщает получателю посылки трек-номер, заявленный его отправителем.
+
+        Args:
+            sender_user_id (int): Идентификатор отправителя.
+            track_number (str): Трек-номер посылки.
+        """
+        rows = await self.db.fetchall(sql_query_get_receiver, (sender_user_id,))
+        for (receiver_id,) in rows:
+            try:
+                await self.sender.send_message(receiver_id, config.got_track.format(track_num=track_number),
+                                               priority=BULK)
+            except SEND_ERRORS as e:
+                logging.warning('Track notification to %s failed: %r', receiver_id, e)
+
+
+sql_query_get_progress = "SELECT `last_id`, `sent`, `failed`, `finished_at` FROM `broadcast_progress` WHERE `name` = ?"
+
+sql_query_start_progress = """INSERT OR REPLACE INTO `broadcast_progress` (`name`, `started_at`) VALUES (?, ?)"""
+
+sql_query_save_progress = "UPDATE `broadcast_progress` SET `last_id` = ?, `sent` = ?, `failed` = ? WHERE `name` = ?"
+
+sql_query_finish_progress = "UPDATE `broadcast_progress` SET `finished_at` = ? WHERE `name` = ?"
+
+sql_query_tasks_chunk = """SELECT u.`id`, u.`user_id`, u.`vk_id` FROM `users` AS u \
+ JOIN `google_form` AS f ON f.`vk_id` = u.`vk_id` WHERE u.`id` > ? ORDER BY u.`id` LIMIT ?"""
+
+sql_query_tracks_chunk = """SELECT r.`id`, r.`user_id`, s.`track_number` FROM `users` AS r \
+ JOIN `google_form` AS f ON f.`sent_to_id` = r.`vk_id` JOIN `users` AS s ON s.`vk_id` = f.`vk_id` \
+ WHERE r.`id` > ? AND s.`track_number` != 'notimplemented' ORDER BY r.`id` LIMIT ?"""
+
+sql_query_get_receiver = """SELECT r.`user_id` FROM `users` AS s \
+ JOIN `google_form` AS f ON f.`vk_id` = s.`vk_id` JOIN `users` AS r ON r.`vk_id` = f.`sent_to_id` \
+ WHERE s.`user_id` = ?"""
@@ -0,0 +1,304 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль кэширования данных, которые не меняются во время работы бота.
+
+Содержит класс GoogleFormCache — кэш таблицы google_form в памяти процесса,
+класс TaskMessageCache — кэш готовых текстов заданий и класс KnownUsers —
+множество идентификаторов пользователей, уже записанных в базу.
+"""
+
+import bisect
+import heapq
+import pathlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import db
+
+
+class GoogleFormCache:
+    """Кэш таблицы google_form.
+
+    Таблица заполняется миграцией до запуска бота, поэтому она загружается в память
+    один раз: словари «VK ID → VK ID получателя» и обратный «VK ID получателя → VK ID»
+    хранятся целиком, а строки пожеланий — целиком или, если задан `max_size`
+    и строк больше, в LRU-кэше ограниченного размера. Раз в `check_interval` секунд
+    кэш сверяет версию таблицы (её увеличивают триггеры на google_form)
+    и перезагружается, если таблица изменилась.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        max_size (int): Наибольшее число строк пожеланий в памяти (None — без ограничений).
+        check_interval (float): Период проверки версии таблицы, в секундах.
+    """
+
+    def __init__(self, db_path, max_size=None, check_interval=60.0):
+        """Открывает соединение только для чтения и загружает таблицу.
+
+        Args:
+            db_path (str): Путь к файлу базы данных SQLite.
+            max_size (int): Наибольшее число строк пожеланий в памяти (None — без ограничений).
+            check_interval (float): Период проверки версии таблицы, в секундах.
+        """
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + '?mode=ro',
+                                           uri=True, check_same_thread=False)
+        self._sent_to = {}
+        self._senders = {}
+        self._wishes = OrderedDict()
+        self._bounded = False
+        self.version = None
+        self._checked_at = 0.0
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        """Загружает таблицу в память. Вызывается под блокировкой."""
+        self.version = self._read_version()
+        self._checked_at = time.monotonic()
+        self._sent_to = {}
+        self._senders = {}
+        self._wishes = OrderedDict()
+        count = self._connection.execute("SELECT COUNT(*) FROM `google_form`").fetchone()[0]
+        self._bounded = self.max_size is not None and count > self.max_size
+        if self._bounded:
+            for vk_id, sent_to_id in self._connection.execute("SELECT `vk_id`, `sent_to_id` FROM `google_form`"):
+                self._sent_to[str(vk_id)] = str(sent_to_id)
+                self._senders[str(sent_to_id)] = str(vk_id)
+        else:
+            for row in self._connection.execute(sql_query_load_google_form):
+                vk_id, sent_to_id = str(row[0]), str(row[1])
+                self._sent_to[vk_id] = sent_to_id
+                self._senders[sent_to_id] = vk_id
+                self._wishes[vk_id] = row[2:]
+
+    def _read_version(self):
+        row = self._connection.execute(db.sql_query_get_meta, ('google_form_version',)).fetchone()
+        return row[0] if row else None
+
+    def _check(self):
+        """Перезагружает кэш, если версия таблицы изменилась. Вызывается под блокировкой."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if self._read_version() != self.version:
+            self._load()
+
+    def refresh(self):
+        """Перезагружает кэш, если версия таблицы изменилась с последней проверки.
+
+        Returns:
+            int: Текущая версия таблицы.
+        """
+        with self._lock:
+            self._check()
+            return self.version
+
+    def vk_ids(self):
+        """Возвращает VK ID всех участников из Google-формы.
+
+        Returns:
+            list: Список VK ID.
+        """
+        with self._lock:
+            return list(self._sent_to)
+
+    def invalidate(self):
+        """Принудительно перезагружает кэш."""
+        with self._lock:
+            self._load()
+
+    def is_in_google_form(self, vk_id):
+        """Проверяет, есть ли пользователь в Google-форме.
+
+        Args:
+            vk_id (str): VK ID пользователя.
+
+        Returns:
+            bool: True, если пользователь есть в Google-форме, False — если нет.
+        """
+        with self._lock:
+            self._check()
+            return str(vk_id) in self._sent_to
+
+    def get_send_to_id(self, vk_id):
+        """Возвращает VK ID получателя для отправителя.
+
+        Args:
+            vk_id (str): VK ID отправителя.
+
+        Returns:
+            str: VK ID получателя или пустая строка, если не найден.
+        """
+        with self._lock:
+            self._check()
+            return self._sent_to.get(str(vk_id), '')
+
+    def get_vk_sender_key(self, owner_vk_id):
+        """Возвращает VK ID отправителя по VK ID получателя.
+
+        Args:
+            owner_vk_id (str): VK ID получателя.
+
+        Returns:
+            str: VK ID отправителя или пустая строка, если не найден.
+        """
+        with self._lock:
+            self._check()
+            return self._senders.get(str(owner_vk_id), '')
+
+    def get_google_form_columns(self, vk_id):
+        """Возвращает список данных из Google-формы для пользователя.
+
+        Args:
+            vk_id (str): VK ID пользователя.
+
+        Returns:
+            list: Список данных из Google-формы.
+        """
+        vk_id = str(vk_id)
+        with self._lock:
+            self._check()
+            if vk_id not in self._sent_to:
+                return []
+            wishes = self._wishes.get(vk_id)
+            if wishes is None:
+                row = self._connection.execute(db.sql_query_get_from_sheet, (vk_id,)).fetchone()
+                if row is None:
+                    return []
+                wishes = self._wishes[vk_id] = tuple(row)
+                if len(self._wishes) > self.max_size:
+                    self._wishes.popitem(last=False)
+            elif self._bounded:
+                self._wishes.move_to_end(vk_id)
+            return list(wishes)
+
+
+class TaskMessageCache:
+    """Кэш готовых текстов заданий.
+
+    Текст задания отправителя подготавливается один раз — при первом запросе или
+    заранее через `warm` — и хранится по ключу (VK ID отправителя, версия шаблона).
+    Кэш сбрасывается, когда GoogleFormCache перезагружает таблицу.
+
+    Args:
+        form_cache (GoogleFormCache): Кэш Google-формы.
+        render (callable): Функция, превращающая данные получателя в текст задания.
+        template_version (int): Версия шаблона задания.
+    """
+
+    def __init__(self, form_cache, render, template_version):
+        """Создаёт пустой кэш.
+
+        Args:
+            form_cache (GoogleFormCache): Кэш Google-формы.
+            render (callable): Функция, превращающая данные получателя в текст задания.
+            template_version (int): Версия шаблона задания.
+        """
+        self.form_cache = form_cache
+        self.render = render
+        self.template_version = template_version
+        self._lock = threading.Lock()
+        self._messages = OrderedDict()
+        self._form_version = form_cache.version
+
+    def get(self, sender_vk_id):
+        """Возвращает текст задания для отправителя.
+
+        Args:
+            sender_vk_id (str): VK ID отправителя.
+
+        Returns:
+            str: Текст задания или None, если отправителя или его получателя нет в Google-форме.
+        """
+        key = (str(sender_vk_id), self.template_version)
+        form_version = self.form_cache.refresh()
+        with self._lock:
+            if self._form_version != form_version:
+                self._messages.clear()
+                self._form_version = form_version
+            message = self._messages.get(key)
+            if message is not None:
+                self._messages.move_to_end(key)
+                return message
+        wishes = self.form_cache.get_google_form_columns(self.form_cache.get_send_to_id(sender_vk_id))
+        if not wishes:
+            return None
+        message = self.render(wishes)
+        with self._lock:
+            self._messages[key] = message
+            if self.form_cache.max_size is not None and len(self._messages) > self.form_cache.max_size:
+                self._messages.popitem(last=False)
+        return message
+
+    def warm(self):
+        """Заранее подготавливает задания для всех отправителей из Google-формы.
+
+        Returns:
+            int: Количество подготовленных заданий.
+        """
+        return sum(self.get(vk_id) is not None for vk_id in self.form_cache.vk_ids())
+
+
+class KnownUsers:
+    """Множество идентификаторов пользователей, уже записанных в таблицу users.
+
+    Загружается при запуске одним запросом и хранится как отсортированный массив
+    64-битных чисел (8 байт на пользователя) с поиском делением пополам. Новые
+    пользователи попадают в небольшое множество, которое сливается с массивом,
+    когда в нём накопится `merge_threshold` идентификаторов. Пользователи из
+    таблицы не удаляются, поэтому множество только растёт и не устаревает.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        merge_threshold (int): Размер множества новых пользователей, при котором оно сливается с массивом.
+    """
+
+    def __init__(self, db_path, merge_threshold=1024):
+        """Загружает идентификаторы пользователей через соединение только для чтения.
+
+        Args:
+            db_path (str): Путь к файлу базы данных SQLite.
+            merge_threshold (int): Размер множества новых пользователей, при котором оно сливается с массивом.
+        """
+        self.merge_threshold = merge_threshold
+        connection = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+        try:
+            self._sorted = array('q', (row[0] for row in connection.execute(db.sql_query_known_users)))
+        finally:
+            connection.close()
+        self._recent = set()
+
+    def __contains__(self, user_id):
+        if user_id in self._recent:
+            return True
+        index = bisect.bisect_left(self._sorted, user_id)
+        return index < len(self._sorted) and self._sorted[index] == user_id
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def add(self, user_id):
+        """Запоминает пользователя.
+
+        Args:
+            user_id (int): Идентификатор пользователя.
+        """
+        if user_id in self:
+            return
+        self._recent.add(user_id)
+        if len(self._recent) >= self.merge_threshold:
+            self._sorted = array('q', heapq.merge(self._sorted, sorted(self._recent)))
+            self._recent = set()
+
+
+sql_query_load_google_form = """SELECT `vk_id`, `sent_to_id`, `name`, `address`, `post_index`, \
+ `new_year_attr`, `new_year_doings`, `best_gift`, `best_film`, `best_song`, `best_dish`, `best_flashback`, \
+ `decorations`, `rabbit_gift` FROM `google_form`"""
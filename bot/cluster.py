@@ -0,0 +1,544 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль запуска бота несколькими процессами.
+
+Процесс-приёмник получает обновления (long polling через polling.Poller или webhook)
+и раздаёт их процессам-обработчикам через очереди multiprocessing. Обновления одного
+пользователя всегда попадают в один процесс, поэтому порядок его сообщений
+и переходы FSM сохраняются. Каждый обработчик импортирует main.py со своими
+соединениями для чтения, а все изменения базы выполняет один процесс записи
+(BatchWriter), к которому обработчики обращаются через RemoteWriter.
+
+Запуск: `python bot/cluster.py`, число обработчиков задаёт CLUSTER_WORKERS.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from async_db import BatchWriter, WriterStats
+from db import Database
+from update_queue import UpdateQueue, update_user_id
+
+# задаётся в процессе-обработчике до импорта main.py; None — бот запущен одним процессом
+worker = None
+
+# служебное сообщение в очереди обработчика: дождаться обработки всего полученного
+_join = 'join'
+
+
+def shard_of(user_id, shards):
+    """Возвращает номер процесса-обработчика для пользователя.
+
+    Идентификатор перемешивается мультипликативным хешем: внутри процесса UpdateQueue
+    делит обновления по остатку от деления, и без перемешивания обоим делениям
+    достались бы одни и те же младшие разряды.
+
+    Args:
+        user_id (int): Идентификатор пользователя.
+        shards (int): Количество процессов-обработчиков.
+
+    Returns:
+        int: Номер процесса от 0 до shards - 1.
+    """
+    return (((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) % shards
+
+
+class Worker:
+    """Сведения о текущем процессе-обработчике.
+
+    Attributes:
+        index (int): Номер процесса.
+        count (int): Количество процессов-обработчиков.
+        writer (RemoteWriter): Объект записи через общий процесс записи.
+    """
+
+    def __init__(self, index, count, writer):
+        self.index = index
+        self.count = count
+        self.writer = writer
+
+    def owns(self, user_id):
+        """bool: True, если обновления пользователя приходят в этот процесс."""
+        return shard_of(user_id, self.count) == self.index
+
+
+class RemoteWriter:
+    """Объект записи процесса-обработчика: передаёт изменения процессу записи.
+
+    Повторяет интерфейс BatchWriter (submit, close, stats), поэтому подставляется
+    в AsyncDatabase и SQLiteStorage вместо собственного потока записи. Ответы
+    процесса записи принимает отдельный поток.
+
+    Args:
+        index (int): Номер процесса-обработчика.
+        requests (multiprocessing.Queue): Общая очередь изменений процесса записи.
+        responses (multiprocessing.Queue): Очередь ответов этому процессу.
+    """
+
+    def __init__(self, index, requests, responses):
+        self.index = index
+        self.stats = WriterStats()
+        self._requests = requests
+        self._responses = responses
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._last_batch = None
+        self._thread = threading.Thread(target=self._receive, name='db-remote-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params):
+        """Отправляет изменение процессу записи.
+
+        Args:
+            sql (str): SQL-запрос.
+            params (dict | tuple): Параметры запроса.
+
+        Returns:
+            concurrent.futures.Future: Завершится количеством изменённых строк после фиксации транзакции.
+        """
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._futures[request_id] = future
+        self._requests.put((self.index, request_id, sql, params))
+        return future
+
+    def close(self):
+        """Дожидается ответов на все отправленные изменения и останавливает поток приёма."""
+        with self._lock:
+            pending = list(self._futures.values())
+        wait(pending)
+        self._responses.put(None)
+        self._thread.join()
+
+    def _receive(self):
+        while True:
+            response = self._responses.get()
+            if response is None:
+                break
+            request_id, batch, result, error = response
+            with self._lock:
+                future = self._futures.pop(request_id)
+            if batch != self._last_batch:
+                self._last_batch = batch
+                self.stats.batches += 1
+            if not future.set_running_or_notify_cancel():
+                # ожидание отменено, изменение всё равно выполнено
+                continue
+            if error is None:
+                self.stats.operations += 1
+                future.set_result(result)
+            else:
+                future.set_exception(getattr(sqlite3, error[0], sqlite3.Error)(error[1]))
+
+
+class IngressDatabase:
+    """База данных процесса-приёмника для polling.Poller: только fetchall и execute.
+
+    Чтение идёт своим соединением только для чтения, открываемым при первом запросе
+    (после того как процесс записи применил миграции), изменения — через процесс записи.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        writer (RemoteWriter): Объект записи через общий процесс записи.
+    """
+
+    def __init__(self, db_path, writer):
+        self._db_path = db_path
+        self._writer = writer
+        self._connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cluster-ingress-db')
+
+    def _fetchall(self, sql, params):
+        if self._connection is None:
+            self._connection = Database(self._db_path, read_only=True).connection
+        return self._connection.execute(sql, params).fetchall()
+
+    async def fetchall(self, sql, params=()):
+        """Выполняет читающий запрос, как AsyncDatabase.fetchall."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._fetchall, sql, params)
+
+    async def execute(self, sql, params=()):
+        """Выполняет изменяющий запрос через процесс записи, как AsyncDatabase.execute."""
+        return await asyncio.wrap_future(self._writer.submit(sql, params))
+
+    def close(self):
+        """Дожидается отправленных изменений и закрывает соединение."""
+        self._writer.close()
+        self._executor.submit(self._close).result()
+        self._executor.shutdown()
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+
+def _reply(responses, writer, request_id, future):
+    # вызывается в потоке BatchWriter до учёта транзакции, поэтому её номер — число уже учтённых
+    error = future.exception()
+    if error is None:
+        responses.put((request_id, writer.stats.batches, future.result(), None))
+    else:
+        responses.put((request_id, writer.stats.batches, None, (type(error).__name__, str(error))))
+
+
+def run_writer(db_path, requests, responses, ready):
+    """Процесс записи: выполняет изменения всех обработчиков через один BatchWriter.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        requests (multiprocessing.Queue): Очередь изменений (None — остановиться).
+        responses (list): Очереди ответов процессам-обработчикам по их номерам.
+        ready (multiprocessing.Event): Устанавливается, когда миграции применены и поток записи запущен.
+    """
+    import config
+    from logging_setup import setup_logging
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging('./logs/bot-writer.log')
+    writer = BatchWriter(db_path)
+    ready.set()
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        index, request_id, sql, params = request
+        writer.submit(sql, params).add_done_callback(functools.partial(_reply, responses[index], writer, request_id))
+    writer.close()
+    stats = writer.stats
+    logging.info(config.writer_stats % (stats.batches, stats.operations, stats.mean_batch_size,
+                                        stats.max_batch_size, stats.flush_seconds))
+
+
+def run_worker(index, count, updates, acks, requests, responses, report_done, setup=None):
+    """Процесс-обработчик: импортирует main.py и обрабатывает свою долю обновлений.
+
+    У каждого обработчика свой файл журнала, свой порт метрик (METRICS_PORT + 1 + номер)
+    и своя доля общего ограничения частоты отправки SEND_RATE.
+
+    Args:
+        index (int): Номер процесса.
+        count (int): Количество процессов-обработчиков.
+        updates (multiprocessing.Queue): Очередь обновлений этого процесса (None — остановиться).
+        acks (multiprocessing.Queue): Общая очередь подтверждений процессу-приёмнику.
+        requests (multiprocessing.Queue): Очередь изменений процесса записи.
+        responses (multiprocessing.Queue): Очередь ответов процесса записи.
+        report_done (multiprocessing.Event): Если установлен, номер каждого обработанного обновления
+            подтверждается процессу-приёмнику.
+        setup (Callable): Функция, вызываемая с модулем main до запуска, например для подмены Bot в тестах.
+    """
+    global worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ['LOG_FILE'] = f'./logs/bot-worker-{index}.log'
+    if os.getenv('METRICS_PORT'):
+        os.environ['METRICS_PORT'] = str(int(os.environ['METRICS_PORT']) + 1 + index)
+    os.environ['SEND_RATE'] = str(float(os.getenv('SEND_RATE', 30)) / count)
+    worker = Worker(index, count, RemoteWriter(index, requests, responses))
+
+    import main
+    if setup is not None:
+        setup(main)
+    asyncio.run(_serve(main, index, updates, acks, report_done.is_set()))
+
+
+def _take(updates, limit=256):
+    """Дожидается обновления и забирает вместе с ним уже ожидающие, не больше `limit`."""
+    taken = [updates.get()]
+    while len(taken) < limit and taken[-1] is not None:
+        try:
+            taken.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return taken
+
+
+async def _serve(main, index, updates, acks, report_done):
+    loop = asyncio.get_running_loop()
+    def done(update):
+        acks.put(('done', index, update['update_id']))
+
+    local = UpdateQueue(main.dp, workers=int(os.getenv('UPDATE_WORKERS', 8)),
+                        maxsize=int(os.getenv('UPDATE_QUEUE_SIZE', 1000)), on_done=done if report_done else None)
+    local.start()
+    await main.on_startup(main.dp)
+    acks.put(('ready', index))
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='cluster-updates') as receiver:
+        running = True
+        while running:
+            for update in await loop.run_in_executor(receiver, _take, updates):
+                if update is None:
+                    running = False
+                elif update == _join:
+                    await local.join()
+                    acks.put(('joined', index))
+                else:
+                    await local.put(update)
+    await local.close()
+    # состояния FSM сохраняются через процесс записи, поэтому до того, как on_shutdown закроет RemoteWriter
+    await main.dp.storage.close()
+    await main.dp.storage.wait_closed()
+    await main.on_shutdown(main.dp)
+    await (await main.bot.get_session()).close()
+
+
+class Cluster:
+    """Процессы записи и обработки и распределение обновлений между ними.
+
+    Повторяет интерфейс UpdateQueue (start, put, put_nowait, join, close, on_done), поэтому
+    подставляется в приложение webhook и в polling.Poller вместо очереди одного процесса.
+    Если задан on_done, start вызывается в цикле событий, а подтверждения обработчиков
+    разбирает отдельный поток.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        workers (int): Количество процессов-обработчиков.
+        queue_size (int): Наибольшее общее число обновлений, ожидающих в очередях обработчиков.
+        setup (Callable): Функция, которую каждый обработчик вызывает с модулем main до запуска.
+
+    Attributes:
+        on_done (Callable): Вызывается в цикле событий с каждым обновлением после его обработки.
+        database (IngressDatabase): База данных для процесса-приёмника; закрывается при остановке.
+    """
+
+    def __init__(self, db_path, workers=2, queue_size=1000, setup=None):
+        """Создаёт очереди и процессы; процессы запускаются методом start.
+
+        Args:
+            db_path (str): Путь к файлу базы данных SQLite.
+            workers (int): Количество процессов-обработчиков.
+            queue_size (int): Наибольшее общее число ожидающих обновлений.
+            setup (Callable): Функция настройки обработчика (должна импортироваться по имени).
+        """
+        # spawn, а не fork: родительский процесс может уже держать потоки и соединения SQLite
+        context = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self._updates = [context.Queue(max(queue_size // workers, 1)) for _ in range(workers)]
+        self._acks = context.Queue()
+        self._requests = context.Queue()
+        # Process.start() забывает свои аргументы, а очередь, собранная сборщиком мусора до того,
+        # как дочерний процесс её откроет, недоступна ему, поэтому ссылки хранятся здесь
+        # последняя очередь ответов — процессу-приёмнику
+        self._responses = [context.Queue() for _ in range(workers + 1)]
+        self._ready = context.Event()
+        self._report_done = context.Event()
+        self._writer = context.Process(target=run_writer, name='rudolf-writer',
+                                       args=(db_path, self._requests, self._responses, self._ready))
+        self._processes = [context.Process(target=run_worker, name=f'rudolf-worker-{i}',
+                                           args=(i, workers, self._updates[i], self._acks, self._requests,
+                                                 self._responses[i], self._report_done, setup))
+                           for i in range(workers)]
+        self.database = IngressDatabase(db_path, RemoteWriter(workers, self._requests, self._responses[workers]))
+        self.on_done = None
+        self._in_flight = {}
+        self._loop = None
+        self._acks_reader = None
+        self._joining = None
+
+    def start(self):
+        """Запускает процесс записи, затем обработчики, и дожидается их готовности.
+
+        Если какой-то процесс не запустился, остальные останавливаются, а исключение передаётся дальше.
+        """
+        try:
+            self._writer.start()
+            while not self._ready.wait(1):
+                if not self._writer.is_alive():
+                    raise RuntimeError('Database writer process failed to start')
+            if self.on_done is not None:
+                self._report_done.set()
+            for process in self._processes:
+                process.start()
+            self._wait_acks('ready')
+            if self.on_done is not None:
+                self._loop = asyncio.get_running_loop()
+                self._acks_reader = threading.Thread(target=self._read_acks, name='cluster-acks', daemon=True)
+                self._acks_reader.start()
+        except BaseException:
+            for process in (self._writer, *self._processes):
+                if process.is_alive():
+                    process.terminate()
+            raise
+
+    def _wait_acks(self, kind):
+        pending = set(range(self.workers))
+        while pending:
+            try:
+                ack, index = self._acks.get(timeout=1)
+            except queue.Empty:
+                dead = [process.name for process in self._processes if not process.is_alive()]
+                if dead:
+                    raise RuntimeError('Worker processes exited: ' + ', '.join(dead))
+                continue
+            if ack == kind:
+                pending.discard(index)
+
+    def _read_acks(self):
+        # подтверждения одного обработчика приходят по порядку: 'joined' — после всех его 'done'
+        while True:
+            ack = self._acks.get()
+            if ack is None:
+                break
+            if ack[0] == 'done':
+                self._loop.call_soon_threadsafe(self._done, ack[2])
+            elif ack[0] == 'joined':
+                self._loop.call_soon_threadsafe(self._joined, ack[1])
+
+    def _done(self, update_id):
+        update = self._in_flight.pop(update_id, None)
+        if update is not None:
+            self.on_done(update)
+
+    def _joined(self, index):
+        pending, joined = self._joining
+        pending.discard(index)
+        if not pending and not joined.done():
+            joined.set_result(None)
+
+    def _queue_for(self, update):
+        return self._updates[shard_of(update_user_id(update), self.workers)]
+
+    def put_nowait(self, update):
+        """Передаёт обновление обработчику, если в его очереди есть место.
+
+        Args:
+            update (dict): Обновление Telegram в виде JSON-словаря.
+
+        Returns:
+            bool: True, если обновление принято, False — если очередь заполнена.
+        """
+        try:
+            self._queue_for(update).put_nowait(update)
+        except queue.Full:
+            return False
+        if self.on_done is not None:
+            self._in_flight[update['update_id']] = update
+        return True
+
+    async def put(self, update):
+        """Передаёт обновление обработчику, дожидаясь места в его очереди.
+
+        Args:
+            update (dict): Обновление Telegram в виде JSON-словаря.
+        """
+        if not self.put_nowait(update):
+            if self.on_done is not None:
+                self._in_flight[update['update_id']] = update
+            await asyncio.get_running_loop().run_in_executor(None, self._queue_for(update).put, update)
+
+    async def join(self):
+        """Дожидается, пока обработчики обработают все переданные им обновления."""
+        loop = asyncio.get_running_loop()
+        if self._acks_reader is not None:
+            self._joining = (set(range(self.workers)), loop.create_future())
+        for updates in self._updates:
+            await loop.run_in_executor(None, updates.put, _join)
+        if self._acks_reader is None:
+            await loop.run_in_executor(None, self._wait_acks, 'joined')
+            return
+        joined = self._joining[1]
+        while not joined.done():
+            await asyncio.wait((joined,), timeout=1)
+            dead = [process.name for process in self._processes if not process.is_alive()]
+            if dead and not joined.done():
+                raise RuntimeError('Worker processes exited: ' + ', '.join(dead))
+
+    async def close(self):
+        """Обрабатывает оставшиеся обновления и останавливает обработчики, затем процесс записи."""
+        await asyncio.get_running_loop().run_in_executor(None, self._stop)
+
+    def _stop(self):
+        for updates in self._updates:
+            updates.put(None)
+        for process in self._processes:
+            process.join()
+        if self._acks_reader is not None:
+            self._acks.put(None)
+            self._acks_reader.join()
+        self.database.close()
+        self._requests.put(None)
+        self._writer.join()
+
+
+async def poll(bot, cluster, timeout=20):
+    """Получает обновления через long polling и раздаёт их процессам-обработчикам до отмены задачи.
+
+    Обновления получает polling.Poller, поэтому, как и у бота одним процессом, полученные
+    обновления и граница обработанных хранятся в базе (update_inbox и bot_meta): пришедшие,
+    пока бот не работал, и прерванные его остановкой обновления обрабатываются после запуска.
+    Poller запускает кластер и останавливает его после сохранения границы.
+
+    Args:
+        bot (Bot): Бот, от имени которого запрашиваются обновления.
+        cluster (Cluster): Ещё не запущенный кластер.
+        timeout (int): Время ожидания новых обновлений в одном запросе, в секундах.
+    """
+    from aiogram import Dispatcher
+
+    from polling import Poller
+
+    # диспетчер нужен Poller только для запросов getUpdates: обновления обрабатывает кластер
+    poller = Poller(Dispatcher(bot), cluster.database, timeout=timeout, updates=cluster)
+    await bot.delete_webhook()
+    try:
+        await poller.run()
+    finally:
+        await poller.close()
+
+
+def main():
+    """Запускает кластер с параметрами из .env."""
+    from aiogram import Bot
+    from aiohttp import web
+    from dotenv import load_dotenv
+
+    from logging_setup import setup_logging
+    from webhook import build_app
+
+    load_dotenv('./.env')
+    setup_logging('./logs/bot-ingress.log')
+    bot = Bot(os.getenv('TOKEN'))
+    cluster = Cluster('./data/database.db', workers=int(os.getenv('CLUSTER_WORKERS') or os.cpu_count()),
+                      queue_size=int(os.getenv('UPDATE_QUEUE_SIZE', 1000)))
+
+    if os.getenv('RUN_MODE', 'polling') == 'webhook':
+        url, path = os.getenv('WEBHOOK_URL'), os.getenv('WEBHOOK_PATH', '/webhook')
+        secret_token = os.getenv('WEBHOOK_SECRET')
+        app = build_app(None, path, secret_token=secret_token, updates=cluster)
+
+        async def set_webhook(app):
+            await bot.set_webhook(url.rstrip('/') + path, secret_token=secret_token, max_connections=100)
+
+        async def close_session(app):
+            await (await bot.get_session()).close()
+
+        app.on_startup.append(set_webhook)
+        app.on_cleanup.append(close_session)
+        web.run_app(app, host=os.getenv('WEBAPP_HOST', '0.0.0.0'), port=int(os.getenv('WEBAPP_PORT', 8080)))
+    else:
+        async def run_polling():
+            try:
+                await poll(bot, cluster)
+            finally:
+                await (await bot.get_session()).close()
+
+        try:
+            asyncio.run(run_polling())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    # процессы запускаются функциями модуля cluster, а не __main__, чтобы обработчики видели cluster.worker
+    import cluster as module
+    module.main()
@@ -1,48 +1,12 @@
 # -*- coding: UTF-8 -*-
 """
-Модуль для проверки корректности вводимых пользователем строк и хранения сообщений бота.
+Модуль для хранения сообщений бота.
 
-Содержит функции для проверки корректности VK ID и трек-номера, а также
-хранит тексты сообщений бота для различных сценариев взаимодействия.
+Хранит тексты сообщений бота для различных сценариев взаимодействия;
+проверки корректности VK ID и трек-номера находятся в модуле validators.
 """
 
-def is_allowed(msg: str):
-    """Проверяет, что строка не содержит запрещённых символов.
-
-    Args:
-        msg (str): Входная строка для проверки.
-
-    Returns:
-        bool: True, если строка корректна, False — если содержит запрещённые символы.
-    """
-    stop_list = "\/@%&*^?!.,;:#№$~- ><+=)(`[]§"
-    for w in msg:
-        if w in stop_list or 0 <= ord(w) <= 31:
-            return False
-    return True
-
-
-def track_is_true(track_num: str):
-    """Проверяет корректность трек-номера.
-
-    Трек-номер должен состоять из 14 символов и не содержать запрещённых символов.
-
-    Args:
-        track_num (str): Входная строка для проверки.
-
-    Returns:
-        bool: True, если трек-номер корректен, False — если нет.
-    """
-    length = 14
-    stop_list = "\/@%&*^?!.,;:#№$~- _><+=)(`[]§"
-    if len(track_num) != length:
-        return False
-
-    for w in track_num:
-        if w in stop_list or 0 <= ord(w) <= 31:
-            return False
-
-    return True
+import zlib
 
 
 # bot messages
@@ -86,6 +50,25 @@ task_message = """✨Привет! Я Оленёнок Рудольф, твой
 С наступающим тебя Новым годом от Тоши и всех оленей Санты! 🎄🎁
 """
 
+# поля шаблона задания в порядке столбцов Google-формы
+task_message_fields = ('name', 'address', 'post_index', 'new_year_attr', 'new_year_doings', 'best_gift',
+                       'best_film', 'best_song', 'best_dish', 'best_flashback', 'decorations', 'rabbit_gift')
+# меняется вместе с текстом шаблона, по ней сбрасываются ранее подготовленные задания
+task_template_version = zlib.crc32(task_message.encode('utf-8'))
+
+
+def render_task_message(wishes):
+    """Подставляет данные получателя из Google-формы в шаблон задания.
+
+    Args:
+        wishes (list): Данные получателя в порядке столбцов Google-формы.
+
+    Returns:
+        str: Текст задания.
+    """
+    return task_message.format(**dict(zip(task_message_fields, wishes)))
+
+
 # help message
 help_message = """Снова привет, я цифровой ассистент Рудольф! Ты вызвал справку и сейчас я расскажу тебе все, что знаю.\
 Я здесь для того, чтобы облегчить процесс проведения Тайного Санты: у меня можно попросить задание и запросить \
@@ -137,7 +120,8 @@ registration_empty = """У меня есть подозрение, что ты 
 
 # all about tracking
 track_message = """О, уже отправил посылочку? Прекрасно! Пришли мне следующим сообщением трек-номер посылки. \
-Напоминаю, что состоять он должен ровно из 14 символов и содержать только буквы и цифры. Постарайся не ошибиться! ☠️"""
+Напоминаю, что по России это ровно 14 цифр, а для международных отправлений — 13 символов вида RA123456785RU. \
+Постарайся не ошибиться! ☠️"""
 
 track_success_updated = """✅ Отлично, твой трек-номер записан! Если при запросе трек-номера выводится ошибка,\
 значит, твой отправитель еще не отправил посылку. Если это повторяется в течение долгого времени, \
@@ -158,10 +142,35 @@ https://www.pochta.ru/tracking"""
 track_empty = """Пока что твой отправитель не прикрепил трек-номера 🤷. Я бы, конечно, быканул на него, но я же \
 олененок :3 \nПопробуй повторить запрос позже: может быть у меня будут уже хорошие новости для тебя! ✨"""
 
+parcel_status = "Статус посылки: {status}"
+
+parcel_status_changed = """📦 Новости о твоей посылке {track_num}!
+Статус: {status}"""
+
 not_in_google_form = """❌ Ошибка! У меня есть серьезные подозрения, что тебя нет в гугл-форме, которую мы присылали \
 участникам Тайного Санты! Если ты уверен, что она тобой заполнена, то срочно вызывай кнопку помощи и пиши нам в \
 поддержку! Сделай это как можно скорее! 🚑"""
 
+# broadcasts (admins only)
+broadcast_usage = """Рассылка: /broadcast tasks — разослать задания, /broadcast tracks — разослать трек-номера. \
+Добавь restart, чтобы начать завершённую рассылку заново."""
+broadcast_started = "Рассылка {kind} запущена 🚀"
+broadcast_running = "Рассылка {kind} уже идёт ⏳"
+broadcast_already = "Рассылка {kind} уже завершена. Чтобы начать заново: /broadcast {kind} restart"
+broadcast_finished = "Рассылка {kind} завершена ✅ Отправлено: {sent}, не удалось: {failed}"
+# pairing check (admins only)
+check_pairs_ok = "Пары в порядке ✅ Участников: {participants}, циклов: {cycles}. Проверка заняла {seconds:.2f} с"
+check_pairs_failed = "Найдены ошибки ❌ Участников: {participants}. Проверка заняла {seconds:.2f} с"
+check_pairs_cycles = "⚠️ Пары образуют {cycles} отдельных циклов вместо одного"
+check_pairs_problem = "— {title}: {count}, например: {examples}"
+check_pairs_titles = {
+    'missing_receivers': 'получателя нет в анкете',
+    'shared_receivers': 'получатель у нескольких отправителей',
+    'unsent': 'никто не дарит',
+    'fixed_points': 'дарит сам себе',
+    'unknown_users': 'зарегистрирован, но нет в анкете',
+    'duplicate_registrations': 'один VK ID у нескольких пользователей',
+}
 # default answer
 default_message = """Клавиатура ниже это переводчик с человеческого на мой язык и обратно. Но я попробую ответить!\n \
 Кхм-кхм.. Беееее-беееее! Или, блин, стой.. МУУУУУ! МУУУУУ! Черт, вообще я хотел помяукать.. \
@@ -178,3 +187,9 @@ new_user = "New user with ID: %s was registered"
 new_vk_id = "User with ID: %s set a new VK ID: %s"
 
 new_tracker = "User with ID: %s set a new tracker %s"
+writer_stats = "Database writer: %d batches, %d writes, %.1f mean / %d max batch size, %.3f s flushing"
+broadcast_log = "Broadcast %s finished: %d sent, %d failed in %.1f s"
+debounce_stats = "Repeated presses: %d answered, %d suppressed; saved %d DB reads and %d sends"
+catch_up_started = "Catching up on pending updates after update %s"
+catch_up_finished = "Caught up on %d pending updates in %.1f s (%.0f updates/s)"
+tracking_log = "Parcel tracking: %d parcels checked, %d changed status, %d failed in %.1f s"
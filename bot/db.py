@@ -6,7 +6,36 @@
 Содержит классы для управления пользователями, их данными и интеграцией с Google-формой.
 """
 
+import contextlib
+import pathlib
 import sqlite3
+from typing import NamedTuple
+
+
+class UserContext(NamedTuple):
+    """Неизменяемый набор данных о пользователе, необходимый обработчикам.
+
+    Attributes:
+        signup (str): Статус регистрации пользователя.
+        vk_id (str): VK ID пользователя.
+        track_number (str): Трек-номер, заявленный самим пользователем.
+        in_google_form (bool): Есть ли пользователь в Google-форме.
+        sent_to_id (str): VK ID получателя подарка от пользователя.
+        sender_track_number (str): Трек-номер посылки, которую отправили пользователю.
+        wishes (tuple): Данные получателя из Google-формы (пустой кортеж, если не найдены).
+    """
+    signup: str = ''
+    vk_id: str = ''
+    track_number: str = ''
+    in_google_form: bool = False
+    sent_to_id: str = ''
+    sender_track_number: str = ''
+    wishes: tuple = ()
+
+    @property
+    def registered(self):
+        """bool: True, если пользователь указал VK ID."""
+        return self.signup != 'setvkid'
 
 
 class Database:
@@ -18,24 +47,43 @@ class Database:
         db_path (str): Путь к файлу базы данных SQLite.
     """
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, read_only=False, form_cache=None):
         """Инициализирует соединение с базой данных и создаёт курсор.
 
+        Соединение для записи применяет миграции схемы, соединение только для чтения
+        открывается в режиме `mode=ro` и схему не изменяет.
+
         Args:
             db_path (str): Путь к файлу базы данных SQLite.
+            read_only (bool): Открыть соединение только для чтения.
+            form_cache (GoogleFormCache): Кэш Google-формы; если задан, запросы к google_form
+                обслуживаются из него.
         """
-        self.connection = sqlite3.Connection(db_path)
+        self.form_cache = form_cache
+        if read_only:
+            self.connection = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + '?mode=ro',
+                                              uri=True)
+            self.schema_version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        else:
+            self.connection = sqlite3.Connection(db_path)
+            self.schema_version = migrate_schema(self.connection)
         self.cursor = self.connection.cursor()
 
+    def close(self):
+        """Закрывает соединение с базой данных."""
+        self.connection.close()
+
     def add_user(self, user_id):
-        """Добавляет нового пользователя в базу данных.
+        """Добавляет пользователя в базу данных, если его там ещё нет.
 
         Args:
             user_id (int): Идентификатор пользователя.
+
+        Returns:
+            bool: True, если пользователь добавлен, False — если он уже был.
         """
         with self.connection:
-            return self.cursor.execute("INSERT INTO `users` (`user_id`) VALUES (?)",
-                                       (user_id,))
+            return bool(self.cursor.execute(sql_query_add_user, {'user_id': user_id}).rowcount)
 
     def user_exists(self, user_id):
         """Проверяет, существует ли пользователь в базе данных.
@@ -47,9 +95,7 @@ class Database:
             bool: True, если пользователь существует, False — если нет.
         """
         with self.connection:
-            result = self.cursor.execute("SELECT * FROM `users` WHERE `user_id` = ?",
-                                         (user_id,)).fetchall()
-            return bool(len(result))
+            return self.cursor.execute(sql_query_user_exists, (user_id,)).fetchone() is not None
 
     def set_vk_id(self, user_id, vk_id):
         """Устанавливает VK ID для пользователя.
@@ -59,8 +105,7 @@ class Database:
             vk_id (str): VK ID пользователя.
         """
         with self.connection:
-            return self.cursor.execute("UPDATE `users` SET `vk_id` = ? WHERE `user_id` = ?",
-                                       (vk_id, user_id,))
+            return self.cursor.execute(sql_query_set_vk_id, {'user_id': user_id, 'vk_id': vk_id})
 
     def get_vk_id(self, user_id):
         """Возвращает VK ID пользователя.
@@ -104,8 +149,7 @@ class Database:
             signup (str): Новый статус регистрации.
         """
         with self.connection:
-            return self.cursor.execute("UPDATE `users` SET `signup` = ? WHERE `user_id` = ?",
-                                       (signup, user_id,))
+            return self.cursor.execute(sql_query_set_signup, {'user_id': user_id, 'signup': signup})
 
     def set_track_number(self, user_id, tracker):
         """Устанавливает трек-номер для пользователя.
@@ -115,8 +159,7 @@ class Database:
             tracker (str): Трек-номер.
         """
         with self.connection:
-            return self.cursor.execute("UPDATE `users` SET `track_number` = ? WHERE `user_id` = ?",
-                                       (tracker, user_id,))
+            return self.cursor.execute(sql_query_set_track_number, {'user_id': user_id, 'tracker': tracker})
 
     def get_track_number(self, user_id):
         """Возвращает трек-номер пользователя.
@@ -145,9 +188,9 @@ class Database:
         """
         receiver_id = ''
         with self.connection:
-            sender_vk = self.get_vk_id(user_id)
-            result = self.cursor.execute("SELECT `sent_to_id` FROM `google_form` WHERE `vk_id` = ?",
-                                         (sender_vk,))
+            result = self.cursor.execute("SELECT f.`sent_to_id` FROM `users` AS u "
+                                         "JOIN `google_form` AS f ON f.`vk_id` = u.`vk_id` WHERE u.`user_id` = ?",
+                                         (user_id,))
             for row in result:
                 receiver_id = str(row[0])
             return receiver_id
@@ -178,6 +221,8 @@ class Database:
         Returns:
             str: VK ID отправителя или пустая строка, если не найден.
         """
+        if self.form_cache is not None:
+            return self.form_cache.get_vk_sender_key(owner_vk_id)
         sender = ''
         with self.connection:
             result = self.cursor.execute("SELECT `vk_id` FROM `google_form` WHERE `sent_to_id` = ?",
@@ -195,11 +240,67 @@ class Database:
         Returns:
             bool: True, если пользователь есть в Google-форме, False — если нет.
         """
+        if self.form_cache is not None:
+            return self.form_cache.is_in_google_form(vk_id)
         with self.connection:
             result = self.cursor.execute("SELECT * FROM `google_form` WHERE `vk_id` = ?",
                                          (vk_id,)).fetchall()
             return bool(len(result))
 
+    def load_context(self, user_id):
+        """Возвращает всё, что нужно обработчику.
+
+        Если задан кэш Google-формы, из базы читается только строка пользователя
+        и, если у пользователя есть отправитель, трек-номер отправителя — оба запроса
+        к таблице users по индексу; получатель, отправитель и пожелания берутся из кэша.
+        Без кэша всё читается одним запросом с соединением таблиц.
+
+        Args:
+            user_id (int): Идентификатор пользователя.
+
+        Returns:
+            UserContext: Данные пользователя, его получателя и отправителя.
+        """
+        if self.form_cache is None:
+            return self._load_context_joined(user_id)
+        with self.connection:
+            row = self.cursor.execute(sql_query_load_user, (user_id,)).fetchone()
+            if row is None:
+                return UserContext()
+            signup, vk_id, track_number = row
+            vk_id = '' if vk_id is None else str(vk_id)
+            if not vk_id:
+                return UserContext(signup=str(signup), track_number=str(track_number))
+            sent_to_id = self.form_cache.get_send_to_id(vk_id)
+            wishes = self.form_cache.get_google_form_columns(sent_to_id) if sent_to_id else ()
+            sender_track_number = ''
+            sender_vk_id = self.form_cache.get_vk_sender_key(vk_id)
+            if sender_vk_id:
+                sender = self.cursor.execute(sql_query_get_track_via_vk, (sender_vk_id,)).fetchone()
+                if sender is not None and sender[0] is not None:
+                    sender_track_number = str(sender[0])
+            return UserContext(signup=str(signup),
+                               vk_id=vk_id,
+                               track_number=str(track_number),
+                               in_google_form=self.form_cache.is_in_google_form(vk_id),
+                               sent_to_id=sent_to_id,
+                               sender_track_number=sender_track_number,
+                               wishes=tuple(wishes))
+
+    def _load_context_joined(self, user_id):
+        with self.connection:
+            row = self.cursor.execute(sql_query_load_context, (user_id,)).fetchone()
+            if row is None:
+                return UserContext()
+            signup, vk_id, track_number, in_google_form, sent_to_id, sender_track_number = row[:6]
+            return UserContext(signup=str(signup),
+                               vk_id='' if vk_id is None else str(vk_id),
+                               track_number=str(track_number),
+                               in_google_form=bool(in_google_form),
+                               sent_to_id='' if sent_to_id is None else str(sent_to_id),
+                               sender_track_number='' if sender_track_number is None else str(sender_track_number),
+                               wishes=tuple(row[6:]) if row[6] is not None else ())
+
     def get_google_form_columns(self, vk_id):
         """Возвращает список данных из Google-формы для пользователя.
 
@@ -209,6 +310,8 @@ class Database:
         Returns:
             list: Список данных из Google-формы.
         """
+        if self.form_cache is not None:
+            return self.form_cache.get_google_form_columns(vk_id)
         wish_list = []
         with self.connection:
             result = self.cursor.execute(sql_query_get_from_sheet, (vk_id, )).fetchall()
@@ -232,6 +335,7 @@ class DBMigration:
         """
         self.connection = sqlite3.Connection(db_path)
         self.cursor = self.connection.cursor()
+        self.schema_version = migrate_schema(self.connection)
 
     def add_user(self, vk_id, send_to_id, name, address,
                  post_index, new_year_attr, new_year_doings,
@@ -260,11 +364,184 @@ class DBMigration:
                                                            best_song, best_dish, best_flashback, decorations,
                                                            rabbit_gift,))
 
+    def add_users(self, rows):
+        """Добавляет или обновляет пачку пользователей Google-формы одной транзакцией.
+
+        Повторная загрузка тех же данных не создаёт дубликатов: строка с уже
+        существующим VK ID перезаписывается.
+
+        Args:
+            rows (list): Кортежи значений в порядке аргументов add_user.
+
+        Returns:
+            int: Количество загруженных строк.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN")
+            return self.cursor.executemany(sql_query_upsert_google_form, rows).rowcount
+
+    @contextlib.contextmanager
+    def bulk_load(self):
+        """Контекст для массовой загрузки: на время загрузки отключает ожидание записи на диск.
+
+        При сбое посреди загрузки база может остаться неполной, поэтому загрузку
+        после сбоя нужно просто повторить — add_users идемпотентен.
+        """
+        synchronous = self.connection.execute("PRAGMA synchronous").fetchone()[0]
+        cache_size = self.connection.execute("PRAGMA cache_size").fetchone()[0]
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("PRAGMA cache_size = -65536")
+        try:
+            yield self
+        finally:
+            self.connection.execute(f"PRAGMA synchronous = {synchronous:d}")
+            self.connection.execute(f"PRAGMA cache_size = {cache_size:d}")
+
+
+def migrate_schema(connection):
+    """Применяет к базе данных ещё не применённые миграции схемы.
+
+    Номер последней применённой миграции хранится в `PRAGMA user_version`,
+    каждая миграция выполняется в отдельной транзакции вместе с обновлением номера.
+
+    Args:
+        connection (sqlite3.Connection): Соединение с базой данных.
+
+    Returns:
+        int: Версия схемы после применения миграций.
+    """
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(schema_migrations[version:], start=version + 1):
+        with connection:
+            connection.execute("BEGIN")
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {number:d}")
+        version = number
+    return version
+
+
+def _normalize_vk_id_statements(table, column, verb='UPDATE'):
+    """Возвращает запросы, приводящие VK ID в столбце к виду validators.normalize_vk_id.
+
+    Шаги повторяют normalize_vk_id: строчные буквы без пробелов по краям, без адреса
+    страницы (https://, m., vk.com/ или vk.ru/), @ и завершающей /; числовой
+    идентификатор записывается как id<число>.
+
+    Args:
+        table (str): Таблица.
+        column (str): Столбец с VK ID.
+        verb (str): Начало запроса изменения, например 'UPDATE OR IGNORE'.
+
+    Returns:
+        tuple: SQL-запросы.
+    """
+    update = f"{verb} `{table}` SET `{column}` = "
+    value = f"`{column}`"
+    page = f"substr({value}, instr({value}, '://') + 3)"
+    return (
+        f"{update}lower(trim({value})) WHERE {value} != lower(trim({value}))",
+        f"{update}{page} WHERE ({value} LIKE 'http://%' OR {value} LIKE 'https://%') AND ("
+        + ' OR '.join(f"{page} LIKE '{prefix}%'" for prefix in ('vk.com/', 'vk.ru/', 'm.vk.com/', 'm.vk.ru/')) + ")",
+        f"{update}substr({value}, 3) WHERE {value} LIKE 'm.vk.com/%' OR {value} LIKE 'm.vk.ru/%'",
+        f"{update}substr({value}, instr({value}, '/') + 1) WHERE {value} LIKE 'vk.com/%' OR {value} LIKE 'vk.ru/%'",
+        f"{update}substr({value}, 2) WHERE {value} LIKE '@%'",
+        f"{update}substr({value}, 1, length({value}) - 1) WHERE {value} LIKE '_%/'",
+        f"{update}'id' || {value} WHERE {value} GLOB '[1-9]*' AND {value} NOT GLOB '*[^0-9]*' "
+        f"AND length({value}) <= 12",
+    )
+
+
+# миграции схемы: i-й элемент переводит базу с версии i на версию i + 1
+schema_migrations = (
+    # 1: покрывающие индексы для всех путей поиска в Database
+    ("CREATE INDEX IF NOT EXISTS `idx_users_user_id` ON `users` (`user_id`, `signup`, `vk_id`, `track_number`)",
+     "CREATE INDEX IF NOT EXISTS `idx_users_vk_id` ON `users` (`vk_id`, `user_id`)",
+     "CREATE INDEX IF NOT EXISTS `idx_google_form_sent_to_id` ON `google_form` (`sent_to_id`, `vk_id`)"),
+    # 2: служебная таблица и версия google_form, которую увеличивает любое её изменение
+    ("CREATE TABLE IF NOT EXISTS `bot_meta` (`key` TEXT PRIMARY KEY, `value`)",
+     "INSERT OR IGNORE INTO `bot_meta` (`key`, `value`) VALUES ('google_form_version', 0)",
+     "CREATE TRIGGER IF NOT EXISTS `trg_google_form_insert` AFTER INSERT ON `google_form` BEGIN "
+     "UPDATE `bot_meta` SET `value` = `value` + 1 WHERE `key` = 'google_form_version'; END",
+     "CREATE TRIGGER IF NOT EXISTS `trg_google_form_update` AFTER UPDATE ON `google_form` BEGIN "
+     "UPDATE `bot_meta` SET `value` = `value` + 1 WHERE `key` = 'google_form_version'; END",
+     "CREATE TRIGGER IF NOT EXISTS `trg_google_form_delete` AFTER DELETE ON `google_form` BEGIN "
+     "UPDATE `bot_meta` SET `value` = `value` + 1 WHERE `key` = 'google_form_version'; END"),
+    # 3: состояния конечного автомата (FSM)
+    ("CREATE TABLE IF NOT EXISTS `fsm_storage` (`chat` TEXT NOT NULL, `user` TEXT NOT NULL, `state` TEXT, "
+     "`data` TEXT NOT NULL DEFAULT '{}', `bucket` TEXT NOT NULL DEFAULT '{}', `updated_at` REAL NOT NULL, "
+     "PRIMARY KEY (`chat`, `user`))",
+     "CREATE INDEX IF NOT EXISTS `idx_fsm_storage_updated_at` ON `fsm_storage` (`updated_at`)"),
+    # 4: контрольные точки рассылок
+    ("CREATE TABLE IF NOT EXISTS `broadcast_progress` (`name` TEXT PRIMARY KEY, `last_id` INTEGER NOT NULL DEFAULT 0, "
+     "`sent` INTEGER NOT NULL DEFAULT 0, `failed` INTEGER NOT NULL DEFAULT 0, `started_at` REAL NOT NULL, "
+     "`finished_at` REAL)",),
+    # 5: один пользователь — одна строка; дубликаты от одновременных /start одинаковы, остаётся первая
+    ("DELETE FROM `users` WHERE `id` NOT IN (SELECT MIN(`id`) FROM `users` GROUP BY `user_id`)",
+     "CREATE UNIQUE INDEX IF NOT EXISTS `idx_users_user_id_unique` ON `users` (`user_id`)"),
+    # 6: статусы посылок, полученные службой отслеживания (tracking.py)
+    ("CREATE TABLE IF NOT EXISTS `parcel_status` (`track_number` TEXT PRIMARY KEY, `status` TEXT NOT NULL, "
+     "`description` TEXT NOT NULL DEFAULT '', `final` INTEGER NOT NULL DEFAULT 0, `checked_at` REAL NOT NULL, "
+     "`changed_at` REAL NOT NULL)",
+     "CREATE INDEX IF NOT EXISTS `idx_users_track_number` ON `users` (`track_number`)"),
+    # 7: VK ID, сохранённые до normalize_vk_id, — в том виде, в котором их теперь записывают бот и генератор;
+    # строка анкеты, VK ID которой совпал с уже записанным, остаётся как была (её покажет /check_pairs)
+    _normalize_vk_id_statements('users', 'vk_id')
+    + _normalize_vk_id_statements('google_form', 'vk_id', 'UPDATE OR IGNORE')
+    + _normalize_vk_id_statements('google_form', 'sent_to_id'),
+    # 8: входящая очередь обновлений, полученных в режиме long polling, но ещё не обработанных (polling.py)
+    ("CREATE TABLE IF NOT EXISTS `update_inbox` (`update_id` INTEGER PRIMARY KEY, `body` TEXT NOT NULL)",),
+    # 9: поиск по user_id обслуживает покрывающий индекс из миграции 1, а уникальный из миграции 5 только
+    # не даёт появиться второй строке пользователя; в базах, где прежняя миграция 9 удалила покрывающий, он создаётся
+    ("CREATE INDEX IF NOT EXISTS `idx_users_user_id` ON `users` (`user_id`, `signup`, `vk_id`, `track_number`)",),
+)
+
+sql_query_get_meta = "SELECT `value` FROM `bot_meta` WHERE `key` = ?"
+
+sql_query_set_meta = "INSERT INTO `bot_meta` (`key`, `value`) VALUES (?, ?) ON CONFLICT (`key`) DO UPDATE SET\
+ `value` = excluded.`value`"
+
+sql_query_add_user = "INSERT INTO `users` (`user_id`) VALUES (:user_id) ON CONFLICT (`user_id`) DO NOTHING"
+
+sql_query_user_exists = "SELECT 1 FROM `users` WHERE `user_id` = ? LIMIT 1"
+
+sql_query_known_users = "SELECT DISTINCT `user_id` FROM `users` ORDER BY `user_id`"
+
+sql_query_set_vk_id = "UPDATE `users` SET `vk_id` = :vk_id WHERE `user_id` = :user_id"
+
+sql_query_set_signup = "UPDATE `users` SET `signup` = :signup WHERE `user_id` = :user_id"
+
+sql_query_set_track_number = "UPDATE `users` SET `track_number` = :tracker WHERE `user_id` = :user_id"
 
 sql_query_migrate = """INSERT INTO `google_form` (`vk_id`, `sent_to_id`, `name`, `address`, `post_index`, \
  `new_year_attr`, `new_year_doings`, `best_gift`, `best_film`, `best_song`, `best_dish`, `best_flashback`, \
  `decorations`, `rabbit_gift`) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
 
+sql_query_upsert_google_form = sql_query_migrate + """ ON CONFLICT (`vk_id`) DO UPDATE SET \
+ `sent_to_id` = excluded.`sent_to_id`, `name` = excluded.`name`, `address` = excluded.`address`, \
+ `post_index` = excluded.`post_index`, `new_year_attr` = excluded.`new_year_attr`, \
+ `new_year_doings` = excluded.`new_year_doings`, `best_gift` = excluded.`best_gift`, \
+ `best_film` = excluded.`best_film`, `best_song` = excluded.`best_song`, `best_dish` = excluded.`best_dish`, \
+ `best_flashback` = excluded.`best_flashback`, `decorations` = excluded.`decorations`, \
+ `rabbit_gift` = excluded.`rabbit_gift`"""
+
 sql_query_get_from_sheet = """SELECT `name`, `address`, `post_index`, \
  `new_year_attr`, `new_year_doings`, `best_gift`, `best_film`, `best_song`, `best_dish`, `best_flashback`, \
  `decorations`, `rabbit_gift` FROM `google_form` WHERE `vk_id` = ?"""
+
+# здесь и в sql_query_load_context: без INDEXED BY SQLite выбирает уникальный индекс по user_id
+# и читает ещё и строку таблицы
+sql_query_load_user = "SELECT `signup`, `vk_id`, `track_number` FROM `users` INDEXED BY `idx_users_user_id` \
+ WHERE `user_id` = ?"
+
+sql_query_get_track_via_vk = "SELECT `track_number` FROM `users` WHERE `vk_id` = ? LIMIT 1"
+
+sql_query_load_context = """SELECT u.`signup`, u.`vk_id`, u.`track_number`, f.`vk_id` IS NOT NULL, f.`sent_to_id`, \
+ s.`track_number`, w.`name`, w.`address`, w.`post_index`, w.`new_year_attr`, w.`new_year_doings`, w.`best_gift`, \
+ w.`best_film`, w.`best_song`, w.`best_dish`, w.`best_flashback`, w.`decorations`, w.`rabbit_gift` \
+ FROM `users` AS u INDEXED BY `idx_users_user_id` \
+ LEFT JOIN `google_form` AS f ON f.`vk_id` = u.`vk_id` \
+ LEFT JOIN `google_form` AS sf ON sf.`sent_to_id` = u.`vk_id` \
+ LEFT JOIN `users` AS s ON s.`vk_id` = sf.`vk_id` \
+ LEFT JOIN `google_form` AS w ON w.`vk_id` = f.`sent_to_id` \
+ WHERE u.`user_id` = ? LIMIT 1"""
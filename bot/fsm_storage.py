@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль хранилища состояний конечного автомата (FSM) в SQLite.
+
+Содержит класс SQLiteStorage — хранилище aiogram, которое держит состояния в памяти,
+пачками сохраняет изменения в таблицу fsm_storage базы данных бота и забывает
+брошенные диалоги по истечении заданного времени.
+"""
+
+import asyncio
+import copy
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from db import Database
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в файле базы данных бота.
+
+    Все операции обслуживаются из памяти. Изменённые записи раз в `flush_interval`
+    секунд одной транзакцией сохраняются в таблицу fsm_storage, а при запуске
+    загружаются обратно, поэтому перезапуск бота не сбрасывает начатые диалоги.
+    Записи, к которым не обращались дольше `ttl` секунд, считаются пустыми
+    и удаляются и из памяти, и из базы.
+
+    Если задан `writer`, хранилище открывает базу только для чтения, а изменения
+    отправляет через него, — так несколько процессов бота пишут через один поток записи.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite.
+        ttl (float): Время жизни неиспользуемой записи, в секундах.
+        flush_interval (float): Период сохранения изменений, в секундах.
+        writer: Объект записи с методом submit, например RemoteWriter (None — писать самому).
+        owns (Callable): Загружать только записи пользователей, для которых `owns(user_id)` истинно
+            (None — все записи).
+    """
+
+    def __init__(self, db_path, ttl=7 * 24 * 60 * 60, flush_interval=1.0, writer=None, owns=None):
+        """Открывает соединение в отдельном потоке и загружает неистёкшие записи.
+
+        Args:
+            db_path (str): Путь к файлу базы данных SQLite.
+            ttl (float): Время жизни неиспользуемой записи, в секундах.
+            flush_interval (float): Период сохранения изменений, в секундах.
+            writer: Объект записи с методом submit (None — писать самому).
+            owns (Callable): Фильтр загружаемых записей по идентификатору пользователя.
+        """
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._db_path = db_path
+        self._writer = writer
+        self._owns = owns
+        self._records = {}
+        self._dirty = set()
+        self._flusher = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-storage')
+        self._executor.submit(self._load).result()
+
+    def _load(self):
+        self._connection = Database(self._db_path, read_only=self._writer is not None).connection
+        expired = time.time() - self.ttl
+        if self._writer is None:
+            with self._connection:
+                self._connection.execute(sql_query_delete_expired, (expired,))
+        for chat, user, state, data, bucket, updated_at in self._connection.execute(
+                "SELECT `chat`, `user`, `state`, `data`, `bucket`, `updated_at` FROM `fsm_storage` "
+                "WHERE `updated_at` >= ?", (expired,)):
+            if self._owns is None or self._owns(int(user)):
+                self._records[(chat, user)] = [state, json.loads(data), json.loads(bucket), updated_at]
+
+    def _save(self, rows, expired):
+        if self._writer is not None:
+            # поток записи объединит изменения, пришедшие вместе, в одну транзакцию
+            futures = [self._writer.submit(sql_query_save_state, row) for row in rows if row[2] is not None]
+            futures += [self._writer.submit(sql_query_delete_state, row[:2]) for row in rows if row[2] is None]
+            futures.append(self._writer.submit(sql_query_delete_expired, (expired,)))
+            for future in futures:
+                future.result()
+            return
+        with self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(sql_query_save_state, [row for row in rows if row[2] is not None])
+            self._connection.executemany(sql_query_delete_state, [row[:2] for row in rows if row[2] is None])
+            self._connection.execute(sql_query_delete_expired, (expired,))
+
+    def _record(self, chat, user, create=False):
+        """Возвращает запись чата и пользователя, если она есть и не истекла.
+
+        Args:
+            chat: Идентификатор чата.
+            user: Идентификатор пользователя.
+            create (bool): Создать пустую запись, если её нет.
+        """
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+        record = self._records.get(key)
+        now = time.time()
+        if record is not None and now - record[3] > self.ttl:
+            del self._records[key]
+            self._dirty.add(key)
+            record = None
+        if record is None and create:
+            record = self._records[key] = [None, {}, {}, now]
+        if record is not None and create:
+            record[3] = now
+            self._dirty.add(key)
+            self._ensure_flusher()
+        return record
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Сохраняет накопленные изменения в базу одной транзакцией и удаляет истёкшие записи."""
+        now = time.time()
+        for key in [key for key, record in self._records.items() if now - record[3] > self.ttl]:
+            del self._records[key]
+            self._dirty.add(key)
+        if not self._dirty:
+            return
+        rows = []
+        for key in self._dirty:
+            record = self._records.get(key)
+            if record is not None and (record[0] is not None or record[1] or record[2]):
+                rows.append((*key, json.dumps(record[1]), json.dumps(record[2]), record[3], record[0]))
+            else:
+                self._records.pop(key, None)
+                rows.append((*key, None))
+        self._dirty.clear()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._save, rows, now - self.ttl)
+
+    def state_counts(self):
+        """Возвращает количество активных записей в каждом состоянии.
+
+        Returns:
+            dict: Словарь «состояние → количество записей».
+        """
+        counts = {}
+        for record in self._records.values():
+            if record[0] is not None:
+                counts[record[0]] = counts.get(record[0], 0) + 1
+        return counts
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await self.flush()
+
+    async def wait_closed(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._connection.close)
+        self._executor.shutdown(wait=True)
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        record = self._record(chat, user)
+        return record[0] if record is not None and record[0] is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        record = self._record(chat, user)
+        return copy.deepcopy(record[1]) if record is not None else copy.deepcopy(default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        self._record(chat, user, create=True)[0] = self.resolve_state(state)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        self._record(chat, user, create=True)[1] = copy.deepcopy(data or {})
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        if data is None:
+            data = {}
+        record = self._record(chat, user, create=True)
+        record[1].update(data, **kwargs)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        record = self._record(chat, user)
+        return copy.deepcopy(record[2]) if record is not None else copy.deepcopy(default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        self._record(chat, user, create=True)[2] = copy.deepcopy(bucket or {})
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        if bucket is None:
+            bucket = {}
+        record = self._record(chat, user, create=True)
+        record[2].update(bucket, **kwargs)
+
+
+sql_query_save_state = """INSERT INTO `fsm_storage` (`chat`, `user`, `data`, `bucket`, `updated_at`, `state`) \
+ VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (`chat`, `user`) DO UPDATE SET `state` = excluded.`state`, \
+ `data` = excluded.`data`, `bucket` = excluded.`bucket`, `updated_at` = excluded.`updated_at`"""
+
+sql_query_delete_state = "DELETE FROM `fsm_storage` WHERE `chat` = ? AND `user` = ?"
+
+sql_query_delete_expired = "DELETE FROM `fsm_storage` WHERE `updated_at` < ?"
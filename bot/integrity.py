@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль проверки распределения пар.
+
+Проверяет, что данные google_form, загруженные DBMigration, образуют правильное
+распределение: sent_to_id — перестановка vk_id без участников, дарящих самим себе,
+и сколько циклов она образует (генератор всегда строит один). Заодно ищет VK ID
+зарегистрированных пользователей, которых нет в анкете, и VK ID, под которыми
+зарегистрировались несколько пользователей.
+
+Идентификаторы читаются из базы одним проходом по каждой таблице. VK ID вида
+id<число> (так их хранит бот) сразу разбираются в целые числа, остальные
+сравниваются как строки; участники сопоставляются по хеш-индексу pandas,
+а дальше все проверки — векторные операции numpy над номерами.
+Модуль не зависит от остальных модулей бота и используется ботом (/check_pairs),
+скриптом scripts/check_pairs.py и проверкой генератора пар benchmarks/bench_pairing.py.
+"""
+
+import pathlib
+import sqlite3
+import time
+import warnings
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# разделитель значений в group_concat; если он встретится в самих VK ID, значения читаются построчно
+_separator = '\x1f'
+
+_powers_of_ten = 10 ** np.arange(19, dtype=np.int64)
+
+
+class PairingReport(NamedTuple):
+    """Результат проверки распределения пар.
+
+    Attributes:
+        participants (int): Количество строк google_form.
+        missing_receivers (tuple): VK ID отправителей, чьего получателя нет в анкете.
+        shared_receivers (tuple): VK ID получателей, которым дарят несколько отправителей.
+        unsent (tuple): VK ID участников, которым никто не дарит.
+        fixed_points (tuple): VK ID участников, дарящих самим себе.
+        cycles (int): Количество циклов распределения (None, если sent_to_id — не перестановка vk_id).
+        unknown_users (tuple): VK ID зарегистрированных пользователей, которых нет в анкете.
+        duplicate_registrations (tuple): VK ID, под которыми зарегистрировались несколько пользователей.
+        seconds (float): Время проверки.
+    """
+
+    participants: int
+    missing_receivers: tuple
+    shared_receivers: tuple
+    unsent: tuple
+    fixed_points: tuple
+    cycles: int
+    unknown_users: tuple
+    duplicate_registrations: tuple
+    seconds: float
+
+    @property
+    def is_permutation(self):
+        """bool: Каждый участник дарит ровно одному участнику и получает ровно от одного."""
+        return not (self.missing_receivers or self.shared_receivers or self.unsent)
+
+    @property
+    def ok(self):
+        """bool: Распределение правильное и все зарегистрированные пользователи есть в анкете по одному разу."""
+        return self.is_permutation and not (self.fixed_points or self.unknown_users or self.duplicate_registrations)
+
+    def problems(self):
+        """Возвращает найденные ошибки.
+
+        Returns:
+            list: Пары (название поля, VK ID) для непустых списков ошибок, в порядке полей.
+        """
+        names = ('missing_receivers', 'shared_receivers', 'unsent', 'fixed_points', 'unknown_users',
+                 'duplicate_registrations')
+        return [(name, getattr(self, name)) for name in names if getattr(self, name)]
+
+
+def count_cycles(receivers):
+    """Считает циклы перестановки удвоением указателей.
+
+    После k шагов каждый элемент знает наименьший номер среди 2^k элементов своего
+    цикла, начиная с себя, поэтому через ceil(log2 n) шагов — наименьший номер цикла;
+    циклов столько, сколько элементов, совпадающих с этим номером.
+
+    Args:
+        receivers (np.ndarray): Перестановка: элемент i переходит в receivers[i].
+
+    Returns:
+        int: Количество циклов.
+    """
+    n = len(receivers)
+    if not n:
+        return 0
+    # 32-битные номера вдвое сокращают обращения к памяти, а на них и уходит время
+    dtype = np.int32 if n < 2 ** 31 else np.int64
+    label = np.arange(n, dtype=dtype)
+    pointer = np.asarray(receivers, dtype=dtype)
+    for _ in range(max(1, int(np.ceil(np.log2(n))))):
+        np.minimum(label, label[pointer], out=label)
+        pointer = pointer[pointer]
+    return int(np.count_nonzero(label == np.arange(n, dtype=dtype)))
+
+
+def _numeric_ids(text, count):
+    """Разбирает склеенные group_concat VK ID вида id<число> в числа.
+
+    Args:
+        text (str): VK ID через _separator.
+        count (int): Количество VK ID.
+
+    Returns:
+        np.ndarray: Числа из VK ID или None, если хотя бы один VK ID записан иначе.
+    """
+    if not text.startswith('id') or text.count(_separator + 'id') != count - 1:
+        return None
+    # numpy 1.x на лишних символах предупреждает и возвращает прочитанное, новые версии бросают ValueError
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            numbers = np.fromstring(text[2:], dtype=np.int64, sep=_separator + 'id')
+        except ValueError:
+            return None
+    if len(numbers) != count or numbers.min() < 1:
+        return None
+    # без знаков, пробелов и ведущих нулей число занимает ровно столько символов, сколько в нём цифр
+    digits = int(np.searchsorted(_powers_of_ten, numbers, side='right').sum())
+    return numbers if digits + 3 * count - 1 == len(text) else None
+
+
+def _read_ids(connection, sql_concat, sql_rows):
+    """Читает столбцы VK ID одним запросом.
+
+    Returns:
+        list: Массивы чисел по столбцам, если все VK ID вида id<число>, иначе списки строк.
+    """
+    count, *columns = connection.execute(sql_concat).fetchone()
+    if not count:
+        return [np.zeros(0, dtype=np.int64) for _ in columns]
+    values = [_numeric_ids(column, count) for column in columns]
+    if all(numbers is not None for numbers in values):
+        return values
+    values = [column.split(_separator) for column in columns]
+    if any(len(column) != count for column in values):
+        rows = connection.execute(sql_rows).fetchall()
+        values = [list(column) for column in zip(*rows)]
+    return values
+
+
+def _as_strings(column):
+    if isinstance(column, np.ndarray):
+        return np.array([f'id{number}' for number in column.tolist()], dtype=object)
+    return np.array(column, dtype=object)
+
+
+def _names(keys):
+    if keys.dtype.kind == 'i':
+        return tuple(f'id{number}' for number in keys.tolist())
+    return tuple(keys)
+
+
+def check_pairs(db_path):
+    """Проверяет распределение пар в базе.
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite; открывается только для чтения.
+
+    Returns:
+        PairingReport: Результат проверки.
+    """
+    started = time.perf_counter()
+    connection = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        columns = _read_ids(connection, sql_query_form_ids, sql_query_form_rows)
+        columns += _read_ids(connection, sql_query_user_ids, sql_query_user_rows)
+    finally:
+        connection.close()
+    if not all(isinstance(column, np.ndarray) for column in columns):
+        columns = [_as_strings(column) for column in columns]
+    vk_ids, sent_to, user_ids = columns
+    n = len(vk_ids)
+    # vk_id — первичный ключ google_form, поэтому участник i получает номер i, а не найденные — -1
+    form = pd.Index(vk_ids)
+    receivers = form.get_indexer(sent_to)
+    users = form.get_indexer(user_ids)
+    in_form = receivers >= 0
+    received = np.bincount(receivers[in_form], minlength=n)
+    fixed = receivers == np.arange(n)
+    registered = np.bincount(users[users >= 0], minlength=n)
+    unknown, unknown_names = pd.factorize(user_ids[users < 0])
+    unknown_registered = np.bincount(unknown, minlength=len(unknown_names))
+    permutation = in_form.all() and (received == 1).all()
+    return PairingReport(
+        participants=n,
+        missing_receivers=_names(vk_ids[~in_form]),
+        shared_receivers=_names(vk_ids[received > 1]),
+        unsent=_names(vk_ids[received == 0]),
+        fixed_points=_names(vk_ids[fixed]),
+        cycles=count_cycles(receivers) if permutation else None,
+        unknown_users=_names(unknown_names),
+        duplicate_registrations=_names(vk_ids[registered > 1]) + _names(unknown_names[unknown_registered > 1]),
+        seconds=time.perf_counter() - started)
+
+
+sql_query_form_ids = "SELECT COUNT(*), group_concat(`vk_id`, char(31)), group_concat(`sent_to_id`, char(31)) \
+ FROM `google_form`"
+
+sql_query_form_rows = "SELECT `vk_id`, `sent_to_id` FROM `google_form`"
+
+sql_query_user_ids = "SELECT COUNT(*), group_concat(`vk_id`, char(31)) FROM `users` WHERE `vk_id` IS NOT NULL"
+
+sql_query_user_rows = "SELECT `vk_id` FROM `users` WHERE `vk_id` IS NOT NULL"
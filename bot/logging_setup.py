@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль настройки журналирования бота.
+
+Обработчики бота только кладут записи в ограниченную очередь (QueueHandler),
+а запись в файл и консоль выполняет отдельный поток QueueListener. Файл журнала
+ротируется по размеру и содержит записи в формате JSON по одной на строку.
+Если очередь переполнена, записи отбрасываются, а их количество сообщается
+одной сводной записью, как только в очереди появится место.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+
+
+_exception_formatter = logging.Formatter()
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи пользователя и обработчик aiogram, в контексте которых она создана.
+
+    Фильтр выполняется в потоке, создавшем запись, поэтому видит переменные
+    контекста aiogram; поля user_id и handler остаются None вне обработки обновления.
+    """
+
+    def filter(self, record):
+        if not hasattr(record, 'user_id'):
+            user = types.User.get_current()
+            record.user_id = user.id if user is not None else None
+        if not hasattr(record, 'handler'):
+            handler = current_handler.get(None)
+            record.handler = getattr(handler, '__name__', None)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись как JSON-объект в одну строку.
+
+    Поля user_id, handler и latency попадают в объект, только если они заданы.
+    """
+
+    fields = ('user_id', 'handler', 'latency')
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{record.msecs:03.0f}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in self.fields:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не ждёт места в заполненной очереди.
+
+    Запись, не поместившаяся в очередь, отбрасывается; количество отброшенных
+    записей передаётся сводной записью уровня WARNING перед следующей принятой.
+
+    Attributes:
+        dropped (int): Количество записей, отброшенных с момента последней сводки.
+        dropped_total (int): Количество записей, отброшенных за всё время.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.dropped_total = 0
+
+    def prepare(self, record):
+        # сообщение и трассировка форматируются здесь, чтобы в очередь не попали аргументы и объекты исключений
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record())
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self.dropped_total += 1
+
+    def _dropped_record(self):
+        return logging.LogRecord('logging_setup', logging.WARNING, __file__, 0,
+                                 'Log queue was full, %d records dropped', (self.dropped,), None)
+
+
+def setup_logging(path='./logs/bot-info.log', level=logging.INFO, max_bytes=10 * 1024 * 1024, backups=5,
+                  queue_size=10000):
+    """Настраивает корневой журнал: очередь записей и поток, пишущий их в файл и консоль.
+
+    Args:
+        path (str): Путь к файлу журнала.
+        level (int): Уровень журналирования.
+        max_bytes (int): Размер файла, после которого он ротируется.
+        backups (int): Сколько старых файлов журнала хранить.
+        queue_size (int): Наибольшее число записей в очереди.
+
+    Returns:
+        logging.handlers.QueueListener: Запущенный поток записи; допишет очередь и остановится при выходе.
+    """
+    file_log = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                    encoding='utf-8')
+    file_log.setFormatter(JsonFormatter())
+    console_out = logging.StreamHandler()
+    console_out.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    logging.basicConfig(handlers=(queue_handler,), level=level)
+
+    listener = logging.handlers.QueueListener(log_queue, file_log, console_out, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
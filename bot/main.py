@@ -7,60 +7,209 @@
     - Конечные автоматы (FSM): 
         • Registration: процесс регистрации через VK ID
         • Tracking: установка трек-номера
-    - Интеграция с БД SQLite через класс Database
-    - Система логирования в файл и консоль
+      Состояния хранятся в базе данных (SQLiteStorage) и переживают перезапуск бота
+    - Интеграция с БД SQLite через класс AsyncDatabase (асинхронная обёртка над Database)
+    - Система логирования в файл (JSON, с ротацией) и консоль через очередь, не блокирующую обработчики
+    - Метрики: задержки обработчиков и запросов к БД, состояния FSM, очередь отправки (metrics.py)
+    - Режимы запуска (переменная RUN_MODE в .env): long polling (по умолчанию) или webhook;
+      в режиме long polling обновления, пришедшие за время простоя, обрабатываются после запуска;
+      несколько процессов — через cluster.py, который импортирует этот модуль в каждом обработчике
 """
 
 import os
+import asyncio
 import logging
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, executor, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram import Bot, Dispatcher, types
 from aiogram.dispatcher import FSMContext
 
+import cluster
 import config
+import integrity
+import validators
 from states import Registration, Tracking
 import markups as nav
 from markups import Buttons as Bt
+from async_db import AsyncDatabase
 from db import Database
+from metrics import Metrics
+from logging_setup import setup_logging
+from cache import TaskMessageCache
+from fsm_storage import SQLiteStorage
+from webhook import start_webhook
+from polling import start_polling
+from sender import SendScheduler
+from broadcast import Broadcaster
+from tracking import HttpTrackingClient, TrackingService
+from router import Router
 
 
 load_dotenv('./.env')
 token = os.getenv('TOKEN')
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-console_out = logging.StreamHandler()
-file_log = logging.FileHandler("./logs/bot-info.log")
-file_log.setFormatter(formatter)
-console_out.setFormatter(formatter)
-logging.basicConfig(handlers=(file_log, console_out), level=logging.INFO)
+setup_logging(os.getenv('LOG_FILE', './logs/bot-info.log'), queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+
+# в процессе-обработчике кластера изменения базы выполняет общий процесс записи
+writer = cluster.worker.writer if cluster.worker is not None else None
+owns = cluster.worker.owns if cluster.worker is not None else None
 
 bot = Bot(token)
-storage = MemoryStorage()
+storage = SQLiteStorage('./data/database.db', writer=writer, owns=owns)
 dp = Dispatcher(bot, storage=storage)
-db = Database('./data/database.db')
+sender = SendScheduler(bot, global_rate=float(os.getenv('SEND_RATE', 30)))
+form_cache_size = os.getenv('FORM_CACHE_SIZE')
+db = AsyncDatabase('./data/database.db', form_cache_size=int(form_cache_size) if form_cache_size else None,
+                   writer=writer)
+task_messages = TaskMessageCache(db.form_cache, config.render_task_message, config.task_template_version)
+broadcaster = Broadcaster(db, sender, task_messages)
+# отслеживание посылок включается, если задан адрес API отслеживания
+tracking_url = os.getenv('TRACKING_API_URL')
+tracking = TrackingService(
+    db, sender, HttpTrackingClient(tracking_url, token=os.getenv('TRACKING_API_TOKEN'),
+                                   batch_size=int(os.getenv('TRACKING_BATCH_SIZE', 50)),
+                                   concurrency=int(os.getenv('TRACKING_CONCURRENCY', 4))),
+    interval=float(os.getenv('TRACKING_INTERVAL', 1800)),
+    ttl=float(os.getenv('TRACKING_TTL', 3600))) if tracking_url else None
+admin_ids = {int(i) for i in os.getenv('ADMIN_IDS', '').split(',') if i.strip()}
+# кнопки меню: один обработчик в диспетчере, дальше — поиск по тексту кнопки
+router = Router(db.load_context, unregistered=lambda msg: sender.reply(
+    msg.from_user.id, config.registration_empty, reply_markup=nav.main_menu),
+    debounce_window=float(os.getenv('DEBOUNCE_SECONDS', 3)))
+
+metrics = Metrics()
+metrics.instrument_class(Database, 'db_query')
+metrics.instrument_class(AsyncDatabase, 'db_call')
+metrics.instrument_class(HttpTrackingClient, 'tracking_api')
+metrics.gauge('fsm_users', storage.state_counts, label='state')
+metrics.gauge('send_queue_depth', lambda: sender.stats.waiting)
+metrics.gauge('messages_sent_total', lambda: sender.stats.sent, kind='counter')
+metrics.gauge('messages_failed_total', lambda: sender.stats.failed, kind='counter')
+metrics.gauge('send_retries_total', lambda: sender.stats.retries, kind='counter')
+metrics.gauge('db_writer_batches_total', lambda: db.writer_stats.batches, kind='counter')
+metrics.gauge('db_writer_writes_total', lambda: db.writer_stats.operations, kind='counter')
+metrics.gauge('debounced_presses_total', lambda: router.debounce_stats.suppressed, kind='counter')
+metrics.gauge('debounce_saved_reads_total', lambda: router.debounce_stats.saved_reads, kind='counter')
+metrics.gauge('debounce_saved_sends_total', lambda: router.debounce_stats.saved_sends, kind='counter')
+
+# фоновые задачи обработчиков; цикл событий хранит только слабые ссылки на задачи
+background_tasks = set()
+
+
+def run_in_background(coro):
+    """Запускает корутину отдельной задачей, не дожидаясь её завершения.
+
+    Задача хранится в background_tasks до завершения, а её ошибка записывается в журнал.
+
+    Args:
+        coro: Корутина.
+
+    Returns:
+        asyncio.Task: Запущенная задача.
+    """
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+def _background_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error('Background task %s failed', task.get_name(), exc_info=task.exception())
 
 
 @dp.message_handler(commands=['start'])
 async def get_started(msg: types.Message):
     """Обработчик команды /start.
 
-    Проверяет наличие пользователя в базе данных:
-    - Если пользователь новый — добавляет его и отправляет стартовое сообщение.
+    Проверяет наличие пользователя: сначала в памяти (db.known_users), затем
+    добавлением в базу, которое не создаёт вторую строку для того же пользователя:
+    - Если пользователь новый — он добавлен, отправляется стартовое сообщение.
     - Если пользователь уже существует — отправляет соответствующее сообщение.
 
     Args:
         msg (types.Message): Объект сообщения от пользователя.
     """
-    if not db.user_exists(msg.from_user.id):
-        db.add_user(msg.from_user.id)
+    if msg.from_user.id not in db.known_users and await db.add_user(msg.from_user.id):
         logging.info(config.new_user % msg.from_user.id)
-        await bot.send_message(msg.from_user.id, config.start_message, reply_markup=nav.main_menu)
+        await sender.reply(msg.from_user.id, config.start_message, reply_markup=nav.main_menu)
+    else:
+        await sender.reply(msg.from_user.id, config.usr_exists_message, reply_markup=nav.main_menu)
+
+
+@dp.message_handler(lambda message: message.from_user.id in admin_ids, commands=['broadcast'])
+async def broadcast(msg: types.Message):
+    """Обработчик команды /broadcast (только для администраторов).
+
+    Запускает в фоне рассылку заданий (/broadcast tasks) или трек-номеров
+    (/broadcast tracks) и сообщает администратору о её завершении.
+
+    Args:
+        msg (types.Message): Объект сообщения от пользователя.
+    """
+    args = msg.get_args().split()
+    kind = args[0] if args else ''
+    if kind not in Broadcaster.kinds:
+        await sender.reply(msg.from_user.id, config.broadcast_usage)
+    elif broadcaster.is_running(kind):
+        await sender.reply(msg.from_user.id, config.broadcast_running.format(kind=kind))
+    else:
+        task = broadcaster.start(kind, restart='restart' in args[1:])
+        run_in_background(report_broadcast(msg.from_user.id, kind, task))
+
+
+async def report_broadcast(admin_id, kind, task):
+    """Сообщает администратору о запуске и результате рассылки.
+
+    Args:
+        admin_id (int): Идентификатор администратора, запустившего рассылку.
+        kind (str): Вид рассылки.
+        task (asyncio.Task): Задача рассылки.
+    """
+    await sender.send_message(admin_id, config.broadcast_started.format(kind=kind))
+    result = await task
+    if result is None:
+        await sender.send_message(admin_id, config.broadcast_already.format(kind=kind))
+    else:
+        await sender.send_message(admin_id, config.broadcast_finished.format(kind=kind, sent=result[0],
+                                                                             failed=result[1]))
+
+
+@dp.message_handler(lambda message: message.from_user.id in admin_ids, commands=['check_pairs'])
+async def check_pairs(msg: types.Message):
+    """Обработчик команды /check_pairs (только для администраторов).
+
+    Запускает проверку распределения пар фоновой задачей: на большой базе она
+    идёт секунды, и обработчик не должен задерживать остальные обновления.
+
+    Args:
+        msg (types.Message): Объект сообщения от пользователя.
+    """
+    run_in_background(report_pairs(msg.from_user.id))
+
+
+async def report_pairs(admin_id):
+    """Проверяет распределение пар в базе (integrity.check_pairs) в отдельном потоке
+    и присылает администратору найденные ошибки.
+
+    Args:
+        admin_id (int): Идентификатор администратора, запросившего проверку.
+    """
+    report = await asyncio.get_running_loop().run_in_executor(None, integrity.check_pairs, './data/database.db')
+    if report.ok:
+        lines = [config.check_pairs_ok.format(participants=report.participants, cycles=report.cycles,
+                                              seconds=report.seconds)]
     else:
-        await bot.send_message(msg.from_user.id, config.usr_exists_message, reply_markup=nav.main_menu)
+        lines = [config.check_pairs_failed.format(participants=report.participants, seconds=report.seconds)]
+        lines += [config.check_pairs_problem.format(title=config.check_pairs_titles[name], count=len(vk_ids),
+                                                    examples=', '.join(vk_ids[:5]))
+                  for name, vk_ids in report.problems()]
+    if report.cycles is not None and report.cycles > 1:
+        lines.append(config.check_pairs_cycles.format(cycles=report.cycles))
+    await sender.send_message(admin_id, '\n'.join(lines))
 
 
-@dp.message_handler(lambda message: message.text == Bt.REGISTRY)
+@router.route(Bt.REGISTRY)
 async def registration(msg: types.Message):
     """ Обработчик кнопки регистрации.
 
@@ -70,7 +219,7 @@ async def registration(msg: types.Message):
     Args:
         msg (types.Message): Объект сообщения от пользователя.
     """
-    await bot.send_message(msg.from_user.id, config.registration_message, reply_markup=nav.back_menu)
+    await sender.reply(msg.from_user.id, config.registration_message, reply_markup=nav.back_menu)
     await Registration.vk_id.set()
 
 
@@ -89,25 +238,26 @@ async def vk_id_processing(msg: types.Message, state: FSMContext):
         state (FSMContext): Состояние конечного автомата (FSM).
     """
     if msg.text != Bt.BACK:
-        if db.get_signup(msg.from_user.id) == 'setvkid':
-            if config.is_allowed(msg.text):
-                db.set_vk_id(msg.from_user.id, msg.text)
-                db.set_signup(msg.from_user.id, 'complete')
-                logging.info(config.new_vk_id % (msg.from_user.id, msg.text))
-                await bot.send_message(msg.from_user.id, config.registration_success, reply_markup=nav.main_menu)
-                await state.finish()
-            else:
-                await bot.send_message(msg.from_user.id, config.registration_failed)
-                await Registration.vk_id.set()
+        vk_id = validators.normalize_vk_id(msg.text)
+        if vk_id is None:
+            await sender.reply(msg.from_user.id, config.registration_failed)
+            await Registration.vk_id.set()
+        elif not (await db.load_context(msg.from_user.id)).registered:
+            await asyncio.gather(db.set_vk_id(msg.from_user.id, vk_id),
+                                 db.set_signup(msg.from_user.id, 'complete'))
+            logging.info(config.new_vk_id % (msg.from_user.id, vk_id))
+            router.forget(msg.from_user.id)
+            await sender.reply(msg.from_user.id, config.registration_success, reply_markup=nav.main_menu)
+            await state.finish()
         else:
-            await bot.send_message(msg.from_user.id, config.registration_already, reply_markup=nav.main_menu)
+            await sender.reply(msg.from_user.id, config.registration_already, reply_markup=nav.main_menu)
             await state.finish()
     else:
-        await bot.send_message(msg.from_user.id, config.back_to_menu_message, reply_markup=nav.main_menu)
+        await sender.reply(msg.from_user.id, config.back_to_menu_message, reply_markup=nav.main_menu)
         await state.finish()
 
 
-@dp.message_handler(lambda message: message.text == Bt.SET_TRACKER)
+@router.route(Bt.SET_TRACKER)
 async def set_track_number(msg: types.Message):
     """
     Обработчик кнопки установки трек-номера.
@@ -118,7 +268,7 @@ async def set_track_number(msg: types.Message):
     Args:
         msg (types.Message): Объект сообщения от пользователя.
     """
-    await bot.send_message(msg.from_user.id, config.track_message, reply_markup=nav.back_menu)
+    await sender.reply(msg.from_user.id, config.track_message, reply_markup=nav.back_menu)
     await Tracking.set_track_number.set()
 
 
@@ -137,110 +287,88 @@ async def track_number_processing(msg: types.Message, state: FSMContext):
         state (FSMContext): Состояние конечного автомата (FSM).
     """
     if msg.text != Bt.BACK:
-        if db.get_signup(msg.from_user.id) != 'setvkid':
-            if db.get_track_number(msg.from_user.id) == 'notimplemented':
-                if config.track_is_true(msg.text):
-                    db.set_track_number(msg.from_user.id, msg.text)
-                    logging.info(config.new_tracker % (msg.from_user.id, msg.text))
-                    await bot.send_message(msg.from_user.id, config.track_success_updated, reply_markup=nav.main_menu)
-                    await state.finish()
-                else:
-                    await bot.send_message(msg.from_user.id, config.track_failed)
-                    await Tracking.set_track_number.set()
-            else:
-                await bot.send_message(msg.from_user.id, config.track_already, reply_markup=nav.main_menu)
-                await state.finish()
+        track_number = validators.normalize_track_number(msg.text)
+        context = None if track_number is None else await db.load_context(msg.from_user.id)
+        if context is None:
+            await sender.reply(msg.from_user.id, config.track_failed)
+            await Tracking.set_track_number.set()
+        elif not context.registered:
+            await sender.reply(msg.from_user.id, config.registration_empty, reply_markup=nav.main_menu)
+            await state.finish()
+        elif context.track_number == 'notimplemented':
+            await db.set_track_number(msg.from_user.id, track_number)
+            logging.info(config.new_tracker % (msg.from_user.id, track_number))
+            run_in_background(broadcaster.notify_track(msg.from_user.id, track_number))
+            await sender.reply(msg.from_user.id, config.track_success_updated, reply_markup=nav.main_menu)
+            await state.finish()
         else:
-            await bot.send_message(msg.from_user.id, config.registration_empty, reply_markup=nav.main_menu)
+            await sender.reply(msg.from_user.id, config.track_already, reply_markup=nav.main_menu)
             await state.finish()
     else:
-        await bot.send_message(msg.from_user.id, config.back_to_menu_message, reply_markup=nav.main_menu)
+        await sender.reply(msg.from_user.id, config.back_to_menu_message, reply_markup=nav.main_menu)
         await state.finish()
 
 
-@dp.message_handler(lambda message: message.text == Bt.GET_HELP)
+@router.route(Bt.GET_HELP, private=True)
 async def get_help(msg: types.Message):
-    """Обработчик кнопки получения помощи.
+    """Обработчик кнопки получения помощи (только в личном чате).
 
     Отправляет пользователю сообщение с инструкцией или справкой.
 
     Args:
         msg (types.Message): Объект сообщения от пользователя.
     """
-    if msg.chat.type == 'private':
-        await bot.send_message(msg.from_user.id, config.help_message)
+    await sender.reply(msg.from_user.id, config.help_message)
 
 
-@dp.message_handler(lambda message: message.text == Bt.GET_TRACKER)
-async def get_tracker(msg: types.Message):
-    """Обработчик кнопки получения трек-номера.
+@router.route(Bt.GET_TRACKER, private=True, registered=True, debounce=True)
+async def get_tracker(msg: types.Message, context):
+    """Обработчик кнопки получения трек-номера (только для зарегистрированных, в личном чате).
 
-    Проверяет статус пользователя и наличие трек-номера:
-    - Если пользователь зарегистрирован и трек-номер есть — отправляет его.
-    - Если пользователь не зарегистрирован или трек-номер отсутствует — сообщает об этом.
+    Проверяет наличие трек-номера:
+    - Если трек-номер есть — отправляет его вместе с последним известным статусом посылки.
+    - Если пользователя нет в Google-форме или трек-номер отсутствует — сообщает об этом.
 
     Args:
         msg (types.Message): Объект сообщения от пользователя.
+        context (UserContext): Данные пользователя, загруженные при проверке регистрации.
     """
-    if msg.chat.type == 'private':
-        if db.get_signup(msg.from_user.id) != 'setvkid':
-            vk = db.get_vk_id(msg.from_user.id)
-            if db.is_in_google_form(vk):
-                sender_id = db.get_vk_sender_key(vk)
-                owner_tg_id = db.get_user_id_via_vk(sender_id)
-                track_num = db.get_track_number(owner_tg_id)
-                if track_num == 'notimplemented' or owner_tg_id == '' or track_num == '':
-                    await bot.send_message(msg.from_user.id,
-                                           config.track_empty,
-                                           reply_markup=nav.main_menu)
-                else:
-                    await bot.send_message(msg.from_user.id,
-                                           config.got_track.format(track_num=track_num),
-                                           reply_markup=nav.main_menu)
-            else:
-                await bot.send_message(msg.from_user.id, config.not_in_google_form, reply_markup=nav.main_menu)
+    if context.in_google_form:
+        track_num = context.sender_track_number
+        if track_num == 'notimplemented' or track_num == '':
+            await sender.reply(msg.from_user.id,
+                               config.track_empty,
+                               reply_markup=nav.main_menu)
         else:
-            await bot.send_message(msg.from_user.id, config.registration_empty, reply_markup=nav.main_menu)
+            text = config.got_track.format(track_num=track_num)
+            status = tracking.status(track_num) if tracking is not None else None
+            if status is not None:
+                text += '\n' + config.parcel_status.format(status=status.description)
+            await sender.reply(msg.from_user.id, text, reply_markup=nav.main_menu)
+    else:
+        await sender.reply(msg.from_user.id, config.not_in_google_form, reply_markup=nav.main_menu)
 
 
-@dp.message_handler(lambda message: message.text == Bt.GET_MESSAGE)
-async def get_message(msg: types.Message):
-    """Обработчик кнопки получения сообщения.
+@router.route(Bt.GET_MESSAGE, private=True, registered=True, debounce=True)
+async def get_message(msg: types.Message, context):
+    """Обработчик кнопки получения сообщения (только для зарегистрированных, в личном чате).
 
-    Проверяет статус пользователя и наличие данных:
-    - Если пользователь зарегистрирован и данные есть — отправляет сообщение.
-    - Если пользователь не зарегистрирован или данных нет — сообщает об этом.
+    Проверяет наличие данных:
+    - Если данные есть — отправляет сообщение с заданием.
+    - Если данных нет — сообщает об этом.
 
     Args:
         msg (types.Message): Объект сообщения от пользователя.
+        context (UserContext): Данные пользователя, загруженные при проверке регистрации.
     """
-    if msg.chat.type == 'private':
-        if db.get_signup(msg.from_user.id) != 'setvkid':
-            vk = db.get_vk_id(msg.from_user.id)
-            if db.is_in_google_form(vk):
-                sent_to_id = db.get_send_to_id(msg.from_user.id)
-                wishes = db.get_google_form_columns(sent_to_id)
-                await bot.send_message(msg.from_user.id,
-                                       config.task_message.format(name=wishes[0],
-                                                                  address=wishes[1],
-                                                                  post_index=wishes[2],
-                                                                  new_year_attr=wishes[3],
-                                                                  new_year_doings=wishes[4],
-                                                                  best_gift=wishes[5],
-                                                                  best_film=wishes[6],
-                                                                  best_song=wishes[7],
-                                                                  best_dish=wishes[8],
-                                                                  best_flashback=wishes[9],
-                                                                  decorations=wishes[10],
-                                                                  rabbit_gift=wishes[11]),
-                                       reply_markup=nav.main_menu)
-            else:
-                await bot.send_message(msg.from_user.id, config.not_in_google_form, reply_markup=nav.main_menu)
-        else:
-            await bot.send_message(msg.from_user.id, config.registration_empty, reply_markup=nav.main_menu)
+    if context.in_google_form:
+        message = task_messages.get(context.vk_id) or config.not_in_google_form
+        await sender.reply(msg.from_user.id, message, reply_markup=nav.main_menu)
+    else:
+        await sender.reply(msg.from_user.id, config.not_in_google_form, reply_markup=nav.main_menu)
 
 
-@dp.message_handler()
+@router.fallback
 async def default_answer(msg: types.Message):
     """Обработчик сообщений, не попавших под другие хэндлеры.
 
@@ -249,8 +377,75 @@ async def default_answer(msg: types.Message):
     Args:
         msg (types.Message): Объект сообщения от пользователя.
     """
-    await bot.send_message(msg.from_user.id, config.default_message, reply_markup=nav.main_menu)
+    await sender.reply(msg.from_user.id, config.default_message, reply_markup=nav.main_menu)
+
+
+dp.register_message_handler(router.dispatch)
+
+slow_handler = float(os.getenv('LOG_SLOW_SECONDS', 5))
+metrics.instrument_dispatcher(dp, slow=slow_handler)
+router.wrap_handlers(lambda handler: metrics.timed('handler', handler.__name__, handler, slow_handler))
+
+
+async def on_startup(dispatcher: Dispatcher):
+    """Запускает HTTP-точку метрик (если задан METRICS_PORT), периодическую сводку задержек в журнал
+    и отслеживание посылок (если задан TRACKING_API_URL).
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер бота.
+    """
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        dispatcher['metrics_server'] = await metrics.serve(os.getenv('METRICS_HOST', '127.0.0.1'), int(metrics_port))
+    dispatcher['metrics_log'] = asyncio.create_task(
+        metrics.log_periodically(float(os.getenv('METRICS_LOG_INTERVAL', 300))))
+    if tracking is not None:
+        # в кластере API опрашивает только первый процесс, остальные перечитывают статусы из базы
+        dispatcher['tracking'] = asyncio.create_task(
+            tracking.run(poll=cluster.worker is None or cluster.worker.index == 0))
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """Останавливает метрики, дожидается отправки ответов из очереди и закрывает базу данных при остановке бота.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер бота.
+    """
+    if 'metrics_log' in dispatcher:
+        dispatcher['metrics_log'].cancel()
+    if 'metrics_server' in dispatcher:
+        await dispatcher['metrics_server'].cleanup()
+    if 'tracking' in dispatcher:
+        dispatcher['tracking'].cancel()
+        await asyncio.gather(dispatcher['tracking'], return_exceptions=True)
+        await tracking.client.close()
+    await sender.join()
+    summary = metrics.summary()
+    if summary:
+        logging.info('Latency summary:\n%s', summary)
+    db.close()
+    stats = db.writer_stats
+    logging.info(config.writer_stats % (stats.batches, stats.operations, stats.mean_batch_size,
+                                        stats.max_batch_size, stats.flush_seconds))
+    debounce = router.debounce_stats
+    logging.info(config.debounce_stats % (debounce.passed, debounce.suppressed,
+                                          debounce.saved_reads, debounce.saved_sends))
 
 
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True)
\ No newline at end of file
+    if os.getenv('RUN_MODE', 'polling') == 'webhook':
+        start_webhook(dp, os.getenv('WEBHOOK_URL'),
+                      path=os.getenv('WEBHOOK_PATH', '/webhook'),
+                      host=os.getenv('WEBAPP_HOST', '0.0.0.0'),
+                      port=int(os.getenv('WEBAPP_PORT', 8080)),
+                      workers=int(os.getenv('UPDATE_WORKERS', 8)),
+                      queue_size=int(os.getenv('UPDATE_QUEUE_SIZE', 1000)),
+                      secret_token=os.getenv('WEBHOOK_SECRET'),
+                      on_startup=on_startup,
+                      on_shutdown=on_shutdown)
+    else:
+        start_polling(dp, db,
+                      workers=int(os.getenv('UPDATE_WORKERS', 8)),
+                      queue_size=int(os.getenv('UPDATE_QUEUE_SIZE', 1000)),
+                      on_startup=on_startup,
+                      on_shutdown=on_shutdown)
\ No newline at end of file
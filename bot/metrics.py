@@ -0,0 +1,305 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль метрик бота.
+
+Содержит гистограммы задержек в стиле HDR (логарифмические корзины с постоянной
+относительной точностью), реестр Metrics, который оборачивает таймерами обработчики
+диспетчера и методы классов базы данных, и HTTP-точку в формате Prometheus.
+Модуль не зависит от остальных модулей бота и может импортироваться скриптами.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+
+from aiohttp import web
+
+# 16 корзин на каждую степень двойки: относительная погрешность не больше 1/16
+_sub_bucket_bits = 4
+_max_exponent = 36 - _sub_bucket_bits - 1
+
+
+class Histogram:
+    """Гистограмма длительностей с точностью около 6 % во всём диапазоне.
+
+    Значения хранятся в микросекундах: до 32 мкс — точно, дальше — в корзинах,
+    ширина которых растёт вместе со значением, до 2^36 мкс (около 19 часов).
+    Запись занимает O(1) и безопасна при вызове из нескольких потоков.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Удаляет все записанные значения."""
+        with self._lock:
+            self.counts = [0] * ((_max_exponent + 2) << _sub_bucket_bits)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    @staticmethod
+    def _index(micros):
+        exponent = min(max(micros.bit_length() - _sub_bucket_bits - 1, 0), _max_exponent)
+        return (exponent << _sub_bucket_bits) + min(micros >> exponent, (2 << _sub_bucket_bits) - 1)
+
+    @staticmethod
+    def _upper_bound(index):
+        """Наибольшее значение корзины в секундах."""
+        exponent = max((index >> _sub_bucket_bits) - 1, 0)
+        lowest = (index - (exponent << _sub_bucket_bits)) << exponent
+        return (lowest + (1 << exponent) - 1) / 1e6
+
+    def record(self, seconds):
+        """Учитывает длительность.
+
+        Args:
+            seconds (float): Длительность в секундах.
+        """
+        index = self._index(int(seconds * 1e6))
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q):
+        """Возвращает квантиль длительности.
+
+        Args:
+            q (float): Уровень квантиля от 0 до 1.
+
+        Returns:
+            float: Длительность в секундах (верхняя граница корзины), 0 — если записей нет.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(int(q * self.count + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+
+class Metrics:
+    """Реестр метрик бота.
+
+    Гистограммы объединены в семейства: у каждого семейства одна метка, например
+    имя обработчика. Значения датчиков (gauge) вычисляются в момент чтения метрик.
+
+    Args:
+        prefix (str): Префикс имён метрик в Prometheus.
+    """
+
+    quantiles = (0.5, 0.9, 0.99)
+
+    def __init__(self, prefix='rudolf'):
+        self.prefix = prefix
+        self._families = {}
+        self._gauges = []
+
+    def histogram(self, family, label):
+        """Возвращает гистограмму семейства для значения метки, создавая её при необходимости.
+
+        Args:
+            family (str): Имя семейства, например 'handler'.
+            label (str): Значение метки, например имя обработчика.
+
+        Returns:
+            Histogram: Гистограмма.
+        """
+        histograms = self._families.setdefault(family, {})
+        histogram = histograms.get(label)
+        if histogram is None:
+            histogram = histograms.setdefault(label, Histogram())
+        return histogram
+
+    def family(self, family):
+        """Возвращает гистограммы семейства.
+
+        Args:
+            family (str): Имя семейства, например 'handler'.
+
+        Returns:
+            dict: Словарь «значение метки → Histogram» (копия).
+        """
+        return dict(self._families.get(family, {}))
+
+    def reset(self):
+        """Обнуляет все гистограммы, например между этапами нагрузочного теста."""
+        for histograms in self._families.values():
+            for histogram in histograms.values():
+                histogram.reset()
+
+    def gauge(self, name, read, label=None, kind='gauge'):
+        """Регистрирует датчик.
+
+        Args:
+            name (str): Имя метрики без префикса.
+            read (callable): Возвращает число или, если задана метка, словарь «значение метки → число».
+            label (str): Имя метки (None — датчик без меток).
+            kind (str): Тип метрики в Prometheus: 'gauge' или 'counter'.
+        """
+        self._gauges.append((name, read, label, kind))
+
+    def timed(self, family, label, func, slow=None):
+        """Оборачивает функцию или корутину таймером.
+
+        Args:
+            family (str): Имя семейства гистограмм.
+            label (str): Значение метки.
+            func (callable): Функция или корутинная функция.
+            slow (float): Вызовы дольше стольких секунд пишутся в журнал с полем latency (None — не писать).
+
+        Returns:
+            callable: Обёртка с той же сигнатурой.
+        """
+        histogram = self.histogram(family, label)
+        perf_counter = time.perf_counter
+
+        def record(elapsed):
+            histogram.record(elapsed)
+            if slow is not None and elapsed > slow:
+                logging.warning('Slow %s %s: %.3f s', family, label, elapsed, extra={'latency': round(elapsed, 6)})
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(perf_counter() - started)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record(perf_counter() - started)
+        return wrapper
+
+    def instrument_class(self, cls, family):
+        """Оборачивает таймерами открытые методы класса (на уровне класса, для всех экземпляров).
+
+        Методы, уже обёрнутые декоратором (например, contextmanager), не трогаются.
+
+        Args:
+            cls (type): Класс, например Database.
+            family (str): Имя семейства гистограмм; меткой служит «Класс.метод».
+        """
+        for name, func in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(func) or hasattr(func, '__wrapped__'):
+                continue
+            setattr(cls, name, self.timed(family, f'{cls.__name__}.{name}', func))
+
+    def instrument_dispatcher(self, dispatcher, family='handler', slow=None):
+        """Оборачивает таймерами все зарегистрированные обработчики диспетчера.
+
+        Вызывается после регистрации обработчиков. Фильтры и разбор аргументов aiogram
+        не меняются: он по-прежнему смотрит на сигнатуру исходной функции.
+
+        Args:
+            dispatcher (Dispatcher): Диспетчер бота.
+            family (str): Имя семейства гистограмм; меткой служит имя функции-обработчика.
+            slow (float): Обработчики дольше стольких секунд пишутся в журнал (None — не писать).
+        """
+        for observer in (dispatcher.message_handlers, dispatcher.edited_message_handlers,
+                         dispatcher.callback_query_handlers):
+            for handler_obj in observer.handlers:
+                if not hasattr(handler_obj.handler, '__wrapped__'):
+                    handler_obj.handler = self.timed(family, handler_obj.handler.__name__, handler_obj.handler, slow)
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus.
+
+        Returns:
+            str: Текст для ответа на запрос /metrics.
+        """
+        lines = []
+        for family, histograms in sorted(self._families.items()):
+            name = f'{self.prefix}_{family}_seconds'
+            lines += [f'# HELP {name} Duration of {family} calls', f'# TYPE {name} summary']
+            for label, histogram in sorted(histograms.items()):
+                if not histogram.count:
+                    continue
+                labels = f'{family}="{_escape(label)}"'
+                for q in self.quantiles:
+                    lines.append(f'{name}{{{labels},quantile="{q}"}} {histogram.percentile(q):.6f}')
+                lines.append(f'{name}_sum{{{labels}}} {histogram.total:.6f}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        for name, read, label, kind in self._gauges:
+            name = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {name} {kind}')
+            try:
+                value = read()
+            except Exception:
+                logging.exception('Failed to read metric %s', name)
+                continue
+            if label is None:
+                lines.append(f'{name} {value}')
+            else:
+                lines += [f'{name}{{{label}="{_escape(key)}"}} {item}' for key, item in sorted(value.items())]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, top=10):
+        """Возвращает краткую сводку самых долгих по p99 вызовов для журнала.
+
+        Args:
+            top (int): Сколько строк показать в каждом семействе.
+
+        Returns:
+            str: Многострочная сводка.
+        """
+        lines = []
+        for family, histograms in sorted(self._families.items()):
+            active = [(label, h) for label, h in histograms.items() if h.count]
+            for label, h in sorted(active, key=lambda item: item[1].percentile(0.99), reverse=True)[:top]:
+                lines.append(f'{family} {label}: {h.count} calls, p50 {h.percentile(0.5) * 1e3:.2f} ms, '
+                             f'p99 {h.percentile(0.99) * 1e3:.2f} ms, max {h.max * 1e3:.2f} ms')
+        return '\n'.join(lines)
+
+    async def serve(self, host='127.0.0.1', port=9100):
+        """Запускает HTTP-сервер с метриками по адресу /metrics.
+
+        Args:
+            host (str): Адрес, на котором слушает сервер.
+            port (int): Порт сервера.
+
+        Returns:
+            web.AppRunner: Запущенный сервер; остановить — `await runner.cleanup()`.
+        """
+        async def handle(request):
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    async def log_periodically(self, interval=300):
+        """Раз в `interval` секунд пишет сводку в журнал; выполняется до отмены задачи.
+
+        Args:
+            interval (float): Период в секундах.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            summary = self.summary()
+            if summary:
+                logging.info('Latency summary:\n%s', summary)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,290 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль запуска бота в режиме long polling.
+
+В отличие от executor.start_polling(skip_updates=True), обновления, пришедшие,
+пока бот не работал, не отбрасываются. Полученные обновления записываются во
+входящую очередь в базе (таблица update_inbox) и сразу подтверждаются Telegram,
+а номера последнего полученного и последнего обработанного обновлений хранятся
+в таблице bot_meta; после
+запуска бот дообрабатывает входящую очередь, забирает накопившиеся обновления
+пачками по `limit` и обрабатывает их через UpdateQueue: обновления разных
+пользователей — параллельно, одного пользователя — по порядку.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import signal
+import time
+
+from aiogram.bot import api
+from aiogram.utils.exceptions import TelegramAPIError
+
+import config
+import db
+from update_queue import UpdateQueue
+
+offset_key = 'update_offset'
+received_key = 'update_received'
+
+
+class UpdateOffset:
+    """Граница обработанных обновлений.
+
+    Обновления завершаются не по порядку, поэтому граница — наибольший номер,
+    до которого включительно обработаны все полученные обновления. Обновления
+    после границы хранятся во входящей очереди: необработанное обновление,
+    прерванное остановкой бота, будет обработано после запуска.
+
+    Attributes:
+        processed (int): Граница обработанных обновлений (None — ещё ничего не обработано).
+        received (int): Наибольший номер полученного обновления.
+    """
+
+    def __init__(self, processed=None):
+        self.processed = processed
+        self.received = processed
+        self._in_flight = []
+        self._done = set()
+
+    def receive(self, update_id):
+        """Отмечает обновление полученным.
+
+        Args:
+            update_id (int): Номер обновления.
+
+        Returns:
+            bool: False, если обновление уже было получено (Telegram прислал его повторно).
+        """
+        if self.received is not None and update_id <= self.received:
+            return False
+        self.received = update_id
+        heapq.heappush(self._in_flight, update_id)
+        return True
+
+    def done(self, update_id):
+        """Отмечает обновление обработанным и сдвигает границу.
+
+        Args:
+            update_id (int): Номер обновления.
+
+        Returns:
+            bool: True, если граница сдвинулась.
+        """
+        self._done.add(update_id)
+        moved = False
+        while self._in_flight and self._in_flight[0] in self._done:
+            self._done.remove(heapq.heappop(self._in_flight))
+            moved = True
+        if moved:
+            self.processed = self._in_flight[0] - 1 if self._in_flight else self.received
+        return moved
+
+
+class Poller:
+    """Получает обновления через getUpdates и передаёт их в UpdateQueue.
+
+    Каждая пачка обновлений записывается во входящую очередь в базе, и следующий
+    запрос getUpdates подтверждает её Telegram, не дожидаясь обработки: получение
+    обновлений притормаживает только заполненная UpdateQueue, а не самое старое
+    ещё обрабатываемое обновление. Пока не получены накопившиеся обновления,
+    getUpdates вызывается без ожидания; после этого — с ожиданием `timeout` секунд.
+    Раз в `save_interval` секунд обработанные обновления удаляются из входящей
+    очереди, а граница обработанных сохраняется в базу, если она изменилась.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер бота.
+        database (AsyncDatabase): База данных бота.
+        workers (int): Количество параллельных обработчиков обновлений.
+        queue_size (int): Наибольшее число ожидающих обновлений.
+        limit (int): Наибольшее число обновлений в одном ответе getUpdates (не больше 100).
+        timeout (int): Время ожидания новых обновлений в одном запросе, в секундах.
+        save_interval (float): Период сохранения границы и очистки входящей очереди, в секундах.
+        updates: Готовая очередь с интерфейсом UpdateQueue и атрибутом on_done, например Cluster
+            (None — создать UpdateQueue).
+
+    Attributes:
+        caught_up (asyncio.Event): Устанавливается, когда накопившиеся обновления обработаны.
+        catch_up_seconds (float): Время разбора накопившихся обновлений.
+        catch_up_updates (int): Количество накопившихся обновлений.
+    """
+
+    def __init__(self, dispatcher, database, workers=8, queue_size=1000, limit=100, timeout=20, save_interval=1,
+                 updates=None):
+        self.dispatcher = dispatcher
+        self.database = database
+        self.limit = limit
+        self.timeout = timeout
+        self.save_interval = save_interval
+        self.updates = updates if updates is not None else UpdateQueue(dispatcher, workers, queue_size)
+        self.updates.on_done = self._done
+        self.offset = UpdateOffset()
+        self.next_update = None
+        self.caught_up = asyncio.Event()
+        self.catch_up_seconds = None
+        self.catch_up_updates = 0
+        self._backlog_end = None
+        self._started = None
+        self._saved = None
+        self._inbox = []
+        self._handled = []
+        self._saver = None
+
+    async def load_offset(self):
+        """Загружает из базы границу обработанных обновлений и необработанные обновления из входящей очереди.
+
+        Returns:
+            int: Номер последнего обработанного обновления или None, если бот запускается впервые.
+        """
+        rows = await self.database.fetchall(db.sql_query_get_meta, (offset_key,))
+        processed = int(rows[0][0]) if rows else None
+        rows = await self.database.fetchall(db.sql_query_get_meta, (received_key,))
+        received = int(rows[0][0]) if rows else processed
+        self._saved = processed
+        self._inbox = [json.loads(body) for body, in await self.database.fetchall(
+            sql_query_load_inbox, (-1 if processed is None else processed,))]
+        # обработанные обновления удалены из входящей очереди: всё до первого оставшегося уже обработано
+        self.offset = UpdateOffset(self._inbox[0]['update_id'] - 1 if self._inbox else received)
+        for update in self._inbox:
+            self.offset.receive(update['update_id'])
+        self.offset.received = received
+        self.next_update = None if received is None else received + 1
+        return processed
+
+    async def save_offset(self):
+        """Удаляет обработанные обновления из входящей очереди и сохраняет границу, если она изменилась."""
+        handled, self._handled = self._handled, []
+        statements = [(sql_query_clear_update, (update_id,)) for update_id in handled]
+        processed = self.offset.processed
+        if processed is not None and processed != self._saved:
+            statements.append((db.sql_query_set_meta, (offset_key, processed)))
+        await asyncio.gather(*(self.database.execute(sql, params) for sql, params in statements))
+        self._saved = processed
+
+    async def _save_periodically(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self.save_offset()
+
+    async def _store(self, updates):
+        """Записывает обновления во входящую очередь и номер последнего из них одной групповой транзакцией."""
+        if not updates:
+            return
+        await asyncio.gather(self.database.execute(db.sql_query_set_meta, (received_key, self.offset.received)),
+                             *(self.database.execute(sql_query_store_update, (update['update_id'], json.dumps(update)))
+                               for update in updates))
+
+    def _done(self, update):
+        self._handled.append(update['update_id'])
+        if not self.offset.done(update['update_id']):
+            return
+        if self._backlog_end is not None and self.offset.processed >= self._backlog_end:
+            self._finish_catch_up()
+
+    def _finish_catch_up(self):
+        self._backlog_end = None
+        self.catch_up_seconds = time.monotonic() - self._started
+        logging.info(config.catch_up_finished % (self.catch_up_updates, self.catch_up_seconds,
+                                                 self.catch_up_updates / max(self.catch_up_seconds, 1e-9)))
+        self.caught_up.set()
+
+    async def _get_updates(self):
+        # пока разбираются уже полученные накопившиеся обновления, новых ждём как обычно
+        waiting = self.caught_up.is_set() or self._backlog_end is not None
+        payload = {'limit': self.limit, 'timeout': self.timeout if waiting else 0}
+        if self.next_update is not None:
+            payload['offset'] = self.next_update
+        try:
+            return await self.dispatcher.bot.request(api.Methods.GET_UPDATES, payload)
+        except (TelegramAPIError, asyncio.TimeoutError):
+            logging.exception('Failed to get updates')
+            await asyncio.sleep(1)
+            return None
+
+    async def run(self):
+        """Загружает границу, дообрабатывает входящую очередь и получает обновления до отмены задачи."""
+        # очередь запускается первой: Cluster при запуске применяет миграции в процессе записи
+        self.updates.start()
+        logging.info(config.catch_up_started % await self.load_offset())
+        self._started = time.monotonic()
+        self._saver = asyncio.create_task(self._save_periodically())
+        inbox, self._inbox = self._inbox, []
+        for update in inbox:
+            self.catch_up_updates += 1
+            await self.updates.put(update)
+        while True:
+            received = await self._get_updates()
+            if received is None:
+                continue
+            fresh = [update for update in received if self.offset.receive(update['update_id'])]
+            # обновления подтверждаются следующим getUpdates, поэтому до него они должны быть в базе
+            await self._store(fresh)
+            if received:
+                self.next_update = received[-1]['update_id'] + 1
+            for update in fresh:
+                await self.updates.put(update)
+            if not self.caught_up.is_set():
+                self.catch_up_updates += len(fresh)
+                if len(received) < self.limit and self._backlog_end is None:
+                    # накопившиеся обновления получены; разбор закончится, когда граница дойдёт до последнего
+                    self._backlog_end = self.offset.received
+                    if self.offset.processed == self.offset.received:
+                        self._finish_catch_up()
+
+    async def close(self):
+        """Дообрабатывает полученные обновления, сохраняет границу и останавливает очередь."""
+        if self._saver is not None:
+            self._saver.cancel()
+            await asyncio.gather(self._saver, return_exceptions=True)
+        await self.updates.join()
+        # до close: Cluster при остановке закрывает и соединение с процессом записи
+        await self.save_offset()
+        await self.updates.close()
+
+
+def start_polling(dispatcher, database, workers=8, queue_size=1000, on_startup=None, on_shutdown=None):
+    """Запускает бота в режиме long polling до SIGINT или SIGTERM.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер бота.
+        database (AsyncDatabase): База данных бота, в которой хранится граница обработанных обновлений.
+        workers (int): Количество параллельных обработчиков обновлений.
+        queue_size (int): Наибольшее число ожидающих обновлений.
+        on_startup (callable): Корутина, вызываемая с диспетчером при запуске.
+        on_shutdown (callable): Корутина, вызываемая с диспетчером при остановке.
+    """
+    async def run():
+        poller = Poller(dispatcher, database, workers, queue_size)
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, task.cancel)
+            except NotImplementedError:
+                pass
+        if on_startup is not None:
+            await on_startup(dispatcher)
+        await dispatcher.bot.delete_webhook()
+        try:
+            await poller.run()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await poller.close()
+            if on_shutdown is not None:
+                await on_shutdown(dispatcher)
+            await dispatcher.storage.close()
+            await dispatcher.storage.wait_closed()
+            await (await dispatcher.bot.get_session()).close()
+
+    asyncio.run(run())
+
+
+sql_query_store_update = "INSERT OR IGNORE INTO `update_inbox` (`update_id`, `body`) VALUES (?, ?)"
+
+sql_query_load_inbox = "SELECT `body` FROM `update_inbox` WHERE `update_id` > ? ORDER BY `update_id`"
+
+sql_query_clear_update = "DELETE FROM `update_inbox` WHERE `update_id` = ?"
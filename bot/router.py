@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль маршрутизации кнопок меню.
+
+Содержит класс Router — таблицу «текст кнопки → обработчик», которая заменяет
+цепочку фильтров вида `message.text == Bt.X`: обработчик находится одним поиском
+в словаре, а общие проверки (личный чат, регистрация) выполняются один раз
+до вызова обработчика. Повторные нажатия одной кнопки одним пользователем
+подавляются в течение короткого окна после ответа.
+"""
+
+import collections
+import time
+from typing import Callable, NamedTuple
+
+from aiogram.dispatcher.handler import current_handler
+
+
+class Route(NamedTuple):
+    """Маршрут кнопки.
+
+    Attributes:
+        handler (Callable): Корутина-обработчик.
+        private (bool): Обрабатывать только сообщения из личного чата.
+        registered (bool): Только для зарегистрированных; обработчик получает UserContext вторым аргументом.
+        debounce (bool): Подавлять повторные нажатия.
+    """
+
+    handler: Callable
+    private: bool = False
+    registered: bool = False
+    debounce: bool = False
+
+
+class DebounceStats:
+    """Счётчики подавления повторных нажатий.
+
+    Attributes:
+        passed (int): Нажатия, обработанные как обычно.
+        suppressed (int): Нажатия, пришедшие в течение окна после такого же и оставленные без ответа.
+        saved_reads (int): Сэкономленные чтения из базы данных.
+        saved_sends (int): Сэкономленные отправки сообщений.
+    """
+
+    def __init__(self):
+        self.passed = 0
+        self.suppressed = 0
+        self.saved_reads = 0
+        self.saved_sends = 0
+
+
+class Router:
+    """Таблица обработчиков кнопок меню.
+
+    Регистрируется в диспетчере как единственный обработчик текстовых сообщений
+    без состояния FSM: `dp.register_message_handler(router.dispatch)`.
+
+    Обновления одного пользователя приходят по порядку (UpdateQueue), поэтому
+    повторное нажатие обрабатывается уже после ответа на первое и подавляется,
+    если пришло в течение `debounce_window` секунд после него.
+
+    Args:
+        load_context (Callable): Корутина, возвращающая UserContext по идентификатору пользователя.
+        unregistered (Callable): Корутина, отвечающая незарегистрированному пользователю.
+        debounce_window (float): Сколько секунд после ответа повторное нажатие той же кнопки остаётся без ответа.
+    """
+
+    def __init__(self, load_context, unregistered, debounce_window=0.0):
+        self.load_context = load_context
+        self.unregistered = unregistered
+        self.debounce_window = debounce_window
+        self.debounce_stats = DebounceStats()
+        self.routes = {}
+        self.default = None
+        # (пользователь, кнопка) → время ответа, по возрастанию времени
+        self._answered = collections.OrderedDict()
+        # пользователь → кнопки из _answered
+        self._answered_by_user = {}
+
+    def route(self, text, private=False, registered=False, debounce=False):
+        """Декоратор: назначает обработчик кнопке.
+
+        Args:
+            text (str): Текст кнопки.
+            private (bool): Обрабатывать только сообщения из личного чата.
+            registered (bool): Пускать только зарегистрированных пользователей.
+            debounce (bool): Подавлять повторные нажатия: ответ кнопки
+                не должен меняться за `debounce_window` секунд.
+        """
+        def decorator(handler):
+            self.routes[text] = Route(handler, private, registered, debounce)
+            return handler
+        return decorator
+
+    def forget(self, user_id):
+        """Разрешает пользователю сразу получить новый ответ, например после регистрации.
+
+        Args:
+            user_id (int): Идентификатор пользователя.
+        """
+        for text in self._answered_by_user.pop(user_id, ()):
+            del self._answered[user_id, text]
+
+    def fallback(self, handler):
+        """Декоратор: назначает обработчик сообщений, не совпавших ни с одной кнопкой."""
+        self.default = Route(handler)
+        return handler
+
+    def wrap_handlers(self, wrap):
+        """Заменяет каждый обработчик результатом `wrap(handler)`, например обёрткой с таймером.
+
+        Args:
+            wrap (Callable): Функция, принимающая и возвращающая корутинную функцию.
+        """
+        self.routes = {text: route._replace(handler=wrap(route.handler)) for text, route in self.routes.items()}
+        if self.default is not None:
+            self.default = self.default._replace(handler=wrap(self.default.handler))
+
+    async def dispatch(self, msg):
+        """Находит обработчик по тексту сообщения, проверяет доступ и вызывает его.
+
+        Args:
+            msg (types.Message): Объект сообщения от пользователя.
+        """
+        route = self.routes.get(msg.text, self.default)
+        if route is None or route.private and msg.chat.type != 'private':
+            return
+        if route.debounce:
+            return await self._debounced(route, msg)
+        return await self._call(route, msg)
+
+    async def _debounced(self, route, msg):
+        key = (msg.from_user.id, msg.text)
+        stats = self.debounce_stats
+        if self._recently_answered(key):
+            stats.suppressed += 1
+            stats.saved_reads += route.registered
+            stats.saved_sends += 1
+            return
+        stats.passed += 1
+        try:
+            return await self._call(route, msg)
+        finally:
+            if self.debounce_window:
+                self._answered[key] = time.monotonic()
+                self._answered.move_to_end(key)
+                self._answered_by_user.setdefault(key[0], set()).add(key[1])
+
+    def _recently_answered(self, key):
+        # ответы записываются по времени, поэтому устаревшие всегда в начале
+        expired = time.monotonic() - self.debounce_window
+        while self._answered:
+            oldest, answered = next(iter(self._answered.items()))
+            if answered > expired:
+                break
+            del self._answered[oldest]
+            texts = self._answered_by_user[oldest[0]]
+            texts.discard(oldest[1])
+            if not texts:
+                del self._answered_by_user[oldest[0]]
+        return key in self._answered
+
+    async def _call(self, route, msg):
+        token = current_handler.set(route.handler)
+        try:
+            if not route.registered:
+                return await route.handler(msg)
+            context = await self.load_context(msg.from_user.id)
+            if not context.registered:
+                return await self.unregistered(msg)
+            return await route.handler(msg, context)
+        finally:
+            current_handler.reset(token)
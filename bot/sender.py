@@ -0,0 +1,251 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль исходящих сообщений бота.
+
+Содержит класс SendScheduler — единую точку отправки сообщений, которая соблюдает
+ограничения Telegram на частоту отправки (общее и для каждого чата), пропускает
+ответы на действия пользователя раньше массовых рассылок и повторяет отправку
+после RetryAfter. Сообщения ждут своей очереди в задачах отправки, а не в
+обработчиках обновлений.
+"""
+
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+
+import aiohttp
+from aiogram.utils.exceptions import NetworkError, RetryAfter, TelegramAPIError
+
+# приоритеты отправки: меньше — раньше
+INTERACTIVE = 0
+BULK = 1
+
+# ошибки, с которыми send_message может не отправить сообщение: ответ Telegram, сбой соединения, таймаут
+SEND_ERRORS = (TelegramAPIError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class TokenBucket:
+    """Ведро токенов: не больше `capacity` подряд и `rate` в секунду в среднем.
+
+    Args:
+        rate (float): Скорость пополнения, токенов в секунду.
+        capacity (float): Ёмкость ведра.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Забирает токен, если он есть.
+
+        Returns:
+            float: 0, если токен забран, иначе время в секундах до появления токена.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    @property
+    def idle(self):
+        """bool: True, если ведро полное и его можно забыть."""
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class SendStats:
+    """Метрики SendScheduler.
+
+    Attributes:
+        sent (int): Количество отправленных сообщений.
+        failed (int): Количество сообщений, которые не удалось отправить.
+        retries (int): Количество повторных попыток.
+        waiting (int): Количество сообщений, ожидающих отправки (глубина очереди).
+        wait_seconds (float): Суммарное время ожидания в очереди.
+        max_wait_seconds (float): Наибольшее время ожидания в очереди.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.waiting = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def mean_wait_seconds(self):
+        """float: Среднее время ожидания в очереди."""
+        return self.wait_seconds / self.sent if self.sent else 0.0
+
+
+class SendScheduler:
+    """Планировщик исходящих сообщений.
+
+    У каждого чата своя очередь сообщений, которую разбирает своя задача: сообщения
+    чата отправляются по порядку и не чаще, чем позволяет ведро чата. Общее ведро
+    ограничивает суммарную частоту — не больше `global_rate` сообщений в любую
+    секунду, — а его токены выдаются в порядке приоритета (INTERACTIVE раньше BULK).
+    RetryAfter приостанавливает всю отправку на указанное Telegram время, после чего
+    попытка повторяется.
+
+    Обработчики обновлений отвечают через `reply`, который только ставит сообщение
+    в очередь чата: ожидание токенов не задерживает ни обработчик, ни обновления
+    других пользователей, которые ждут его в той же очереди обновлений.
+
+    Args:
+        bot (Bot): Бот, через которого отправляются сообщения.
+        global_rate (float): Общее число сообщений в секунду.
+        chat_rate (float): Число сообщений в секунду в один чат.
+        chat_burst (int): Сколько сообщений подряд можно отправить в один чат.
+        max_retries (int): Наибольшее число повторных попыток.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_retries=5):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.stats = SendStats()
+        # без запаса: токен появляется раз в 1 / global_rate секунд
+        self._global = TokenBucket(global_rate, 1)
+        self._chats = {}
+        self._outboxes = {}
+        self._drains = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._pump = None
+        self._paused_until = 0.0
+
+    async def send_message(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        """Отправляет сообщение с соблюдением ограничений Telegram и дожидается отправки.
+
+        Args:
+            chat_id (int): Идентификатор чата.
+            text (str): Текст сообщения.
+            priority (int): INTERACTIVE для ответов пользователю, BULK для рассылок.
+            **kwargs: Остальные параметры Bot.send_message.
+
+        Returns:
+            types.Message: Отправленное сообщение.
+        """
+        return await self._enqueue(chat_id, text, priority, kwargs)
+
+    async def reply(self, chat_id, text, **kwargs):
+        """Ставит ответ пользователю в очередь чата, не дожидаясь отправки.
+
+        Ошибка отправки записывается в журнал.
+
+        Args:
+            chat_id (int): Идентификатор чата.
+            text (str): Текст сообщения.
+            **kwargs: Остальные параметры Bot.send_message.
+        """
+        self._enqueue(chat_id, text, INTERACTIVE, kwargs).add_done_callback(_log_failure)
+
+    async def join(self):
+        """Дожидается отправки всех сообщений из очередей."""
+        while self._drains:
+            await asyncio.gather(*list(self._drains.values()), return_exceptions=True)
+
+    def _enqueue(self, chat_id, text, priority, kwargs):
+        future = asyncio.get_running_loop().create_future()
+        outbox = self._outboxes.get(chat_id)
+        if outbox is None:
+            if len(self._chats) > 10000:
+                self._forget_idle_chats()
+            outbox = self._outboxes[chat_id] = collections.deque()
+            self._drains[chat_id] = asyncio.create_task(self._drain(chat_id, outbox))
+        outbox.append((text, priority, kwargs, future, time.monotonic()))
+        self.stats.waiting += 1
+        return future
+
+    async def _drain(self, chat_id, outbox):
+        """Отправляет сообщения из очереди чата, пока она не опустеет."""
+        try:
+            while outbox:
+                text, priority, kwargs, future, enqueued = outbox.popleft()
+                try:
+                    if not future.cancelled():
+                        message = await self._send(chat_id, text, priority, kwargs, enqueued)
+                        if not future.done():
+                            future.set_result(message)
+                except Exception as e:
+                    self.stats.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                finally:
+                    self.stats.waiting -= 1
+        finally:
+            del self._outboxes[chat_id]
+            del self._drains[chat_id]
+
+    async def _send(self, chat_id, text, priority, kwargs, enqueued):
+        for attempt in itertools.count():
+            await self._acquire(chat_id, priority)
+            if attempt == 0:
+                waited = time.monotonic() - enqueued
+                self.stats.wait_seconds += waited
+                self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+            try:
+                message = await self.bot.send_message(chat_id, text, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                logging.warning('Flood control, sending paused for %s s', e.timeout)
+                self._paused_until = max(self._paused_until, time.monotonic() + e.timeout)
+            except NetworkError:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 30))
+            else:
+                self.stats.sent += 1
+                return message
+            self.stats.retries += 1
+
+    def _forget_idle_chats(self):
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items()
+                        if chat_id not in self._outboxes and bucket.idle]:
+            del self._chats[chat_id]
+
+    async def _acquire(self, chat_id, priority):
+        """Дожидается токенов ведра чата и общего ведра."""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        delay = bucket.take()
+        while delay:
+            await asyncio.sleep(delay)
+            delay = bucket.take()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._grant())
+        await waiter
+
+    async def _grant(self):
+        """Выдаёт токены общего ведра ожидающим в порядке приоритета."""
+        while self._waiters:
+            delay = max(self._paused_until - time.monotonic(), 0) or self._global.take()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.warning('Reply was not sent: %r', future.exception())
@@ -0,0 +1,239 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль отслеживания посылок.
+
+Содержит клиент API отслеживания (HttpTrackingClient — пачки трек-номеров через общий
+пул соединений aiohttp с ограничением числа одновременных запросов) и фоновую службу
+TrackingService, которая периодически обновляет статусы посылок, хранит их в таблице
+parcel_status и сообщает получателю, когда статус его посылки меняется.
+"""
+
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+import aiohttp
+
+import config
+from sender import BULK, SEND_ERRORS
+
+
+class ParcelStatus(NamedTuple):
+    """Статус посылки.
+
+    Attributes:
+        status (str): Код статуса, по которому определяется его смена.
+        description (str): Описание статуса для пользователя.
+        final (bool): Статус окончательный (посылка вручена или возвращена), дальше её можно не проверять.
+    """
+
+    status: str
+    description: str = ''
+    final: bool = False
+
+
+class TrackingClient(ABC):
+    """Клиент API отслеживания посылок.
+
+    Служба отслеживания использует только метод fetch, поэтому любой другой
+    источник статусов подключается подклассом, который его реализует.
+    """
+
+    @abstractmethod
+    async def fetch(self, track_numbers):
+        """Запрашивает статусы посылок.
+
+        Args:
+            track_numbers (list): Трек-номера.
+
+        Returns:
+            dict: Словарь «трек-номер → ParcelStatus»; посылки, статус которых получить не удалось, отсутствуют.
+        """
+
+    async def close(self):
+        """Освобождает соединения клиента."""
+
+
+class HttpTrackingClient(TrackingClient):
+    """Клиент JSON API отслеживания с пакетными запросами.
+
+    Трек-номера отправляются пачками по `batch_size` запросом
+    `POST {url}` с телом `{"numbers": [...]}`; ответ — `{"parcels": [{"number": ...,
+    "status": ..., "description": ..., "final": ...}]}`. Все запросы идут через одну
+    сессию aiohttp, одновременно выполняется не больше `concurrency` запросов.
+
+    Args:
+        url (str): Адрес метода пакетного запроса статусов.
+        token (str): Токен API, передаётся в заголовке Authorization (None — без него).
+        batch_size (int): Количество трек-номеров в одном запросе.
+        concurrency (int): Наибольшее число одновременных запросов.
+        timeout (float): Время ожидания ответа на один запрос, в секундах.
+    """
+
+    def __init__(self, url, token=None, batch_size=50, concurrency=4, timeout=30.0):
+        self.url = url
+        self.token = token
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            headers = {'Authorization': f'Bearer {self.token}'} if self.token else None
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency), headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def fetch_batch(self, track_numbers):
+        """Запрашивает статусы одной пачки трек-номеров.
+
+        Args:
+            track_numbers (list): Не больше `batch_size` трек-номеров.
+
+        Returns:
+            dict: Словарь «трек-номер → ParcelStatus».
+        """
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.post(self.url, json={'numbers': list(track_numbers)}) as response:
+                response.raise_for_status()
+                body = await response.json()
+        return {parcel['number']: ParcelStatus(str(parcel['status']), parcel.get('description') or '',
+                                               bool(parcel.get('final')))
+                for parcel in body.get('parcels', ())}
+
+    async def fetch(self, track_numbers):
+        batches = [track_numbers[i:i + self.batch_size] for i in range(0, len(track_numbers), self.batch_size)]
+        results = await asyncio.gather(*(self.fetch_batch(batch) for batch in batches), return_exceptions=True)
+        statuses = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logging.warning('Tracking request for %d parcels failed: %r', len(batch), result)
+            else:
+                statuses.update(result)
+        return statuses
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class TrackingService:
+    """Фоновое обновление статусов посылок.
+
+    Раз в `interval` секунд запрашивает статусы всех заявленных трек-номеров, которые
+    не проверялись дольше `ttl` секунд и ещё не получили окончательный статус.
+    Статусы хранятся в таблице parcel_status и копией в памяти, поэтому чтение статуса
+    обработчиком не обращается к базе. Когда статус посылки меняется, получатель
+    посылки получает уведомление; первый полученный статус уведомления не вызывает —
+    о трек-номере получатель уже узнал, когда отправитель его заявил.
+
+    Args:
+        db (AsyncDatabase): База данных бота.
+        sender (SendScheduler): Планировщик исходящих сообщений.
+        client (TrackingClient): Клиент API отслеживания.
+        interval (float): Период проверки, в секундах.
+        ttl (float): Сколько секунд полученный статус считается свежим.
+    """
+
+    def __init__(self, db, sender, client, interval=1800.0, ttl=3600.0):
+        self.db = db
+        self.sender = sender
+        self.client = client
+        self.interval = interval
+        self.ttl = ttl
+        self.statuses = {}
+
+    async def load(self):
+        """Загружает сохранённые статусы в память."""
+        rows = await self.db.fetchall(sql_query_load_statuses)
+        self.statuses = {number: ParcelStatus(status, description, bool(final))
+                         for number, status, description, final in rows}
+
+    def status(self, track_number):
+        """Возвращает последний известный статус посылки.
+
+        Args:
+            track_number (str): Трек-номер.
+
+        Returns:
+            ParcelStatus: Статус или None, если он ещё не известен.
+        """
+        return self.statuses.get(track_number)
+
+    async def poll(self, ttl=None):
+        """Обновляет статусы посылок, которые пора проверить, и рассылает уведомления о смене статуса.
+
+        Args:
+            ttl (float): Сколько секунд статус считается свежим (None — `self.ttl`).
+
+        Returns:
+            tuple: Количество проверенных посылок, сменивших статус и тех, чей статус получить не удалось.
+        """
+        started = time.monotonic()
+        now = time.time()
+        due = [number for number, in await self.db.fetchall(sql_query_due_parcels,
+                                                             (now - (self.ttl if ttl is None else ttl),))]
+        if not due:
+            return 0, 0, 0
+        fetched = await self.client.fetch(due)
+        await asyncio.gather(*(self.db.execute(sql_query_save_status, (number, status.status, status.description,
+                                                                       int(status.final), now, now))
+                               for number, status in fetched.items()))
+        changed = []
+        for number, status in fetched.items():
+            previous = self.statuses.get(number)
+            self.statuses[number] = status
+            if previous is not None and previous.status != status.status:
+                changed.append((number, status))
+        await asyncio.gather(*(self._notify(number, status) for number, status in changed))
+        failed = len(due) - len(fetched)
+        logging.info(config.tracking_log % (len(due), len(changed), failed, time.monotonic() - started))
+        return len(due), len(changed), failed
+
+    async def _notify(self, track_number, status):
+        for (receiver_id,) in await self.db.fetchall(sql_query_get_parcel_receivers, (track_number,)):
+            text = config.parcel_status_changed.format(track_num=track_number, status=status.description)
+            try:
+                await self.sender.send_message(receiver_id, text, priority=BULK)
+            except SEND_ERRORS as e:
+                logging.warning('Parcel status notification to %s failed: %r', receiver_id, e)
+
+    async def run(self, poll=True):
+        """Загружает статусы и обновляет их каждые `interval` секунд до отмены задачи.
+
+        Args:
+            poll (bool): Опрашивать API; если False, только перечитывать статусы из базы —
+                для процессов кластера, кроме первого, чтобы API опрашивал один процесс.
+        """
+        await self.load()
+        while True:
+            try:
+                await (self.poll() if poll else self.load())
+            except Exception:
+                logging.exception('Parcel tracking failed')
+            await asyncio.sleep(self.interval)
+
+
+sql_query_load_statuses = "SELECT `track_number`, `status`, `description`, `final` FROM `parcel_status`"
+
+sql_query_due_parcels = """SELECT DISTINCT u.`track_number` FROM `users` AS u \
+ LEFT JOIN `parcel_status` AS p ON p.`track_number` = u.`track_number` \
+ WHERE u.`track_number` != 'notimplemented' AND (p.`checked_at` IS NULL OR p.`checked_at` < ? AND NOT p.`final`)"""
+
+sql_query_save_status = """INSERT INTO `parcel_status` (`track_number`, `status`, `description`, `final`, \
+ `checked_at`, `changed_at`) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (`track_number`) DO UPDATE SET \
+ `changed_at` = CASE WHEN `status` = excluded.`status` THEN `changed_at` ELSE excluded.`changed_at` END, \
+ `status` = excluded.`status`, `description` = excluded.`description`, `final` = excluded.`final`, \
+ `checked_at` = excluded.`checked_at`"""
+
+sql_query_get_parcel_receivers = """SELECT r.`user_id` FROM `users` AS s \
+ JOIN `google_form` AS f ON f.`vk_id` = s.`vk_id` JOIN `users` AS r ON r.`vk_id` = f.`sent_to_id` \
+ WHERE s.`track_number` = ?"""
@@ -0,0 +1,123 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль очереди входящих обновлений Telegram.
+
+Содержит класс UpdateQueue — ограниченную очередь, которую разбирают несколько
+обработчиков: обновления разных пользователей обрабатываются параллельно,
+а обновления одного пользователя — строго по порядку.
+"""
+
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher, types
+
+
+def update_user_id(update):
+    """Возвращает идентификатор пользователя, от которого пришло обновление.
+
+    Args:
+        update (dict): Обновление Telegram в виде JSON-словаря.
+
+    Returns:
+        int: Идентификатор пользователя или 0, если его нет в обновлении.
+    """
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('chat')
+            if sender:
+                return sender['id']
+    return 0
+
+
+class UpdateQueue:
+    """Ограниченная очередь обновлений, разделённая по пользователям.
+
+    Обновление попадает в одну из `workers` очередей по идентификатору пользователя,
+    и каждую очередь разбирает свой обработчик, поэтому порядок обновлений одного
+    пользователя (и переходы его FSM) сохраняется. Если очередь заполнена,
+    обновление не принимается — источник должен повторить его позже.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер бота.
+        workers (int): Количество обработчиков.
+        maxsize (int): Наибольшее общее число ожидающих обновлений.
+        on_done (Callable): Вызывается с каждым обновлением после его обработки, в том числе неудачной.
+    """
+
+    def __init__(self, dispatcher, workers=8, maxsize=1000, on_done=None):
+        """Создаёт очереди; обработчики запускаются методом start.
+
+        Args:
+            dispatcher (Dispatcher): Диспетчер бота.
+            workers (int): Количество обработчиков.
+            maxsize (int): Наибольшее общее число ожидающих обновлений.
+            on_done (Callable): Вызывается с каждым обработанным обновлением.
+        """
+        self.dispatcher = dispatcher
+        self.on_done = on_done
+        self._queues = [asyncio.Queue(max(maxsize // workers, 1)) for _ in range(workers)]
+        self._tasks = []
+
+    @property
+    def depth(self):
+        """int: Количество ожидающих обновлений."""
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self):
+        """Запускает обработчики в текущем цикле событий."""
+        self._tasks = [asyncio.create_task(self._work(q)) for q in self._queues]
+
+    def _queue_for(self, update):
+        return self._queues[update_user_id(update) % len(self._queues)]
+
+    def put_nowait(self, update):
+        """Ставит обновление в очередь, если в ней есть место.
+
+        Args:
+            update (dict): Обновление Telegram в виде JSON-словаря.
+
+        Returns:
+            bool: True, если обновление принято, False — если очередь заполнена.
+        """
+        try:
+            self._queue_for(update).put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put(self, update):
+        """Ставит обновление в очередь, дожидаясь свободного места.
+
+        Args:
+            update (dict): Обновление Telegram в виде JSON-словаря.
+        """
+        await self._queue_for(update).put(update)
+
+    async def join(self):
+        """Дожидается обработки всех принятых обновлений."""
+        await asyncio.gather(*(q.join() for q in self._queues))
+
+    async def close(self):
+        """Обрабатывает оставшиеся обновления и останавливает обработчики."""
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _work(self, queue):
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        while True:
+            update = await queue.get()
+            try:
+                # отдельная задача — отдельный контекст, как при обычном polling:
+                # фильтры aiogram кэшируют состояние FSM в переменных контекста
+                await asyncio.create_task(self.dispatcher.process_update(types.Update.to_object(update)))
+            except Exception:
+                logging.exception('Failed to process update %s', update.get('update_id'))
+            finally:
+                if self.on_done is not None:
+                    self.on_done(update)
+                queue.task_done()
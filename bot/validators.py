@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль проверки вводимых пользователем строк.
+
+Содержит проверки VK ID и трек-номеров на заранее скомпилированных регулярных
+выражениях: некорректный ввод отсекается до любых обращений к базе данных.
+Модуль не зависит от остальных модулей бота и может импортироваться скриптами.
+
+Проверки строже прежних (любая строка без запрещённых символов и любые 14 символов
+трек-номера): VK ID — только числовой идентификатор или короткое имя ВКонтакте
+(латиница, от двух символов), поэтому кириллица и однобуквенные имена отклоняются;
+трек-номер — только внутренний номер Почты России или UPU S10 с верной контрольной цифрой.
+"""
+
+import operator
+import re
+
+# vk.com/durov, https://m.vk.com/id1, @durov, durov, id1, 1
+_vk_link = re.compile(r'(?:(?:https?://)?(?:m\.)?vk\.(?:com|ru)/|@)?(?P<name>\S+?)/?', re.IGNORECASE)
+_vk_numeric = re.compile(r'(?:id)?(?P<id>[1-9][0-9]{0,11})')
+_vk_screen_name = re.compile(r'[a-z][a-z0-9_.]{1,31}')
+
+# почтовые отправления: внутренние Почты России (14 цифр) и международные UPU S10 (RA123456785RU)
+_domestic_track = re.compile(r'[0-9]{14}')
+_s10_track = re.compile(r'[A-Z]{2}[0-9]{9}[A-Z]{2}')
+_s10_weights = (8, 6, 4, 2, 3, 5, 9, 7)
+_s10_fix = (5, 0) + tuple(range(9, 0, -1))
+
+
+def normalize_vk_id(text: str):
+    """Приводит VK ID к виду, в котором он хранится в базе данных.
+
+    Ссылка на страницу и @ отбрасываются, числовой идентификатор записывается
+    как id<число>, короткое имя — строчными буквами.
+
+    Args:
+        text (str): VK ID, короткое имя или ссылка на страницу.
+
+    Returns:
+        str: VK ID, например 'id1' или 'durov', или None, если это не VK ID.
+    """
+    link = _vk_link.fullmatch(text.strip())
+    if link is None:
+        return None
+    name = link.group('name').lower()
+    numeric = _vk_numeric.fullmatch(name)
+    if numeric is not None:
+        return 'id' + numeric.group('id')
+    if _vk_screen_name.fullmatch(name) is None or name.startswith('id') and name[2:].isdigit():
+        return None
+    return name
+
+
+def domestic_check_digit(digits: str):
+    """Вычисляет контрольную цифру внутреннего трек-номера Почты России.
+
+    Args:
+        digits (str): Первые 13 цифр трек-номера.
+
+    Returns:
+        int: Контрольная цифра.
+    """
+    # цифры берутся как байты ASCII: сумма по срезу считается без преобразования каждой цифры в int
+    codes = digits.encode('ascii')
+    total = 3 * sum(codes[0::2]) + sum(codes[1::2]) - ord('0') * (3 * len(codes[0::2]) + len(codes[1::2]))
+    return (10 - total % 10) % 10
+
+
+def s10_check_digit(serial: str):
+    """Вычисляет контрольную цифру международного трек-номера UPU S10.
+
+    Args:
+        serial (str): Восемь цифр серийного номера.
+
+    Returns:
+        int: Контрольная цифра.
+    """
+    total = sum(map(operator.mul, serial.encode('ascii'), _s10_weights)) - ord('0') * sum(_s10_weights)
+    # 11 - остаток, где 10 заменяется на 0, а 11 — на 5
+    return _s10_fix[total % 11]
+
+
+def normalize_track_number(text: str):
+    """Проверяет трек-номер по формату и контрольной цифре.
+
+    Пробелы внутри номера отбрасываются, буквы приводятся к верхнему регистру.
+
+    Args:
+        text (str): Трек-номер, введённый пользователем.
+
+    Returns:
+        str: Трек-номер, например '80085271434545' или 'RA123456785RU', или None, если он некорректен.
+    """
+    track = ''.join(text.split()).upper()
+    if _domestic_track.fullmatch(track):
+        return track if domestic_check_digit(track[:13]) == int(track[13]) else None
+    if _s10_track.fullmatch(track):
+        return track if s10_check_digit(track[2:10]) == int(track[10]) else None
+    return None
@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Модуль запуска бота в режиме webhook.
+
+Telegram сам присылает обновления POST-запросами на aiohttp-сервер бота.
+Сервер сразу отвечает и ставит обновление в ограниченную UpdateQueue;
+если очередь заполнена, сервер отвечает 503 и Telegram повторит обновление позже.
+"""
+
+import hmac
+import logging
+
+from aiohttp import web
+
+from update_queue import UpdateQueue
+
+
+def build_app(dispatcher, path='/webhook', workers=8, queue_size=1000, secret_token=None, updates=None):
+    """Создаёт aiohttp-приложение, принимающее обновления Telegram.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер бота.
+        path (str): Путь, на который Telegram присылает обновления.
+        workers (int): Количество параллельных обработчиков обновлений.
+        queue_size (int): Наибольшее число ожидающих обновлений.
+        secret_token (str): Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (None — не проверять).
+        updates: Готовая очередь с интерфейсом UpdateQueue, например Cluster
+            (None — создать UpdateQueue для dispatcher).
+
+    Returns:
+        web.Application: Приложение; очередь обновлений доступна как app['updates'].
+    """
+    app = web.Application()
+    if updates is None:
+        updates = UpdateQueue(dispatcher, workers, queue_size)
+    app['updates'] = updates
+
+    async def receive_update(request):
+        if secret_token is not None:
+            received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(received, secret_token):
+                return web.Response(status=403)
+        if not updates.put_nowait(await request.json()):
+            logging.warning('Update queue is full, asking Telegram to retry later')
+            return web.Response(status=503)
+        return web.Response()
+
+    async def start_workers(app):
+        updates.start()
+
+    async def stop_workers(app):
+        await updates.close()
+
+    app.router.add_post(path, receive_update)
+    app.on_startup.append(start_workers)
+    app.on_shutdown.append(stop_workers)
+    return app
+
+
+def start_webhook(dispatcher, url, path='/webhook', host='0.0.0.0', port=8080,
+                  workers=8, queue_size=1000, secret_token=None, on_startup=None, on_shutdown=None):
+    """Регистрирует webhook в Telegram и запускает сервер до остановки процесса.
+
+    Необработанные обновления, накопившиеся за время простоя, не сбрасываются:
+    Telegram доставит их после регистрации webhook.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер бота.
+        url (str): Публичный адрес сервера без пути, например https://example.com.
+        path (str): Путь, на который Telegram присылает обновления.
+        host (str): Адрес, на котором слушает сервер.
+        port (int): Порт, на котором слушает сервер.
+        workers (int): Количество параллельных обработчиков обновлений.
+        queue_size (int): Наибольшее число ожидающих обновлений.
+        secret_token (str): Секрет, который Telegram передаёт в каждом запросе.
+        on_startup (callable): Корутина, вызываемая с диспетчером при запуске.
+        on_shutdown (callable): Корутина, вызываемая с диспетчером при остановке.
+    """
+    app = build_app(dispatcher, path, workers, queue_size, secret_token)
+
+    async def set_webhook(app):
+        if on_startup is not None:
+            await on_startup(dispatcher)
+        await dispatcher.bot.set_webhook(url.rstrip('/') + path, secret_token=secret_token,
+                                         max_connections=min(workers * 4, 100))
+
+    async def shutdown(app):
+        if on_shutdown is not None:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await (await dispatcher.bot.get_session()).close()
+
+    app.on_startup.append(set_webhook)
+    app.on_cleanup.append(shutdown)
+    web.run_app(app, host=host, port=port)
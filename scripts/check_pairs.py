@@ -0,0 +1,31 @@
+# -*- coding: UTF-8 -*-
+"""Checks the pairs loaded into the database: see bot/integrity.py. Exits with status 1 if a problem is found.
+
+    python -m scripts.check_pairs [--db ./data/database.db] [--examples 5]
+"""
+import argparse
+import sys
+
+from bot.integrity import check_pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='./data/database.db')
+    parser.add_argument('--examples', type=int, default=5, help='VK IDs to show per problem')
+    args = parser.parse_args()
+
+    report = check_pairs(args.db)
+    cycles = 'not a permutation' if report.cycles is None else f'{report.cycles} cycle(s)'
+    print(f'{report.participants} participants, {cycles}, checked in {report.seconds:.2f} s.')
+    for name, vk_ids in report.problems():
+        print(f'{name.replace("_", " ")}: {len(vk_ids)}, e.g. {", ".join(vk_ids[:args.examples])}')
+    if report.cycles is not None and report.cycles > 1:
+        print(f'WARNING: the pairs form {report.cycles} separate cycles instead of one')
+    if not report.ok:
+        sys.exit(1)
+    print('The pairs are valid.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,33 @@
 # -*- coding: UTF-8 -*-
+import numpy as np
 import pandas as pd
-from bot import config
-import random
-import codecs
+import openpyxl
+import time
 from collections import OrderedDict
-from collections import deque
 
 from bot.db import DBMigration
+from bot.metrics import Metrics
+from bot.validators import normalize_vk_id
+from scripts.letters import export_letters
+from scripts.pairing import assign_pairs
+
+# columns of the google_form table in the order of DBMigration.add_user arguments
+FORM_COLUMNS = ('vk_id', 'send_to_id', 'name', 'address', 'post_index', 'new_year_attr', 'new_year_doings',
+                'best_gift', 'best_film', 'best_song', 'best_dish', 'best_flashback', 'decorations', 'rabbit_gift')
+
+
+def group_codes(values, missing_apart):
+    """
+    Numbers equal values 0, 1, ... like pd.factorize, but never gives a missing value the code -1.
+    :param values: Series with NaN or empty strings for missing values
+    :param missing_apart: True to give every missing value its own code (nobody shares an unknown address),
+        False to put all of them into one extra group (an unknown region is a region of its own)
+    :return: int array of codes
+    """
+    codes = pd.factorize(values.replace('', np.nan))[0]
+    missing = codes < 0
+    codes[missing] = codes.max(initial=-1) + 1 + (np.arange(missing.sum()) if missing_apart else 0)
+    return codes
 
 
 class Generator:
@@ -15,6 +36,7 @@ class Generator:
     def __init__(self, path='./data/data.xlsx'):
         """Constructor provides to work with a path to data table"""
         self._path = path
+        self._data = None
         self._pairs = {}
         self._vk_id = []
 
@@ -25,68 +47,63 @@ class Generator:
     def get_people(self):
         return self._vk_id
 
+    def load(self):
+        """Reads the data table once and keeps it in memory"""
+        if self._data is None:
+            self._data = pd.read_excel(self._path)
+        return self._data
+
     def get_people_from_doc(self):
         """Getting people from the list in the document"""
-        data = pd.read_excel('./data/data.xlsx')
-        self._vk_id = tuple(data['vk_id'])
+        self._vk_id = tuple(self.load()['vk_id'])
         return self._vk_id
 
-    def compare_people(self):
+    def compare_people(self, previous=None, seed=None):
         """ Given a list of people, assign each one a secret santa partner
             from the list and return the pairings as a dict. Implemented to always
-            create a perfect cycle """
+            create a perfect cycle.
+            Nobody sends to somebody with the same address or, if `previous` is given
+            (a dict vk_id -> last year's send_to_id or a path to last year's table),
+            to last year's receiver. If the table has a 'region' column, receivers
+            from the same region are preferred. A missing address matches nobody's,
+            participants with a missing region form a region of their own. """
+        data = self.load()
         self.get_people_from_doc()
-        shuffle_ids = list(self._vk_id)
-        random.shuffle(shuffle_ids)
-        partners = deque(shuffle_ids)
-        partners.rotate()
-        self._pairs = OrderedDict(zip(self._vk_id, partners))
+        ids = pd.Index(self._vk_id)
+        if isinstance(previous, str):
+            last_year = pd.read_excel(previous, usecols=['vk_id', 'send_to_id'])
+            previous = dict(zip(last_year['vk_id'], last_year['send_to_id']))
+        last_receivers = ids.get_indexer(ids.map(previous)) if previous else None
+        addresses = group_codes(data['address'].astype(str).str.strip().str.lower().where(data['address'].notna()),
+                                missing_apart=True) if 'address' in data else None
+        regions = group_codes(data['region'], missing_apart=False) if 'region' in data else None
+        receivers = assign_pairs(len(ids), last_receivers, addresses, regions, seed)
+        self._pairs = OrderedDict(zip(self._vk_id, ids[receivers]))
         return self._pairs
 
-    def generate_message(self):
-        """Generates messages to a text-file in the current directory"""
-        print('WARNING: generate_message() is deprecated and will be removed in a future')
-        data = pd.read_excel(self._path)
-        with codecs.open('messages.txt', 'w', "utf_8_sig") as f:
-            self.compare_people()
-            for guy in self._pairs.keys():
-                gifted_name = self._pairs[guy]
-                row_i = data.loc[data['ФИО'] == gifted_name].index[0]
-                address = data.iloc[row_i][...]
-                index = data.iloc[row_i][...]
-                best_variant = data.iloc[row_i][...]
-                especial_thing = data.iloc[row_i][...]
-                decorations = data.iloc[row_i][...]
-                best_gift = data.iloc[row_i][...]
-                film = data.iloc[row_i][...]
-                meal = data.iloc[row_i][...]
-                people_count = data.iloc[row_i][...]
-                f.write(f'Отправитель: {guy}, --> {gifted_name}\n')
-                f.write('###########################################\n')
-                f.write(config.task_message.format(gifted_name=gifted_name,
-                                                   address=address,
-                                                   index=index,
-                                                   best_variant=best_variant,
-                                                   especial_thing=especial_thing,
-                                                   decorations=decorations,
-                                                   best_gift=best_gift,
-                                                   film=film,
-                                                   meal=meal,
-                                                   people_count=people_count))
-                f.write('###########################################\n\n')
-
-    def write_pairs_to_table(self):
+    def generate_message(self, db_path='./data/database.db', out_dir='./messages', archive=None, workers=None):
         """
-        Updates the table with the data from your table with pair-creations.
-        You need to make sure you have the correct column 'send_to_id'.
+        Writes the task letter of every participant, see scripts/letters.py.
+        Run it after write_pairs_to_table: the letters are rendered from the pairs in the database.
+        :return: ExportStats of the export
+        """
+        return export_letters(db_path, out_dir, archive, workers)
+
+    def write_pairs_to_table(self, db_path='./data/database.db', chunk_size=10000):
+        """
+        Updates the table with the data from your table with pair-creations
+        and loads the same rows into google_form, both from one in-memory frame.
+        Only the 'send_to_id' column is assigned (mapped by vk_id), so every
+        participant keeps the rest of their row.
         :return: None
         """
-        data = pd.read_excel(self._path)
-        self.get_people_from_doc()
-        self.compare_people()
-        for i, k in zip(range(len(self._pairs)), self._pairs.keys()):
-            data.at[i, 'vk_id'] = k
-            data.at[i, 'send_to_id'] = self._pairs[k]
+        data = self.load().copy()
+        data['send_to_id'] = data['vk_id'].map(self.compare_people())
+        m = DBMigration(db_path)
+        with m.bulk_load():
+            for start in range(0, len(data), chunk_size):
+                m.add_users(form_rows(data.iloc[start:start + chunk_size]))
+        print(f'{len(data)} pairs written to the "{db_path}".')
         try:
             with pd.ExcelWriter(self._path, engine='openpyxl', mode='w') as writer:
                 data.to_excel(writer, sheet_name='Sheet', index=False)
@@ -94,21 +111,63 @@ class Generator:
         except (PermissionError, FileExistsError, FileNotFoundError):
             print("You do not have permission to write the file. Please try again.")
 
-    def migrate_data_to_sqlite(self):
-        data = pd.read_excel(self._path)
-        m = DBMigration('./data/database.db')
-        for i, record in data.iterrows():
-            m.add_user(record['vk_id'], record['send_to_id'], record['name'], record['address'],
-                       record['post_index'], record['new_year_attr'], record['new_year_doings'],
-                       record['best_gift'], record['best_film'], record['best_song'],
-                       record['best_dish'], record['best_flashback'], record['decorations'],
-                       record['rabbit_gift'])
+    def iter_rows(self, chunk_size=10000):
+        """Streams the form columns of the table in chunks of tuples, without loading the whole workbook"""
+        workbook = openpyxl.load_workbook(self._path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows)
+            indexes = [header.index(column) for column in FORM_COLUMNS]
+            chunk = []
+            for row in rows:
+                if row[indexes[0]] is None:
+                    continue
+                chunk.append(normalize_ids(tuple('' if row[i] is None else str(row[i]) for i in indexes)))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        finally:
+            workbook.close()
+
+    def migrate_data_to_sqlite(self, db_path='./data/database.db', chunk_size=10000):
+        """
+        Loads the table into google_form chunk by chunk, one transaction per chunk.
+        Rows are upserted by vk_id, so the migration can be safely repeated.
+        :return: number of loaded rows
+        """
+        m = DBMigration(db_path)
+        total = 0
+        started = time.perf_counter()
+        with m.bulk_load():
+            for chunk in self.iter_rows(chunk_size):
+                m.add_users(chunk)
+                total += len(chunk)
+        elapsed = time.perf_counter() - started
+        print(f'{total} rows migrated in {elapsed:.1f} s ({total / max(elapsed, 1e-9):.0f} rows/sec).')
+        return total
+
+
+def form_rows(frame):
+    """Rows of a data frame as tuples of google_form values, empty cells as empty strings"""
+    columns = frame[list(FORM_COLUMNS)]
+    rows = columns.astype(object).where(columns.notna(), '').astype(str).itertuples(index=False, name=None)
+    return [normalize_ids(row) for row in rows]
+
+
+def normalize_ids(row):
+    """A google_form row with vk_id and send_to_id written the way the bot stores the VK IDs users send it"""
+    return (normalize_vk_id(row[0]) or row[0], normalize_vk_id(row[1]) or row[1]) + row[2:]
 
 
 if __name__ == "__main__":
+    metrics = Metrics()
+    metrics.instrument_class(DBMigration, 'db_query')
     generator = Generator()
     # ids = generator.get_people_from_doc()
     # pairs = generator.compare_people()
     # generator.write_pairs_to_table()
     generator.migrate_data_to_sqlite()
+    print(metrics.summary())
 
@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+"""Offline export of every participant's task letter from the database (Generator.generate_message).
+
+Pairs are joined with the receivers' form rows by one SQL self-join, streamed in chunks with fetchmany and
+rendered by config.render_task_message, the template the bot sends. Chunks are rendered in a process pool with a
+bounded number of chunks in flight, so memory use does not grow with the number of participants. Each worker writes
+its chunk itself, either as one file per sender in a folder or as one part of a chunked zip archive
+(messages.zip becomes messages-00001.zip, messages-00002.zip, ... with chunk_size letters each):
+
+    python -m scripts.letters [--db ./data/database.db] [--out ./messages | --zip ./messages.zip] [--workers N]
+"""
+import argparse
+import collections
+import concurrent.futures
+import os
+import re
+import sqlite3
+import time
+import zipfile
+
+from bot import config
+
+# every sender with the form row of their receiver; senders whose receiver is not in the form get NULLs
+sql_query_letters = """SELECT s.`vk_id`, s.`sent_to_id`, r.`name`, r.`address`, r.`post_index`, \
+ r.`new_year_attr`, r.`new_year_doings`, r.`best_gift`, r.`best_film`, r.`best_song`, r.`best_dish`, \
+ r.`best_flashback`, r.`decorations`, r.`rabbit_gift` FROM `google_form` AS s \
+ LEFT JOIN `google_form` AS r ON r.`vk_id` = s.`sent_to_id` ORDER BY s.`rowid`"""
+
+ExportStats = collections.namedtuple('ExportStats', 'letters unpaired seconds')
+
+_unsafe = re.compile(r'[^\w.-]')
+
+
+def file_name(vk_id):
+    """Name of a sender's letter file; VK IDs are screen names, anything else is replaced by '_'"""
+    return _unsafe.sub('_', vk_id) + '.txt'
+
+
+def letter(sender, receiver, wishes):
+    """Text of one exported letter: who sends to whom, then the task exactly as the bot sends it"""
+    return f'Отправитель: {sender} --> {receiver}\n\n{config.render_task_message(wishes)}'
+
+
+def part_name(archive, index):
+    """Path of part index (from 1) of a chunked archive: messages.zip -> messages-00001.zip"""
+    stem, ext = os.path.splitext(archive)
+    return f'{stem}-{index:05d}{ext or ".zip"}'
+
+
+def render_chunk(rows, out_dir=None, part=None):
+    """
+    Renders a chunk of rows of sql_query_letters and writes it; runs in the pool workers.
+    :param rows: rows of sql_query_letters with a receiver
+    :param out_dir: folder to write one file per letter to
+    :param part: path of the zip archive part to write the chunk to instead
+    :return: number of written letters
+    """
+    if part is not None:
+        with zipfile.ZipFile(part, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for row in rows:
+                zf.writestr(file_name(row[0]), letter(row[0], row[1], row[2:]))
+    else:
+        for row in rows:
+            with open(os.path.join(out_dir, file_name(row[0])), 'w', encoding='utf_8_sig') as f:
+                f.write(letter(row[0], row[1], row[2:]))
+    return len(rows)
+
+
+def iter_chunks(db_path, chunk_size, unpaired):
+    """Streams rows of sql_query_letters in chunks; senders without a receiver row are appended to unpaired"""
+    connection = sqlite3.connect(db_path)
+    try:
+        cursor = connection.execute(sql_query_letters)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            chunk = []
+            for row in rows:
+                if row[2] is None:
+                    unpaired.append(row[0])
+                else:
+                    chunk.append(tuple('' if value is None else str(value) for value in row))
+            if chunk:
+                yield chunk
+    finally:
+        connection.close()
+
+
+def _render(chunks, out_dir, archive, workers):
+    """Results of render_chunk for every chunk in order, with at most 2 * workers chunks in flight"""
+    jobs = ((chunk, out_dir, None if archive is None else part_name(archive, index))
+            for index, chunk in enumerate(chunks, 1))
+    if workers <= 1:
+        for job in jobs:
+            yield render_chunk(*job)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(pool.submit(render_chunk, *job))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def export_letters(db_path='./data/database.db', out_dir='./messages', archive=None, workers=None, chunk_size=2000):
+    """
+    Renders the task letter of every sender in google_form.
+    :param db_path: database with the pairs, as written by Generator.write_pairs_to_table
+    :param out_dir: folder for one <vk_id>.txt per sender (created if missing); ignored when archive is given
+    :param archive: path of a chunked zip archive to write the letters to instead, one part per chunk
+    :param workers: rendering processes; None for one per CPU, 0 or 1 to render in this process
+    :param chunk_size: rows fetched and rendered at a time
+    :return: ExportStats with the number of letters, VK IDs of senders whose receiver is missing, and the time taken
+    """
+    started = time.perf_counter()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    unpaired = []
+    chunks = iter_chunks(db_path, chunk_size, unpaired)
+    if archive is None:
+        os.makedirs(out_dir, exist_ok=True)
+    total = sum(_render(chunks, out_dir, archive, workers))
+    return ExportStats(total, unpaired, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='./data/database.db')
+    parser.add_argument('--out', default='./messages', help='folder for one file per sender')
+    parser.add_argument('--zip', help='write a chunked zip archive instead of the folder')
+    parser.add_argument('--workers', type=int, help='rendering processes (default: one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='letters per chunk and per archive part')
+    args = parser.parse_args()
+
+    stats = export_letters(args.db, args.out, args.zip, args.workers, args.chunk_size)
+    print(f'{stats.letters} letters written to "{args.zip or args.out}" in {stats.seconds:.1f} s '
+          f'({stats.letters / max(stats.seconds, 1e-9):.0f} letters/sec).')
+    if stats.unpaired:
+        print(f'WARNING: {len(stats.unpaired)} senders have no receiver in the form, e.g. {stats.unpaired[0]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+"""Pairing engine for the Secret Santa: builds a single gift cycle over in-memory arrays.
+
+Participants are numbered 0..n-1. The result is an array `receivers` where participant i
+sends a gift to receivers[i]. The cycle is built from one random permutation, so every
+result is a derangement, and then locally repaired where it breaks an exclusion constraint.
+"""
+import numpy as np
+
+
+class PairingError(ValueError):
+    """Raised when no assignment satisfies the constraints"""
+
+
+def assign_pairs(n, previous=None, addresses=None, regions=None, seed=None, attempts=32, restarts=8):
+    """
+    Assigns every participant a receiver so that all participants form one cycle.
+    :param n: number of participants
+    :param previous: int array, last year's receiver of each participant (-1 if none), must not repeat
+    :param addresses: int array of address codes, participants with the same code never send to each other
+    :param regions: int array of non-negative region codes, receivers from the same region are preferred
+    :param seed: seed or numpy Generator for reproducible results
+    :param attempts: random swap attempts per violation before the exhaustive search
+    :param restarts: how many fresh permutations to try when a violation cannot be repaired
+    :return: int array of receivers
+    """
+    if n < 2:
+        raise PairingError('At least two participants are required.')
+    rng = np.random.default_rng(seed)
+    regions = None if regions is None else np.asarray(regions)
+    if regions is not None and len(regions) and regions.min() < 0:
+        # a code of -1 would silently rank as the last region
+        raise ValueError('Region codes must be non-negative.')
+    checker = _Constraints(previous, addresses)
+    for _ in range(restarts):
+        order = _cycle_order(n, rng, regions)
+        if _repair_all(order, checker, rng, regions, attempts):
+            result = np.empty(n, dtype=np.int64)
+            result[order] = np.roll(order, -1)
+            return result
+    raise PairingError('No assignment satisfies the constraints.')
+
+
+def _cycle_order(n, rng, regions):
+    """Random cycle order of participants; with regions, participants of one region go one after another"""
+    order = rng.permutation(n)
+    if regions is not None:
+        rank = rng.permutation(regions.max() + 1)
+        order = order[np.argsort(rank[regions[order]], kind='stable')]
+    return order
+
+
+def _repair_all(order, checker, rng, regions, attempts):
+    """Repairs every forbidden edge of the cycle in place, False if some edge cannot be repaired"""
+    n = len(order)
+    for k in np.flatnonzero(~checker.allowed(order, np.roll(order, -1))):
+        if checker.allowed_one(order[k], order[(k + 1) % n]):
+            continue
+        if not _repair(order, (k + 1) % n, checker, rng, regions, attempts):
+            return False
+    return True
+
+
+class _Constraints:
+    """Vectorised and scalar checks of the exclusion constraints"""
+
+    def __init__(self, previous, addresses):
+        self.previous = None if previous is None else np.asarray(previous)
+        self.addresses = None if addresses is None else np.asarray(addresses)
+
+    def allowed(self, senders, receivers):
+        ok = senders != receivers
+        if self.previous is not None:
+            ok &= self.previous[senders] != receivers
+        if self.addresses is not None:
+            ok &= self.addresses[senders] != self.addresses[receivers]
+        return ok
+
+    def allowed_one(self, sender, receiver):
+        if sender == receiver:
+            return False
+        if self.previous is not None and self.previous[sender] == receiver:
+            return False
+        if self.addresses is not None and self.addresses[sender] == self.addresses[receiver]:
+            return False
+        return True
+
+
+def _swap_is_allowed(order, a, b, checker):
+    """Checks the (up to four) cycle edges that change when positions a and b swap"""
+    n = len(order)
+    swapped = {a: order[b], b: order[a]}
+    for k in {(a - 1) % n, a, (b - 1) % n, b}:
+        sender = swapped.get(k, order[k])
+        receiver = swapped.get((k + 1) % n, order[(k + 1) % n])
+        if not checker.allowed_one(sender, receiver):
+            return False
+    return True
+
+
+def _repair(order, a, checker, rng, regions, attempts):
+    """
+    Swaps the participant at cycle position a with another one so that the edges around both become allowed.
+    Random candidates are tried first (from the same region when regions are given), then all positions.
+    """
+    n = len(order)
+    if regions is not None:
+        same = np.flatnonzero(regions[order] == regions[order[a]])
+        candidates = same[rng.integers(0, len(same), attempts)]
+    else:
+        candidates = rng.integers(0, n, attempts)
+    for b in candidates:
+        if b != a and _swap_is_allowed(order, a, b, checker):
+            break
+    else:
+        for b in rng.permutation(n):
+            if b != a and _swap_is_allowed(order, a, b, checker):
+                break
+        else:
+            return False
+    order[a], order[b] = order[b], order[a]
+    return True
+
+
+def is_derangement(receivers):
+    """True if receivers is a permutation without fixed points"""
+    receivers = np.asarray(receivers)
+    n = len(receivers)
+    return bool(np.array_equal(np.sort(receivers), np.arange(n)) and not np.any(receivers == np.arange(n)))
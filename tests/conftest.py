@@ -0,0 +1,9 @@
+# -*- coding: UTF-8 -*-
+"""The bot modules import each other by flat names (import config, from db import Database), as bot/main.py does;
+scripts/ import them as a package (from bot.db import DBMigration)"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+sys.path.insert(1, ROOT)
@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+"""BatchWriter groups concurrent writes into one transaction without letting one bad write fail the others;
+AsyncDatabase reads of a user wait for that user's writes still in the writer queue."""
+import asyncio
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from async_db import AsyncDatabase, BatchWriter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSERT_USER = "INSERT INTO `users` (`user_id`) VALUES (?)"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'database.db')
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+    return path
+
+
+def stored_users(db_path):
+    connection = sqlite3.connect(db_path)
+    users = [user_id for user_id, in connection.execute("SELECT `user_id` FROM `users` ORDER BY `user_id`")]
+    connection.close()
+    return users
+
+
+def test_concurrent_writes_share_a_transaction(db_path):
+    writer = BatchWriter(db_path, flush_interval=0.5)
+    futures = [writer.submit(INSERT_USER, (user_id,)) for user_id in range(1, 101)]
+    results = [future.result() for future in futures]
+    writer.close()
+    assert results == [1] * 100
+    assert (writer.stats.batches, writer.stats.max_batch_size) == (1, 100)
+    assert stored_users(db_path) == list(range(1, 101))
+
+
+def test_transactions_hold_at_most_max_batch_writes(db_path):
+    writer = BatchWriter(db_path, flush_interval=0.5, max_batch=10)
+    for future in [writer.submit(INSERT_USER, (user_id,)) for user_id in range(1, 36)]:
+        future.result()
+    writer.close()
+    assert (writer.stats.batches, writer.stats.operations, writer.stats.max_batch_size) == (4, 35, 10)
+
+
+def test_failed_transaction_is_retried_one_write_at_a_time(db_path):
+    writer = BatchWriter(db_path, flush_interval=0.5)
+    # user 2 twice: the second insert breaks the unique user_id index and takes the batch down with it
+    futures = [writer.submit(INSERT_USER, (user_id,)) for user_id in (1, 2, 2, 3)]
+    outcomes = [future.exception() or future.result() for future in futures]
+    writer.close()
+    assert outcomes[:2] == [1, 1] and outcomes[3] == 1
+    assert isinstance(outcomes[2], sqlite3.IntegrityError)
+    assert stored_users(db_path) == [1, 2, 3]
+
+
+def test_cancelled_writes_are_skipped(db_path):
+    writer = BatchWriter(db_path, flush_interval=0.5)
+    kept = writer.submit(INSERT_USER, (1,))
+    cancelled = writer.submit(INSERT_USER, (2,))
+    assert cancelled.cancel()
+    kept.result()
+    writer.close()
+    assert writer.stats.operations == 1
+    assert stored_users(db_path) == [1]
+
+
+def test_close_writes_the_rest_of_the_queue(db_path):
+    writer = BatchWriter(db_path, flush_interval=10)
+    futures = [writer.submit(INSERT_USER, (user_id,)) for user_id in range(1, 6)]
+    writer.close()
+    assert all(future.done() for future in futures)
+    assert stored_users(db_path) == list(range(1, 6))
+
+
+def test_reads_of_a_user_see_the_pending_writes(db_path):
+    async def run():
+        database = AsyncDatabase(db_path, flush_interval=0.3)
+        try:
+            await database.add_user(1)
+            await database.add_user(2)
+            # the writes sit in the writer queue for up to flush_interval
+            writes = asyncio.gather(database.set_signup(1, 'complete'), database.set_vk_id(1, 'durov'))
+            await asyncio.sleep(0)
+            assert 1 in database._pending
+            # another user does not wait for them
+            other = await database.get_signup(2), writes.done()
+            signup, vk_id = await database.get_signup(1), await database.get_vk_id(1)
+            await writes
+            return signup, vk_id, other, dict(database._pending)
+        finally:
+            database.close()
+
+    signup, vk_id, other, pending = asyncio.run(run())
+    assert (signup, vk_id) == ('complete', 'durov')
+    assert other == ('setvkid', False)
+    assert pending == {}
@@ -0,0 +1,31 @@
+# -*- coding: UTF-8 -*-
+"""A broadcast message that fails for any reason, not only a Telegram error, is counted as failed."""
+import asyncio
+
+import aiohttp
+import pytest
+from aiogram.utils.exceptions import BotBlocked
+
+from broadcast import Broadcaster
+
+
+class FailingSender:
+    def __init__(self, error):
+        self.error = error
+
+    async def send_message(self, chat_id, text, priority=None, **kwargs):
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.mark.parametrize('error', [BotBlocked('Forbidden: bot was blocked by the user'),
+                                   aiohttp.ClientConnectionError('Connection reset'),
+                                   asyncio.TimeoutError()])
+def test_failed_send_counts_as_failure(error):
+    broadcaster = Broadcaster(None, FailingSender(error), None)
+    assert asyncio.run(broadcaster._send('tracks', (1, 42, '12345678901234'))) is False
+
+
+def test_successful_send_counts_as_sent():
+    broadcaster = Broadcaster(None, FailingSender(None), None)
+    assert asyncio.run(broadcaster._send('tracks', (1, 42, '12345678901234'))) is True
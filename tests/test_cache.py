@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+"""GoogleFormCache reloads when the google_form triggers bump the table version and keeps at most max_size wishes;
+KnownUsers knows every user the bot has written."""
+import asyncio
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import db
+from async_db import AsyncDatabase
+from cache import GoogleFormCache, KnownUsers, TaskMessageCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARTICIPANTS = 20
+
+
+def form_row(i):
+    """Participant i (VK ID id<i + 1>) sends to the next one"""
+    return (f'id{i + 1}', f'id{(i + 1) % PARTICIPANTS + 1}', f'Participant {i}') + (f'wish {i}',) * 11
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'database.db')
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+    migration = db.DBMigration(path)
+    migration.add_users([form_row(i) for i in range(PARTICIPANTS)])
+    migration.connection.close()
+    return path
+
+
+def change_form(db_path, sql, params=()):
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.execute(sql, params)
+    connection.close()
+
+
+@pytest.mark.parametrize('sql, params', [
+    (db.sql_query_migrate, ('id100', 'id1') + form_row(0)[2:]),
+    ("UPDATE `google_form` SET `name` = ? WHERE `vk_id` = ?", ('Renamed', 'id2')),
+    ("DELETE FROM `google_form` WHERE `vk_id` = ?", ('id2',)),
+])
+def test_every_change_of_the_form_bumps_the_version(db_path, sql, params):
+    cache = GoogleFormCache(db_path)
+    version = cache.version
+    change_form(db_path, sql, params)
+    cache.invalidate()
+    assert cache.version == version + 1
+
+
+def test_changed_form_is_reloaded_after_check_interval(db_path, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = GoogleFormCache(db_path, check_interval=60)
+    assert cache.get_send_to_id('id1') == 'id2'
+    change_form(db_path, "UPDATE `google_form` SET `sent_to_id` = ? WHERE `vk_id` = ?", ('id100', 'id1'))
+    change_form(db_path, "DELETE FROM `google_form` WHERE `vk_id` = ?", ('id3',))
+    # within the interval the cache does not even look at the version
+    now[0] += 59
+    assert cache.get_send_to_id('id1') == 'id2' and cache.is_in_google_form('id3')
+    now[0] += 2
+    assert cache.get_send_to_id('id1') == 'id100'
+    assert cache.get_vk_sender_key('id100') == 'id1'
+    assert not cache.is_in_google_form('id3') and cache.get_google_form_columns('id3') == []
+
+
+def test_task_messages_are_dropped_with_the_form(db_path):
+    cache = GoogleFormCache(db_path, check_interval=0)
+    messages = TaskMessageCache(cache, lambda wishes: wishes[0], template_version=1)
+    assert messages.get('id1') == 'Participant 1'
+    change_form(db_path, "UPDATE `google_form` SET `name` = ? WHERE `vk_id` = ?", ('Renamed', 'id2'))
+    assert messages.get('id1') == 'Renamed'
+
+
+def test_wishes_are_bounded_by_max_size(db_path):
+    cache = GoogleFormCache(db_path, max_size=5)
+    for i in range(PARTICIPANTS):
+        assert cache.get_google_form_columns(f'id{i + 1}') == list(form_row(i)[2:])
+        assert len(cache._wishes) <= 5
+    # the least recently used row goes first
+    cache.get_google_form_columns('id16')
+    cache.get_google_form_columns('id1')
+    assert list(cache._wishes) == ['id18', 'id19', 'id20', 'id16', 'id1']
+    # pairs are still known in full
+    assert len(cache.vk_ids()) == PARTICIPANTS and cache.get_vk_sender_key('id1') == f'id{PARTICIPANTS}'
+
+
+def test_small_form_is_kept_in_full(db_path):
+    cache = GoogleFormCache(db_path, max_size=PARTICIPANTS)
+    assert len(cache._wishes) == PARTICIPANTS
+
+
+def test_known_users_are_loaded_and_grow(db_path):
+    change_form(db_path, "INSERT INTO `users` (`user_id`) VALUES (?)", (7,))
+    users = KnownUsers(db_path, merge_threshold=4)
+    assert 7 in users and 8 not in users
+    for user_id in range(100, 110):
+        users.add(user_id)
+    users.add(7)
+    assert len(users) == 11
+    assert all(user_id in users for user_id in range(100, 110))
+    assert list(users._sorted) == sorted(users._sorted)
+
+
+def test_added_user_is_known_without_a_query(db_path):
+    async def run():
+        database = AsyncDatabase(db_path)
+        try:
+            before = 42 in database.known_users
+            added = await database.add_user(42)
+            again = await database.add_user(42)
+            return before, added, again, 42 in database.known_users
+        finally:
+            database.close()
+
+    assert asyncio.run(run()) == (False, True, False, True)
+    # and a restarted bot loads it
+    assert 42 in KnownUsers(db_path)
@@ -0,0 +1,149 @@
+# -*- coding: UTF-8 -*-
+"""SQLiteStorage: dialogs survive a restart, changes reach the database in one transaction per flush, abandoned
+dialogs expire."""
+import asyncio
+import os
+import shutil
+import sqlite3
+import types
+
+import pytest
+
+import fsm_storage
+from fsm_storage import SQLiteStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'database.db')
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+    return path
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time() as seen by fsm_storage; tests move it forward by hand"""
+    now = types.SimpleNamespace(value=1_000_000.0)
+    monkeypatch.setattr(fsm_storage, 'time', types.SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def stored_rows(db_path):
+    connection = sqlite3.connect(db_path)
+    rows = connection.execute("SELECT `chat`, `user`, `state`, `data`, `bucket` FROM `fsm_storage` "
+                              "ORDER BY `chat`, `user`").fetchall()
+    connection.close()
+    return rows
+
+
+async def close(storage):
+    await storage.close()
+    await storage.wait_closed()
+
+
+def test_dialogs_survive_a_restart(db_path):
+    async def run():
+        storage = SQLiteStorage(db_path, flush_interval=60)
+        await storage.set_state(chat=1, user=1, state='Registration:vk_id')
+        await storage.update_data(chat=1, user=1, data={'vk_id': 'durov'})
+        await storage.update_bucket(chat=1, user=1, sent=2)
+        await storage.set_state(chat=2, user=2, state='Registration:vk_id')
+        await storage.finish(chat=2, user=2)
+        await close(storage)
+
+        restarted = SQLiteStorage(db_path, flush_interval=60)
+        try:
+            return (await restarted.get_state(chat=1, user=1), await restarted.get_data(chat=1, user=1),
+                    await restarted.get_bucket(chat=1, user=1), await restarted.get_state(chat=2, user=2))
+        finally:
+            await close(restarted)
+
+    assert asyncio.run(run()) == ('Registration:vk_id', {'vk_id': 'durov'}, {'sent': 2}, None)
+    # a finished dialog leaves no row behind
+    assert [row[:3] for row in stored_rows(db_path)] == [('1', '1', 'Registration:vk_id')]
+
+
+def test_changes_are_flushed_in_one_transaction(db_path, monkeypatch):
+    saves = []
+    save = SQLiteStorage._save
+
+    def counting_save(self, rows, expired):
+        saves.append(len(rows))
+        save(self, rows, expired)
+
+    monkeypatch.setattr(SQLiteStorage, '_save', counting_save)
+
+    async def run():
+        storage = SQLiteStorage(db_path, flush_interval=60)
+        try:
+            for user in range(100):
+                for step in range(5):
+                    await storage.set_state(chat=user, user=user, state=f'Registration:step{step}')
+            before = stored_rows(db_path)
+            await storage.flush()
+            # nothing changed since the last flush: no transaction at all
+            await storage.flush()
+            return before
+        finally:
+            await close(storage)
+
+    assert asyncio.run(run()) == []
+    assert saves == [100]
+    assert {row[2] for row in stored_rows(db_path)} == {'Registration:step4'}
+
+
+def test_changes_are_flushed_periodically(db_path):
+    async def run():
+        storage = SQLiteStorage(db_path, flush_interval=0.05)
+        try:
+            await storage.set_state(chat=1, user=1, state='Tracker:track_number')
+            for _ in range(100):
+                if stored_rows(db_path):
+                    break
+                await asyncio.sleep(0.02)
+            return stored_rows(db_path)
+        finally:
+            await close(storage)
+
+    assert [row[:3] for row in asyncio.run(run())] == [('1', '1', 'Tracker:track_number')]
+
+
+def test_abandoned_dialogs_expire(db_path, clock):
+    async def run():
+        storage = SQLiteStorage(db_path, ttl=3600, flush_interval=60)
+        await storage.set_state(chat=1, user=1, state='Registration:vk_id')
+        await storage.set_state(chat=2, user=2, state='Registration:vk_id')
+        await storage.flush()
+        clock.value += 3000
+        # touching a dialog keeps it alive
+        await storage.update_data(chat=2, user=2, vk_id='durov')
+        clock.value += 1000
+        expired = await storage.get_state(chat=1, user=1), await storage.get_data(chat=1, user=1)
+        alive = await storage.get_state(chat=2, user=2)
+        await storage.flush()
+        rows = stored_rows(db_path)
+        await close(storage)
+        return expired, alive, rows
+
+    expired, alive, rows = asyncio.run(run())
+    assert expired == (None, {})
+    assert alive == 'Registration:vk_id'
+    assert [row[:2] for row in rows] == [('2', '2')]
+
+
+def test_expired_rows_are_not_loaded(db_path, clock):
+    async def run():
+        storage = SQLiteStorage(db_path, ttl=3600, flush_interval=60)
+        await storage.set_state(chat=1, user=1, state='Registration:vk_id')
+        await close(storage)
+        clock.value += 3601
+        restarted = SQLiteStorage(db_path, ttl=3600, flush_interval=60)
+        try:
+            return await restarted.get_state(chat=1, user=1), restarted.state_counts()
+        finally:
+            await close(restarted)
+
+    assert asyncio.run(run()) == (None, {})
+    assert stored_rows(db_path) == []
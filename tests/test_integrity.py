@@ -0,0 +1,133 @@
+# -*- coding: UTF-8 -*-
+"""check_pairs against a plain Python check on random events, with VK IDs read as numbers and as strings."""
+import os
+import random
+import shutil
+import sqlite3
+
+import pytest
+
+import db
+import integrity
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_event(path, pairs, registered):
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executemany(db.sql_query_migrate, [(vk_id, sent_to) + ('',) * 12 for vk_id, sent_to in pairs])
+        connection.executemany("INSERT INTO `users` (`user_id`, `vk_id`) VALUES (?, ?)",
+                               ((user_id, vk_id) for user_id, vk_id in enumerate(registered, 1)))
+    connection.close()
+    return path
+
+
+def expected_report(pairs, registered):
+    vk_ids = [vk_id for vk_id, _ in pairs]
+    received = {vk_id: 0 for vk_id in vk_ids}
+    for _, sent_to in pairs:
+        if sent_to in received:
+            received[sent_to] += 1
+    counts = {}
+    for vk_id in registered:
+        counts[vk_id] = counts.get(vk_id, 0) + 1
+    report = {
+        'missing_receivers': {vk_id for vk_id, sent_to in pairs if sent_to not in received},
+        'shared_receivers': {vk_id for vk_id, count in received.items() if count > 1},
+        'unsent': {vk_id for vk_id, count in received.items() if not count},
+        'fixed_points': {vk_id for vk_id, sent_to in pairs if vk_id == sent_to},
+        'unknown_users': {vk_id for vk_id in counts if vk_id not in received},
+        'duplicate_registrations': {vk_id for vk_id, count in counts.items() if count > 1},
+    }
+    if report['missing_receivers'] or report['shared_receivers'] or report['unsent']:
+        report['cycles'] = None
+    else:
+        sent_to = dict(pairs)
+        seen, report['cycles'] = set(), 0
+        for vk_id in vk_ids:
+            if vk_id not in seen:
+                report['cycles'] += 1
+                while vk_id not in seen:
+                    seen.add(vk_id)
+                    vk_id = sent_to[vk_id]
+    return report
+
+
+def found_report(report):
+    found = {name: set(getattr(report, name)) for name in (
+        'missing_receivers', 'shared_receivers', 'unsent', 'fixed_points', 'unknown_users',
+        'duplicate_registrations')}
+    found['cycles'] = report.cycles
+    return found
+
+
+def random_event(rng, participants, screen_names, faults):
+    vk_ids = [f'user.{i}' if rng.random() < screen_names else f'id{i + 1}' for i in range(participants)]
+    order = vk_ids[:]
+    rng.shuffle(order)
+    cut = rng.randrange(1, participants)
+    # one or two cycles over a random order
+    sent_to = {order[i]: order[(i + 1) % cut if i < cut else cut + (i + 1 - cut) % (participants - cut)]
+               for i in range(participants)}
+    registered = [vk_id for vk_id in vk_ids if rng.random() < 0.8]
+    for _ in range(faults):
+        kind = rng.randrange(4)
+        sender = rng.choice(vk_ids)
+        if kind == 0:
+            sent_to[sender] = rng.choice(vk_ids)
+        elif kind == 1:
+            sent_to[sender] = rng.choice(['nobody', 'id0', 'id01', f'id{participants + 5}'])
+        elif kind == 2:
+            registered.append(rng.choice(vk_ids))
+        else:
+            registered.append(rng.choice(['ghost', f'id{participants + 7}']))
+    return list(sent_to.items()), registered
+
+
+@pytest.mark.parametrize('screen_names', [0.0, 0.3])
+@pytest.mark.parametrize('faults', [0, 1, 5])
+def test_report_matches_a_plain_check(tmp_path, screen_names, faults):
+    for seed in range(10):
+        rng = random.Random(seed)
+        pairs, registered = random_event(rng, rng.randrange(2, 60), screen_names, faults)
+        path = make_event(str(tmp_path / f'{seed}.db'), pairs, registered)
+        report = integrity.check_pairs(path)
+        assert report.participants == len(pairs)
+        assert found_report(report) == expected_report(pairs, registered), seed
+
+
+def test_numeric_ids_are_reported_as_vk_ids(tmp_path):
+    pairs = [('id1', 'id1'), ('id2', 'id3'), ('id3', 'id2')]
+    report = integrity.check_pairs(make_event(str(tmp_path / 'database.db'), pairs, ['id3', 'id3', 'id4']))
+    assert report.fixed_points == ('id1',) and report.cycles == 2
+    assert report.duplicate_registrations == ('id3',) and report.unknown_users == ('id4',)
+
+
+def test_database_path_may_contain_uri_characters(tmp_path):
+    directory = tmp_path / 'event?2024#1 100%'
+    directory.mkdir()
+    pairs = [('id1', 'id2'), ('id2', 'id1')]
+    report = integrity.check_pairs(make_event(str(directory / 'database.db'), pairs, ['id1']))
+    assert report.ok and report.cycles == 1
+
+
+@pytest.mark.parametrize('text, numbers', [
+    ('id1\x1fid20\x1fid300', [1, 20, 300]),
+    ('id999999999999', [999999999999]),
+])
+def test_canonical_ids_are_read_as_numbers(text, numbers):
+    assert integrity._numeric_ids(text, text.count('\x1f') + 1).tolist() == numbers
+
+
+# none of these is a VK ID id<number>, though most of them parse to a number
+@pytest.mark.parametrize('text', ['id01', 'id0', 'id+1', 'id-1', 'id 1', 'id1 ', 'id1\x1fid', 'id1\x1fid1x',
+                                  'durov', 'id1\x1fdurov', 'ID1', 'id１', 'id99999999999999999999'])
+def test_other_ids_are_read_as_strings(text):
+    assert integrity._numeric_ids(text, text.count('\x1f') + 1) is None
+
+
+def test_empty_event(tmp_path):
+    report = integrity.check_pairs(make_event(str(tmp_path / 'database.db'), [], []))
+    assert (report.participants, report.cycles, report.ok, report.problems()) == (0, 0, True, [])
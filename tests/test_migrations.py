@@ -0,0 +1,91 @@
+# -*- coding: UTF-8 -*-
+"""Schema migrations bring a database written by an earlier version of the bot up to date."""
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import db
+from validators import normalize_vk_id
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# VK IDs as users typed them and as the form had them before they were normalized
+STORED_VK_IDS = ['Durov', ' durov2 ', '123', 'ID124', 'id125', '@Ivan.Petrov', 'vk.com/anna_k', 'https://vk.com/id126',
+                 'http://M.VK.COM/Olga/', 'vk.ru/127', 'm.vk.ru/boris']
+
+
+@pytest.fixture
+def database_at(tmp_path):
+    """Copy of the empty database migrated up to the given schema version"""
+    def migrate_to(version):
+        path = str(tmp_path / 'database.db')
+        shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+        connection = sqlite3.connect(path, isolation_level=None)
+        for statements in db.schema_migrations[:version]:
+            for statement in statements:
+                connection.execute(statement)
+        connection.execute(f'PRAGMA user_version = {version:d}')
+        return path, connection
+
+    return migrate_to
+
+
+def test_stored_vk_ids_are_normalized(database_at):
+    path, connection = database_at(6)
+    form_row = ('name', 'address', '101000', 'attr', 'doings', 'gift', 'film', 'song', 'dish', 'flashback',
+                'decorations', 0)
+    for user_id, vk_id in enumerate(STORED_VK_IDS, 1):
+        connection.execute("INSERT INTO `users` (`user_id`, `vk_id`, `signup`) VALUES (?, ?, 'complete')",
+                           (user_id, vk_id))
+        receiver = STORED_VK_IDS[user_id % len(STORED_VK_IDS)]
+        connection.execute(db.sql_query_migrate, (vk_id, receiver) + form_row)
+    connection.execute("INSERT INTO `users` (`user_id`) VALUES (?)", (len(STORED_VK_IDS) + 1,))
+    connection.close()
+
+    database = db.Database(path)
+    expected = [normalize_vk_id(vk_id) for vk_id in STORED_VK_IDS]
+    assert None not in expected
+    users = database.connection.execute("SELECT `vk_id` FROM `users` ORDER BY `user_id`").fetchall()
+    assert [vk_id for vk_id, in users] == expected + [None]
+    form = dict(database.connection.execute("SELECT `vk_id`, `sent_to_id` FROM `google_form`"))
+    assert form == {vk_id: expected[i % len(expected)] for i, vk_id in enumerate(expected, 1)}
+    database.close()
+
+
+def test_form_rows_that_normalize_to_the_same_vk_id_do_not_stop_the_migration(database_at):
+    path, connection = database_at(6)
+    form_row = ('name', 'address', '101000', 'attr', 'doings', 'gift', 'film', 'song', 'dish', 'flashback',
+                'decorations', 0)
+    connection.execute(db.sql_query_migrate, ('durov', 'id1') + form_row)
+    connection.execute(db.sql_query_migrate, ('Durov', '1') + form_row)
+    connection.close()
+
+    database = db.Database(path)
+    form = sorted(database.connection.execute("SELECT `vk_id`, `sent_to_id` FROM `google_form`"))
+    assert form == [('Durov', 'id1'), ('durov', 'id1')]
+    assert database.schema_version == len(db.schema_migrations)
+    database.close()
+
+
+def test_users_keep_the_covering_user_id_index(database_at):
+    path, connection = database_at(8)
+    connection.close()
+
+    database = db.Database(path)
+    indexes = {name for name, in database.connection.execute(
+        "SELECT `name` FROM `sqlite_master` WHERE `type` = 'index' AND `tbl_name` = 'users'")}
+    assert indexes == {'idx_users_user_id', 'idx_users_user_id_unique', 'idx_users_vk_id', 'idx_users_track_number'}
+    database.close()
+
+
+def test_covering_user_id_index_is_restored(database_at):
+    path, connection = database_at(8)
+    connection.execute("DROP INDEX `idx_users_user_id`")
+    connection.close()
+
+    database = db.Database(path)
+    columns = [name for _, _, name in database.connection.execute("PRAGMA index_info(`idx_users_user_id`)")]
+    assert columns == ['user_id', 'signup', 'vk_id', 'track_number']
+    database.close()
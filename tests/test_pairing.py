@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+"""assign_pairs builds one gift cycle without forbidden pairs; the generator feeds it missing values explicitly."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bot.integrity import count_cycles
+from scripts.generator import Generator, group_codes
+from scripts.pairing import PairingError, assign_pairs, is_derangement
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_result_is_one_cycle_without_forbidden_pairs(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 60))
+    addresses = rng.integers(0, n, n)
+    previous = np.roll(np.arange(n), 1)
+    regions = rng.integers(0, 5, n)
+    try:
+        receivers = assign_pairs(n, previous=previous, addresses=addresses, regions=regions, seed=rng)
+    except PairingError:
+        return
+    assert is_derangement(receivers) and count_cycles(receivers) == 1
+    assert not np.any(receivers == previous)
+    assert not np.any(addresses == addresses[receivers])
+
+
+def test_impossible_constraints_raise():
+    with pytest.raises(PairingError):
+        assign_pairs(3, addresses=[0, 0, 0], seed=0)
+
+
+def test_negative_region_codes_are_rejected():
+    with pytest.raises(ValueError):
+        assign_pairs(3, regions=[0, -1, 0], seed=0)
+
+
+def test_missing_values_get_their_own_codes():
+    values = pd.Series(['a', None, 'b', '', 'a', np.nan])
+    assert list(group_codes(values, missing_apart=True)) == [0, 2, 1, 3, 0, 4]
+    assert list(group_codes(values, missing_apart=False)) == [0, 2, 1, 2, 0, 2]
+    assert list(group_codes(pd.Series([None, None]), missing_apart=False)) == [0, 0]
+
+
+def test_participants_without_an_address_can_send_to_each_other(tmp_path):
+    table = tmp_path / 'data.xlsx'
+    pd.DataFrame({'vk_id': ['id1', 'id2', 'id3', 'id4'], 'address': [None, None, None, 'Street 1'],
+                  'region': [None, 77, None, 77]}).to_excel(table, index=False)
+    pairs = Generator(str(table)).compare_people(seed=0)
+    assert sorted(pairs) == sorted(pairs.values()) == ['id1', 'id2', 'id3', 'id4']
+    assert all(sender != receiver for sender, receiver in pairs.items())
@@ -0,0 +1,252 @@
+# -*- coding: UTF-8 -*-
+"""Long polling against a local stub Bot API: no update that arrived while the bot was down is lost."""
+import asyncio
+import collections
+import os
+import shutil
+import sqlite3
+
+from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+import cluster
+import polling
+from async_db import AsyncDatabase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = '123456:' + 'A' * 35
+
+
+def message_update(update_id, user_id, text):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+        'chat': {'id': user_id, 'type': 'private'}}}
+
+
+class StubBotAPI:
+    """getUpdates that forgets everything below the offset, like Telegram, and a sendMessage that counts messages"""
+
+    def __init__(self):
+        self.pending = []
+        self.offsets = []
+        self.sent = collections.Counter()
+        self.next_id = 1
+        self.url = None
+        self._arrived = asyncio.Event()
+        self._runner = None
+
+    def add(self, user_id, text):
+        self.pending.append(message_update(self.next_id, user_id, text))
+        self.next_id += 1
+        self._arrived.set()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def handle(self, request):
+        data = dict(await request.post())
+        method = request.match_info['method']
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self.get_updates(data)})
+        if method == 'sendMessage':
+            self.sent[int(data['chat_id'])] += 1
+            return web.json_response({'ok': True, 'result': {
+                'message_id': 1, 'date': 0, 'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                'text': data.get('text')}})
+        return web.json_response({'ok': True, 'result': True})
+
+    async def get_updates(self, data):
+        offset = int(data['offset']) if 'offset' in data else None
+        self.offsets.append(offset)
+        if offset is not None:
+            self.pending = [item for item in self.pending if item['update_id'] >= offset]
+        if not self.pending and int(data.get('timeout', 0)):
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), int(data['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:int(data.get('limit', 100))]
+
+
+def make_workdir(path):
+    os.makedirs(path / 'data')
+    os.makedirs(path / 'logs')
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path / 'data' / 'database.db')
+
+
+def stored_boundary(path):
+    connection = sqlite3.connect(str(path / 'data' / 'database.db'))
+    meta = dict(connection.execute("SELECT `key`, `value` FROM `bot_meta` WHERE `key` LIKE 'update_%'"))
+    inbox, = connection.execute("SELECT COUNT(*) FROM `update_inbox`").fetchone()
+    connection.close()
+    return int(meta['update_offset']), int(meta['update_received']), inbox
+
+
+def point_at_stub(main):
+    """Runs in each cluster worker: Telegram is the stub at STUB_BOT_API, without rate limits"""
+    main.bot.server = TelegramAPIServer.from_base(os.environ['STUB_BOT_API'])
+    unlimited = float('inf')
+    main.sender._global.rate = main.sender._global.capacity = main.sender._global.tokens = unlimited
+    main.sender.chat_rate = main.sender.chat_burst = unlimited
+
+
+async def poll_cluster_until_answered(api, users):
+    bot = Bot(TOKEN, server=TelegramAPIServer.from_base(api.url))
+    nodes = cluster.Cluster('./data/database.db', workers=2, queue_size=100, setup=point_at_stub)
+    task = asyncio.create_task(cluster.poll(bot, nodes, timeout=1))
+    try:
+        for _ in range(600):
+            if all(api.sent[user_id] for user_id in users) or task.done():
+                break
+            await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await (await bot.get_session()).close()
+
+
+def test_cluster_polling_resumes_from_the_stored_boundary(tmp_path, monkeypatch):
+    make_workdir(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TOKEN', TOKEN)
+    monkeypatch.setenv('DEBOUNCE_SECONDS', '0')
+
+    async def run():
+        api = StubBotAPI()
+        await api.start()
+        monkeypatch.setenv('STUB_BOT_API', api.url)
+        try:
+            # pending before the first start, then arriving while the bot is down
+            for user_id in range(1, 11):
+                api.add(user_id, '/start')
+            await poll_cluster_until_answered(api, range(1, 11))
+            first = dict(api.sent), stored_boundary(tmp_path)
+            api.sent.clear()
+            api.offsets.clear()
+            for user_id in range(11, 21):
+                api.add(user_id, '/start')
+            await poll_cluster_until_answered(api, range(11, 21))
+            return first, dict(api.sent), api.offsets[0], stored_boundary(tmp_path)
+        finally:
+            await api.stop()
+
+    (first_sent, first_boundary), sent, first_offset, boundary = asyncio.run(run())
+    assert first_sent == {user_id: 1 for user_id in range(1, 11)}
+    assert first_boundary == (10, 10, 0)
+    assert first_offset == 11
+    assert sent == {user_id: 1 for user_id in range(11, 21)}
+    assert boundary == (20, 20, 0)
+
+
+class Recorder:
+    """Dispatcher that records handled messages; the handler of `hold` waits until `release` is set"""
+
+    def __init__(self, api, hold=None):
+        self.handled = []
+        self.hold = hold
+        self.release = asyncio.Event()
+        self.dispatcher = Dispatcher(Bot(TOKEN, server=TelegramAPIServer.from_base(api.url)))
+        self.dispatcher.register_message_handler(self.record)
+
+    async def record(self, message):
+        if message.message_id == self.hold:
+            await self.release.wait()
+        self.handled.append(message.message_id)
+
+    async def close(self):
+        await (await self.dispatcher.bot.get_session()).close()
+
+
+async def catch_up(recorder, database):
+    poller = polling.Poller(recorder.dispatcher, database, workers=2, timeout=1, save_interval=0.1)
+    task = asyncio.create_task(poller.run())
+    await asyncio.wait_for(poller.caught_up.wait(), 30)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await poller.close()
+
+
+def test_restart_resumes_from_the_saved_offset(tmp_path):
+    make_workdir(tmp_path)
+
+    async def run():
+        api = StubBotAPI()
+        await api.start()
+        database = AsyncDatabase(str(tmp_path / 'data' / 'database.db'))
+        recorder = Recorder(api)
+        try:
+            for n in range(30):
+                api.add(n % 5 + 1, str(n))
+            await catch_up(recorder, database)
+            first, recorder.handled = recorder.handled, []
+            api.offsets.clear()
+            for n in range(10):
+                api.add(n % 5 + 1, str(n))
+            await catch_up(recorder, database)
+            return first, recorder.handled, api.offsets[0]
+        finally:
+            await recorder.close()
+            database.close()
+            await api.stop()
+
+    first, second, first_offset = asyncio.run(run())
+    assert sorted(first) == list(range(1, 31))
+    for user in range(5):
+        assert [n for n in first if n % 5 == user] == sorted(n for n in first if n % 5 == user)
+    assert first_offset == 31
+    assert sorted(second) == list(range(31, 41))
+    assert stored_boundary(tmp_path) == (40, 40, 0)
+
+
+def test_crash_replays_only_unhandled_updates_from_the_inbox(tmp_path):
+    make_workdir(tmp_path)
+
+    async def run():
+        api = StubBotAPI()
+        await api.start()
+        database = AsyncDatabase(str(tmp_path / 'data' / 'database.db'))
+        # update 1 comes from user 1 and is held; users 1 and 3 share a queue, so update 3 waits behind it
+        recorder = Recorder(api, hold=1)
+        try:
+            for n in range(1, 21):
+                api.add((n - 1) % 4 + 1, str(n))
+            poller = polling.Poller(recorder.dispatcher, database, workers=2, timeout=1, save_interval=0.1)
+            task = asyncio.create_task(poller.run())
+            for _ in range(300):
+                if len(recorder.handled) == 10 and not api.pending:
+                    break
+                await asyncio.sleep(0.05)
+            before = list(recorder.handled)
+            # handled updates leave the inbox every save_interval
+            await asyncio.sleep(0.3)
+            # crash: nothing is finished or saved any more
+            for running in [task, poller._saver] + poller.updates._tasks:
+                running.cancel()
+            await asyncio.gather(task, poller._saver, *poller.updates._tasks, return_exceptions=True)
+            recorder.handled = []
+            recorder.hold = None
+            await catch_up(recorder, database)
+            return before, recorder.handled
+        finally:
+            await recorder.close()
+            database.close()
+            await api.stop()
+
+    before, replayed = asyncio.run(run())
+    # users 2 and 4 are handled before the crash, users 1 and 3 only after the restart
+    assert sorted(before) == [n for n in range(1, 21) if n % 2 == 0]
+    assert sorted(replayed) == [n for n in range(1, 21) if n % 2 == 1]
+    assert stored_boundary(tmp_path) == (20, 20, 0)
@@ -0,0 +1,66 @@
+# -*- coding: UTF-8 -*-
+"""Every query a handler runs must be served by an index: EXPLAIN QUERY PLAN shows no SCAN step."""
+import os
+import shutil
+
+import pytest
+
+import broadcast
+import db
+import fsm_storage
+import polling
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (query, parameters) of everything that runs on an update, by the handler path that runs it
+HANDLER_QUERIES = {
+    'add_user': (db.sql_query_add_user, {'user_id': 1}),
+    'user_exists': (db.sql_query_user_exists, (1,)),
+    'set_vk_id': (db.sql_query_set_vk_id, {'user_id': 1, 'vk_id': 'id1'}),
+    'set_signup': (db.sql_query_set_signup, {'user_id': 1, 'signup': 'complete'}),
+    'set_track_number': (db.sql_query_set_track_number, {'user_id': 1, 'tracker': '12345678901234'}),
+    'load_context': (db.sql_query_load_user, (1,)),
+    'load_context_sender': (db.sql_query_get_track_via_vk, ('id1',)),
+    'load_context_joined': (db.sql_query_load_context, (1,)),
+    'get_from_sheet': (db.sql_query_get_from_sheet, ('id1',)),
+    'get_meta': (db.sql_query_get_meta, ('update_offset',)),
+    'set_meta': (db.sql_query_set_meta, ('update_offset', 1)),
+    'store_update': (polling.sql_query_store_update, (1, '{}')),
+    'load_inbox': (polling.sql_query_load_inbox, (1,)),
+    'clear_update': (polling.sql_query_clear_update, (1,)),
+    'notify_track': (broadcast.sql_query_get_receiver, (1,)),
+    'save_state': (fsm_storage.sql_query_save_state, ('1', '1', '{}', '{}', 0.0, None)),
+    'delete_state': (fsm_storage.sql_query_delete_state, ('1', '1')),
+}
+
+
+@pytest.fixture(scope='module')
+def connection(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('schema') / 'database.db')
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+    database = db.Database(path)
+    yield database.connection
+    database.close()
+
+
+@pytest.mark.parametrize('name', sorted(HANDLER_QUERIES))
+def test_handler_query_uses_an_index(connection, name):
+    query, params = HANDLER_QUERIES[name]
+    plan = [row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + query, params)]
+    assert not [step for step in plan if step.startswith('SCAN')], plan
+
+
+# lookups of one user by user_id: (query, parameters, name of users in the plan)
+USER_ID_LOOKUPS = {
+    'load_context': (db.sql_query_load_user, (1,), 'users'),
+    'load_context_joined': (db.sql_query_load_context, (1,), 'u'),
+    'user_exists': (db.sql_query_user_exists, (1,), 'users'),
+}
+
+
+@pytest.mark.parametrize('name', sorted(USER_ID_LOOKUPS))
+def test_user_id_lookup_reads_only_the_index(connection, name):
+    query, params, table = USER_ID_LOOKUPS[name]
+    plan = [row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + query, params)]
+    step, = [step for step in plan if step.startswith(f'SEARCH {table} ')]
+    assert 'USING COVERING INDEX' in step, plan
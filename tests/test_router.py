@@ -0,0 +1,72 @@
+# -*- coding: UTF-8 -*-
+"""Router suppresses a repeated press of a debounced button and forgets one user's answers on request."""
+import asyncio
+
+from aiogram import types
+
+from db import UserContext
+from router import Router
+
+
+def message(user_id, text):
+    return types.Message.to_object({
+        'message_id': 1, 'date': 0, 'text': text,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+        'chat': {'id': user_id, 'type': 'private'}})
+
+
+def make_router(window):
+    answered = []
+
+    async def load_context(user_id):
+        return UserContext(signup='complete', vk_id=f'id{user_id}')
+
+    async def unregistered(msg):
+        answered.append((msg.from_user.id, 'unregistered'))
+
+    router = Router(load_context, unregistered, debounce_window=window)
+
+    @router.route('task', private=True, registered=True, debounce=True)
+    async def task(msg, context):
+        answered.append((msg.from_user.id, context.vk_id))
+
+    return router, answered
+
+
+def test_repeated_press_within_the_window_is_suppressed():
+    router, answered = make_router(60)
+
+    async def run():
+        for user_id in (1, 1, 2, 1):
+            await router.dispatch(message(user_id, 'task'))
+
+    asyncio.run(run())
+    assert answered == [(1, 'id1'), (2, 'id2')]
+    stats = router.debounce_stats
+    assert (stats.passed, stats.suppressed, stats.saved_reads, stats.saved_sends) == (2, 2, 2, 2)
+
+
+def test_forget_lets_only_that_user_press_again():
+    router, answered = make_router(60)
+
+    async def run():
+        await router.dispatch(message(1, 'task'))
+        await router.dispatch(message(2, 'task'))
+        router.forget(1)
+        await router.dispatch(message(1, 'task'))
+        await router.dispatch(message(2, 'task'))
+
+    asyncio.run(run())
+    assert answered == [(1, 'id1'), (2, 'id2'), (1, 'id1')]
+
+
+def test_zero_window_answers_every_press():
+    router, answered = make_router(0)
+
+    async def run():
+        for _ in range(3):
+            await router.dispatch(message(1, 'task'))
+
+    asyncio.run(run())
+    assert len(answered) == 3
+    assert router.debounce_stats.suppressed == 0
@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+"""SendScheduler keeps to Telegram's limits (30 messages/s overall, 1/s per chat) off the update handlers' path."""
+import asyncio
+import time
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.utils.exceptions import BadRequest
+
+from sender import SendScheduler
+from update_queue import UpdateQueue
+
+TOKEN = '123456:' + 'A' * 35
+
+
+class StubBot:
+    """Bot.send_message that records when each message left, or fails for the chats in fail"""
+
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = set(fail)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.fail:
+            raise BadRequest('Chat not found')
+        self.sent.append((chat_id, text, time.monotonic()))
+        return text
+
+
+def most_in_a_second(times):
+    return max(sum(start <= t < start + 1 for t in times) for start in times)
+
+
+def test_global_rate_is_30_messages_a_second():
+    bot = StubBot()
+
+    async def run():
+        sender = SendScheduler(bot)
+        await asyncio.gather(*(sender.send_message(chat_id, 'hi') for chat_id in range(61)))
+
+    asyncio.run(run())
+    times = [t for _, _, t in bot.sent]
+    assert len(times) == 61
+    assert most_in_a_second(times) <= 30
+    assert max(times) - min(times) >= 60 / 30 - 0.05
+
+
+def test_chat_rate_is_one_message_a_second_after_the_burst():
+    bot = StubBot()
+
+    async def run():
+        sender = SendScheduler(bot)
+        await asyncio.gather(*(sender.send_message(1, str(i)) for i in range(5)))
+
+    asyncio.run(run())
+    assert [text for _, text, _ in bot.sent] == ['0', '1', '2', '3', '4']
+    times = [t for _, _, t in bot.sent]
+    # three at once, then one a second: message k leaves no earlier than k - 2 seconds after the first
+    assert times[2] - times[0] < 0.5
+    assert all(times[k] - times[0] >= k - 2 - 0.05 for k in range(3, 5))
+    assert times[4] - times[3] >= 0.95
+
+
+def test_chatty_user_does_not_hold_up_others_on_the_same_shard():
+    bot = StubBot()
+
+    async def run():
+        sender = SendScheduler(bot)
+        dispatcher = Dispatcher(Bot(TOKEN))
+
+        async def echo(message):
+            await sender.reply(message.chat.id, message.text)
+
+        dispatcher.register_message_handler(echo)
+        queue = UpdateQueue(dispatcher, workers=1, maxsize=100)
+        queue.start()
+        started = time.monotonic()
+        for update_id, user_id in enumerate([1] * 10 + [2], 1):
+            await queue.put({'update_id': update_id, 'message': {
+                'message_id': update_id, 'date': 0, 'text': str(update_id),
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+                'chat': {'id': user_id, 'type': 'private'}}})
+        await queue.join()
+        handled = time.monotonic() - started
+        while not any(chat_id == 2 for chat_id, _, _ in bot.sent):
+            await asyncio.sleep(0.01)
+        answered = time.monotonic() - started
+        pending = sender.stats.waiting
+        await queue.close()
+        await (await dispatcher.bot.get_session()).close()
+        return handled, answered, pending
+
+    handled, answered, pending = asyncio.run(run())
+    assert handled < 0.5
+    assert answered < 0.5
+    assert pending >= 6  # user 1 is still being paced at 1 message a second
+
+
+def test_failures_reach_send_message_callers_and_the_stats():
+    bot = StubBot(fail={1})
+
+    async def run():
+        sender = SendScheduler(bot)
+        with pytest.raises(BadRequest):
+            await sender.send_message(1, 'lost')
+        await sender.reply(1, 'lost too')
+        await sender.reply(2, 'delivered')
+        await sender.join()
+        return sender.stats
+
+    stats = asyncio.run(run())
+    assert (stats.sent, stats.failed, stats.waiting) == (1, 2, 0)
+    assert [chat_id for chat_id, _, _ in bot.sent] == [2]
@@ -0,0 +1,209 @@
+# -*- coding: UTF-8 -*-
+"""TrackingService against a local stub tracking API: statuses are fetched once per TTL and every change is notified
+to the receiver of the parcel exactly once."""
+import asyncio
+import os
+import shutil
+import sqlite3
+import time
+
+import pytest
+from aiohttp import web
+
+import db
+import tracking
+from async_db import AsyncDatabase
+from sender import BULK
+from validators import domestic_check_digit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARTICIPANTS = 100
+BATCH_SIZE = 10
+
+
+def track_number(i):
+    digits = f'{i:013d}'
+    return digits + str(domestic_check_digit(digits))
+
+
+def receiver(i):
+    """user_id of whoever gets the parcel of participant i: everybody sends to the next one"""
+    return (i + 1) % PARTICIPANTS + 1
+
+
+class StubTrackingAPI:
+    """Batch status endpoint of the protocol HttpTrackingClient speaks; counts requests and their overlap"""
+
+    def __init__(self):
+        self.statuses = {}
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_next = 0
+        self.url = None
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/track', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}/track'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def handle(self, request):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            numbers = (await request.json())['numbers']
+            await asyncio.sleep(0.01)
+            if self.fail_next:
+                self.fail_next -= 1
+                return web.json_response({'error': 'unavailable'}, status=503)
+            return web.json_response({'parcels': [
+                {'number': number, 'status': status, 'description': description, 'final': final}
+                for number, (status, description, final) in ((n, self.statuses[n]) for n in numbers)]})
+        finally:
+            self.in_flight -= 1
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, priority=None, **kwargs):
+        self.sent.append((chat_id, text, priority))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Event of PARTICIPANTS in a single cycle, each registered with a track number"""
+    path = str(tmp_path / 'database.db')
+    shutil.copyfile(os.path.join(ROOT, 'data', 'database-empty.db'), path)
+    migration = db.DBMigration(path)
+    migration.add_users([(f'id{i + 1}', f'id{receiver(i)}') + ('',) * 12 for i in range(PARTICIPANTS)])
+    migration.connection.close()
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executemany(
+            "INSERT INTO `users` (`user_id`, `vk_id`, `signup`, `track_number`) VALUES (?, ?, 'complete', ?)",
+            ((i + 1, f'id{i + 1}', track_number(i)) for i in range(PARTICIPANTS)))
+    connection.close()
+    return path
+
+
+def run_with_service(db_path, scenario):
+    async def run():
+        api = StubTrackingAPI()
+        await api.start()
+        api.statuses = {track_number(i): ('accepted', 'Принято в отделении связи', False)
+                        for i in range(PARTICIPANTS)}
+        database = AsyncDatabase(db_path)
+        client = tracking.HttpTrackingClient(api.url, batch_size=BATCH_SIZE, concurrency=4)
+        sender = RecordingSender()
+        service = tracking.TrackingService(database, sender, client)
+        try:
+            await service.load()
+            return await scenario(api, service, sender)
+        finally:
+            await client.close()
+            database.close()
+            await api.stop()
+
+    return asyncio.run(run())
+
+
+def test_tracking_client_is_abstract():
+    with pytest.raises(TypeError):
+        tracking.TrackingClient()
+
+
+def test_first_poll_fetches_every_parcel_in_batches_without_notifying(db_path):
+    async def scenario(api, service, sender):
+        return await service.poll(), api.requests, api.max_in_flight, sender.sent
+
+    counts, requests, max_in_flight, sent = run_with_service(db_path, scenario)
+    assert counts == (PARTICIPANTS, 0, 0)
+    assert requests == PARTICIPANTS // BATCH_SIZE
+    assert max_in_flight <= 4
+    assert sent == []
+
+
+def test_poll_within_the_ttl_makes_no_requests(db_path):
+    async def scenario(api, service, sender):
+        await service.poll()
+        api.requests = 0
+        return await service.poll(), api.requests
+
+    assert run_with_service(db_path, scenario) == ((0, 0, 0), 0)
+
+
+def test_changed_statuses_notify_exactly_their_receivers(db_path):
+    moved = range(0, PARTICIPANTS, 10)
+
+    async def scenario(api, service, sender):
+        await service.poll()
+        for i in moved:
+            api.statuses[track_number(i)] = ('arrived', 'Прибыло в место вручения', False)
+        return await service.poll(ttl=0), sender.sent
+
+    (checked, changed, failed), sent = run_with_service(db_path, scenario)
+    assert changed == len(moved)
+    assert sorted(chat_id for chat_id, text, priority in sent) == sorted(receiver(i) for i in moved)
+    assert all(priority == BULK for chat_id, text, priority in sent)
+    assert any(track_number(0) in text and 'Прибыло' in text for chat_id, text, priority in sent)
+
+
+def test_parcels_with_a_final_status_are_not_polled_again(db_path):
+    delivered = range(5, PARTICIPANTS, 10)
+
+    async def scenario(api, service, sender):
+        await service.poll()
+        for i in delivered:
+            api.statuses[track_number(i)] = ('delivered', 'Вручено адресату', True)
+        await service.poll(ttl=0)
+        return await service.poll(ttl=0)
+
+    checked, changed, failed = run_with_service(db_path, scenario)
+    assert checked == PARTICIPANTS - len(delivered)
+
+
+def test_failed_batch_is_retried_by_the_next_poll(db_path):
+    async def scenario(api, service, sender):
+        await service.poll()
+        api.fail_next = 1
+        # the retry is due for whatever was checked before `before`, the failed batch only
+        before = time.time()
+        await asyncio.sleep(0.05)
+        first = await service.poll(ttl=0)
+        retried = await service.poll(ttl=time.time() - before)
+        return first, retried
+
+    (checked, changed, failed), (retried, _, _) = run_with_service(db_path, scenario)
+    assert (checked, failed) == (PARTICIPANTS, BATCH_SIZE)
+    assert retried == BATCH_SIZE
+
+
+def test_restarted_service_loads_the_stored_statuses(db_path):
+    async def scenario(api, service, sender):
+        await service.poll()
+        api.statuses[track_number(0)] = ('arrived', 'Прибыло в место вручения', False)
+        await service.poll(ttl=0)
+        restarted = tracking.TrackingService(service.db, RecordingSender(), service.client)
+        await restarted.load()
+        api.requests = 0
+        return restarted.statuses == service.statuses, len(restarted.statuses), api.requests
+
+    assert run_with_service(db_path, scenario) == (True, PARTICIPANTS, 0)
+    connection = sqlite3.connect(db_path)
+    changed, = connection.execute(
+        "SELECT COUNT(*) FROM `parcel_status` WHERE `changed_at` > (SELECT MIN(`changed_at`) FROM `parcel_status`)"
+    ).fetchone()
+    connection.close()
+    assert changed == 1
@@ -0,0 +1,77 @@
+# -*- coding: UTF-8 -*-
+"""normalize_vk_id and normalize_track_number, the checks the registration and tracker handlers run, on random input."""
+import random
+import re
+
+import pytest
+
+from validators import domestic_check_digit, normalize_track_number, normalize_vk_id, s10_check_digit
+
+# mostly harmless characters with every character the old checks forbade and some unicode mixed in
+ALPHABET = ('abcxyzABCXYZ0123456789_абвЁ' + "\\/@%&*^?!.,;:#№$~- ><+=)(`[]§" +
+            ''.join(map(chr, range(32))) + '\x7f  🎄')
+
+STORED_VK_ID = re.compile(r'id[1-9][0-9]{0,11}|[a-z][a-z0-9_.]{1,31}')
+
+
+def fuzz_strings(count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        length = rng.choice((0, 1, 2, 5, 13, 14, 14, 14, 15, 30))
+        clean = rng.random() < 0.5
+        yield ''.join(rng.choice(ALPHABET[:27] if clean else ALPHABET) for _ in range(length))
+
+
+def valid_track(track):
+    if re.fullmatch(r'[0-9]{14}', track):
+        return domestic_check_digit(track[:13]) == int(track[13])
+    if re.fullmatch(r'[A-Z]{2}[0-9]{9}[A-Z]{2}', track):
+        return s10_check_digit(track[2:10]) == int(track[10])
+    return False
+
+
+def test_vk_ids_are_stored_in_one_form():
+    for text in fuzz_strings(50000):
+        vk_id = normalize_vk_id(text)
+        if vk_id is not None:
+            assert STORED_VK_ID.fullmatch(vk_id), repr(text)
+            assert normalize_vk_id(vk_id) == vk_id, repr(text)
+
+
+def test_track_numbers_carry_a_valid_check_digit():
+    rng = random.Random(0)
+    for text in fuzz_strings(50000):
+        track = normalize_track_number(text)
+        assert track is None or valid_track(track), repr(text)
+    for _ in range(5000):
+        digits = ''.join(rng.choice('0123456789') for _ in range(13))
+        track = digits + str(domestic_check_digit(digits))
+        assert normalize_track_number(track) == track
+        assert normalize_track_number(track[:13] + str((int(track[13]) + 1) % 10)) is None
+        serial = ''.join(rng.choice('0123456789') for _ in range(8))
+        s10 = f'RA{serial}{s10_check_digit(serial)}RU'
+        assert normalize_track_number(s10.lower()) == s10
+
+
+@pytest.mark.parametrize('text, vk_id', [
+    ('durov', 'durov'), ('Durov', 'durov'), ('@durov', 'durov'), ('https://m.vk.com/durov/', 'durov'),
+    ('1', 'id1'), ('ID1', 'id1'), ('vk.ru/id1', 'id1'), (' katerina_legostaeva ', 'katerina_legostaeva')])
+def test_accepted_vk_ids(text, vk_id):
+    assert normalize_vk_id(text) == vk_id
+
+
+# 'Дуров', 'a' and 'id0' passed the old check, the rest never did
+@pytest.mark.parametrize('text', ['Дуров', 'a', 'id0', 'durov!', 'ok.ru/durov', ''])
+def test_rejected_vk_ids(text):
+    assert normalize_vk_id(text) is None
+
+
+# the old check accepted any 14 characters
+@pytest.mark.parametrize('text', ['12345678901234', 'ABCDEFGHIJKLMN', 'RA123456780RU', '8008527143454', ''])
+def test_rejected_track_numbers(text):
+    assert normalize_track_number(text) is None
+
+
+def test_accepted_track_numbers():
+    assert normalize_track_number('AA473124829GB') == 'AA473124829GB'
+    assert normalize_track_number('ra 123456785 ru') == 'RA123456785RU'
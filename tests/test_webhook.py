@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+"""Updates POSTed to the webhook route reach the dispatcher, in order per user, behind the secret and the queue."""
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook
+
+TOKEN = '123456:' + 'A' * 35
+
+
+def message_update(update_id, user_id, text):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+        'chat': {'id': user_id, 'type': 'private'}}}
+
+
+async def serve(handler, updates, headers=None, **kwargs):
+    """POSTs updates one by one to an app from build_app; returns the response statuses once all are handled"""
+    bot = Bot(TOKEN)
+    dispatcher = Dispatcher(bot)
+    dispatcher.register_message_handler(handler)
+    app = webhook.build_app(dispatcher, **kwargs)
+    try:
+        async with TestClient(TestServer(app)) as client:
+            statuses = []
+            for item in updates:
+                response = await client.post('/webhook', json=item, headers=headers or {})
+                statuses.append(response.status)
+            await app['updates'].join()
+    finally:
+        await (await bot.get_session()).close()
+    return statuses
+
+
+def test_posted_updates_are_dispatched_in_order_per_user():
+    handled = []
+
+    async def record(message):
+        handled.append((message.from_user.id, message.text))
+
+    updates = [message_update(i, i % 3 + 1, str(i)) for i in range(1, 31)]
+    statuses = asyncio.run(serve(record, updates, workers=2))
+    assert statuses == [200] * len(updates)
+    assert sorted(handled) == sorted((i % 3 + 1, str(i)) for i in range(1, 31))
+    for user_id in (1, 2, 3):
+        texts = [int(text) for sender, text in handled if sender == user_id]
+        assert texts == sorted(texts)
+
+
+def test_wrong_secret_token_is_rejected():
+    handled = []
+
+    async def record(message):
+        handled.append(message.text)
+
+    statuses = asyncio.run(serve(record, [message_update(1, 1, 'wrong')], secret_token='secret',
+                                 headers={'X-Telegram-Bot-Api-Secret-Token': 'guess'}))
+    assert statuses == [403]
+    statuses = asyncio.run(serve(record, [message_update(2, 1, 'right')], secret_token='secret',
+                                 headers={'X-Telegram-Bot-Api-Secret-Token': 'secret'}))
+    assert statuses == [200]
+    assert handled == ['right']
+
+
+def test_full_queue_asks_telegram_to_retry():
+    handled = []
+
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow(message):
+            started.set()
+            await release.wait()
+            handled.append(message.text)
+
+        bot = Bot(TOKEN)
+        dispatcher = Dispatcher(bot)
+        dispatcher.register_message_handler(slow)
+        app = webhook.build_app(dispatcher, workers=1, queue_size=1)
+        try:
+            async with TestClient(TestServer(app)) as client:
+                statuses = [(await client.post('/webhook', json=message_update(1, 1, '1'))).status]
+                await started.wait()
+                for i in (2, 3):
+                    statuses.append((await client.post('/webhook', json=message_update(i, 1, str(i)))).status)
+                release.set()
+                await app['updates'].join()
+        finally:
+            await (await bot.get_session()).close()
+        return statuses
+
+    assert asyncio.run(run()) == [200, 200, 503]
+    assert handled == ['1', '2']